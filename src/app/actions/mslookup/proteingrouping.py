@@ -1,46 +1,154 @@
 MZIDTSV_PEP_COL = 9
 MZIDTSV_PROT_COL = 10
 DB_STORE_CHUNK = 100000
+PARALLEL_BATCH = 100000
 
 from collections import OrderedDict
+from itertools import groupby, islice
+from operator import itemgetter
+from multiprocessing import Pool
+
+import numpy as np
 
 from app.readers import tsv as tsvreader
 from app.actions.mzidtsv import proteingroup_sorters as sorters
 
 
-def build_proteingroup_db(pgdb):
-    build_master_db(pgdb)
+def build_proteingroup_db(pgdb, workers=1):
+    build_master_db(pgdb, workers)
     build_coverage(pgdb)
-    build_content_db(pgdb)
+    build_content_db(pgdb, workers)
+
+
+def parallel_map(function, args, workers):
+    """Maps function over args, in a pool of processes when passing more than
+    one worker. Results are yielded in the order of args. Args are read in
+    batches in this process, since they may be generated from the lookup"""
+    if workers < 2:
+        yield from map(function, args)
+        return
+    with Pool(workers) as pool:
+        batch = list(islice(args, PARALLEL_BATCH))
+        while batch:
+            yield from pool.imap(function, batch,
+                                 max(1, len(batch) // (workers * 4)))
+            batch = list(islice(args, PARALLEL_BATCH))
 
 
-def build_master_db(pgdb):
+def build_master_db(pgdb, workers=1):
+    """Loads the protein-PSM graph once and determines master proteins per
+    connected component of it, in parallel when passing more than one
+    worker. Components are processed in the order the PSM-by-PSM algorithm
+    would reach them, so the masters and PSM-master mappings stored are
+    the same as when querying the DB for each PSM."""
+    graph = load_protein_psm_graph(pgdb)
+    component_masters = []
+    for masters in parallel_map(get_component_masters_star,
+                                generate_graph_components(graph), workers):
+        component_masters.extend(masters)
+    component_masters.sort(key=lambda x: x[0], reverse=True)
     psm_masters = OrderedDict()
     allmasters = {}
-    allpsms = {}
-    for psmid, protein in pgdb.get_all_psm_protein_relations():
+    for psm, master in ((graph['psm_ids'][psm], graph['proteins'][master])
+                        for _, pairs in component_masters
+                        for psm, master in pairs):
         try:
-            allpsms[psmid].append(protein)
+            psm_masters[psm].add(master)
         except KeyError:
-            allpsms[psmid] = [protein]
-    while len(allpsms) > 0:
-        psm_id, proteins = allpsms.popitem()
-        pepprotmap = pgdb.get_protpepmap_from_proteins(proteins)
-        masters = get_masters(pepprotmap)
-        for psm, master in [(p, m) for p, pmasters in masters.items()
-                            for m in pmasters]:
-            try:
-                psm_masters[psm].add(master)
-            except KeyError:
-                psm_masters[psm] = set([master])
-            allmasters[master] = 1
-            if psm in allpsms:
-                del(allpsms[psm])
+            psm_masters[psm] = set([master])
+        allmasters[master] = 1
     print('Collected {0} masters, {1} PSM-master mappings'.format(
         len(allmasters), len(psm_masters)))
     pgdb.store_masters(allmasters, psm_masters)
 
 
+def load_protein_psm_graph(pgdb):
+    """Reads all protein-PSM relations from the lookup and returns the
+    bipartite graph as two CSR adjacency arrays (PSM to proteins and protein
+    to PSMs) of integer indices. PSMs are numbered in order of appearance,
+    proteins in sorted accession order."""
+    psm_ids, proteins = {}, {}
+    edge_psms, edge_prots = [], []
+    for psm_id, protein in pgdb.get_all_psm_protein_relations():
+        edge_psms.append(psm_ids.setdefault(psm_id, len(psm_ids)))
+        edge_prots.append(proteins.setdefault(protein, len(proteins)))
+    accessions = sorted(proteins)
+    amount_psms, amount_prots = len(psm_ids), len(accessions)
+    prot_order = np.empty(amount_prots, dtype=np.int64)
+    prot_order[[proteins[acc] for acc in accessions]] = np.arange(
+        amount_prots, dtype=np.int64)
+    edges = np.unique(np.array(edge_psms, dtype=np.int64) * amount_prots +
+                      prot_order[np.array(edge_prots, dtype=np.int64)])
+    edge_psms, edge_prots = np.divmod(edges, max(amount_prots, 1))
+    by_prot = np.lexsort((edge_psms, edge_prots))
+    return {'psm_ids': list(psm_ids), 'proteins': accessions,
+            'psm_ptr': np.searchsorted(
+                edge_psms, np.arange(amount_psms + 1)).tolist(),
+            'psm_prots': edge_prots.tolist(),
+            'prot_ptr': np.searchsorted(edge_prots[by_prot], np.arange(
+                amount_prots + 1)).tolist(),
+            'prot_psms': edge_psms[by_prot].tolist(),
+            }
+
+
+def generate_graph_components(graph):
+    """Yields connected components of the protein-PSM graph as a list of
+    PSM indices and a dict of protein index to its PSM indices"""
+    psm_ptr, psm_prots = graph['psm_ptr'], graph['psm_prots']
+    prot_ptr, prot_psms = graph['prot_ptr'], graph['prot_psms']
+    seen = bytearray(len(psm_ptr) - 1)
+    for start in range(len(seen)):
+        if seen[start]:
+            continue
+        seen[start] = 1
+        component_psms, component_prots, stack = [start], {}, [start]
+        while stack:
+            psm = stack.pop()
+            for prot in psm_prots[psm_ptr[psm]:psm_ptr[psm + 1]]:
+                if prot in component_prots:
+                    continue
+                members = prot_psms[prot_ptr[prot]:prot_ptr[prot + 1]]
+                component_prots[prot] = members
+                for member in members:
+                    if not seen[member]:
+                        seen[member] = 1
+                        component_psms.append(member)
+                        stack.append(member)
+        yield component_psms, component_prots
+
+
+def get_component_masters_star(args):
+    return get_component_masters(*args)
+
+
+def get_component_masters(component_psms, component_prots):
+    """Determines masters for a connected component by visiting its PSMs in
+    reverse order of appearance. For each visited PSM, masters are found
+    among its proteins, and all PSMs of those proteins are marked as done.
+    Returns a list of (visited PSM, [(PSM, master), ...]) tuples."""
+    psm_proteins = {}
+    for prot, members in component_prots.items():
+        for psm in members:
+            try:
+                psm_proteins[psm].append(prot)
+            except KeyError:
+                psm_proteins[psm] = [prot]
+    protein_psms = {prot: frozenset(members)
+                    for prot, members in component_prots.items()}
+    remaining = set(component_psms)
+    component_masters = []
+    for psm in sorted(component_psms, reverse=True):
+        if psm not in remaining:
+            continue
+        masters = get_masters({prot: protein_psms[prot]
+                               for prot in psm_proteins[psm]})
+        remaining.difference_update(masters)
+        component_masters.append((psm, sorted(
+            (psm_id, master) for psm_id, pmasters in masters.items()
+            for master in pmasters)))
+    return component_masters
+
+
 def process_pgroup_candidates(candidates, protein_psm_map):
     prepgroup = {}
     for candidate in candidates:
@@ -52,7 +160,32 @@ def process_pgroup_candidates(candidates, protein_psm_map):
     return get_protein_group_content(pgroup, master)
 
 
-def build_content_db(pgdb):
+def process_master_group(candidates, protein_psm_map, use_evi):
+    """Returns protein group content and the new master for candidate
+    proteins of a master"""
+    pgroup = process_pgroup_candidates(candidates, protein_psm_map)
+    return pgroup, sorters.sort_to_get_master(pgroup, use_evi)
+
+
+def process_master_group_star(args):
+    return process_master_group(*args)
+
+
+def generate_master_candidates(pg_candidates):
+    """Yields lists of protein group candidates per master, candidates
+    are ordered by master"""
+    pre_protein_group, lastmaster = [], None
+    for protein_candidate in pg_candidates:
+        if protein_candidate[0] != lastmaster and pre_protein_group:
+            yield pre_protein_group
+            pre_protein_group = []
+        lastmaster = protein_candidate[0]
+        pre_protein_group.append(protein_candidate)
+    if pre_protein_group:
+        yield pre_protein_group
+
+
+def build_content_db(pgdb, workers=1):
     protein_psms = {}
     for prot, psm in pgdb.get_protein_psm_records():
         try:
@@ -60,22 +193,15 @@ def build_content_db(pgdb):
         except KeyError:
             protein_psms[prot] = set([psm])
     use_evi = pgdb.check_evidence_tables()
-    pg_candidates = pgdb.get_protein_group_candidates()
-    pre_protein_group = [next(pg_candidates)]
-    lastmaster = pre_protein_group[0][0]
+    groupargs = ((candidates, {cand[2]: protein_psms[cand[2]]
+                               for cand in candidates}, use_evi)
+                 for candidates in generate_master_candidates(
+                     pgdb.get_protein_group_candidates()))
     protein_groups, new_masters = [], {}
-    for protein_candidate in pg_candidates:
-        if protein_candidate[0] != lastmaster:
-            pgroup = process_pgroup_candidates(pre_protein_group, protein_psms)
-            new_master = sorters.sort_to_get_master(pgroup, use_evi)
-            new_masters[new_master['master_id']] = new_master['protein_acc']
-            protein_groups.extend(pgroup)
-            lastmaster, pre_protein_group = protein_candidate[0], []
-        pre_protein_group.append(protein_candidate)
-    pgroup = process_pgroup_candidates(pre_protein_group, protein_psms)
-    new_master = sorters.sort_to_get_master(pgroup, use_evi)
-    new_masters[new_master['master_id']] = new_master['protein_acc']
-    protein_groups.extend(pgroup)
+    for pgroup, new_master in parallel_map(process_master_group_star,
+                                           groupargs, workers):
+        new_masters[new_master['master_id']] = new_master['protein_acc']
+        protein_groups.extend(pgroup)
     protein_groups = [[pg[2], pg[1], pg[3], pg[4], pg[5]]
                       for pg in protein_groups]
     new_masters = ((acc, mid) for mid, acc in new_masters.items())
@@ -110,14 +236,8 @@ def filter_proteins_with_missing_psms(proteins, allprotein_psms):
 
 
 def build_coverage(pgdb):
-    coverage = {}
-    for acc, seq, psm_id, psmseq in pgdb.get_all_proteins_psms_seq():
-        try:
-            coverage[acc]['seq'] = seq
-        except KeyError:
-            coverage[acc] = {'seq': seq, 'psms': []}
-        coverage[acc]['psms'].append(psmseq)
-    pgdb.store_coverage(generate_coverage(coverage))
+    pgdb.store_coverage(generate_coverage(
+        pgdb.get_all_proteins_psms_seq()))
 
 
 def get_masters(ppgraph):
@@ -126,27 +246,21 @@ def get_masters(ppgraph):
     have no proteins whose peptides are supersets of them.
     If shared master proteins are found, report only the first,
     we will sort the whole proteingroup later anyway. In that
-    case, the master reported here may be temporary."""
-    masters = {}
+    case, the master reported here may be temporary.
+    Proteins with identical peptide sets are grouped first, so only
+    distinct sets are compared, largest first."""
+    pepsets = {}
     for protein, peps in ppgraph.items():
-        ismaster = True
-        peps = set(peps)
-        multimaster = set()
-        for subprotein, subpeps in ppgraph.items():
-            if protein == subprotein:
-                continue
-            if peps.issubset(subpeps):
-                if peps.union(subpeps) > peps:
-                    ismaster = False
-                    break
-                elif peps.intersection(subpeps) == peps:
-                    multimaster.update({protein, subprotein})
-        if not ismaster:
+        try:
+            pepsets[frozenset(peps)].append(protein)
+        except KeyError:
+            pepsets[frozenset(peps)] = [protein]
+    pepsets_by_size = sorted(pepsets, key=len, reverse=True)
+    masters = {}
+    for index, peps in enumerate(pepsets_by_size):
+        if any(peps < superset for superset in pepsets_by_size[:index]):
             continue
-        elif multimaster:
-            premaster = sorted(list(multimaster))[0]
-        else:
-            premaster = protein
+        premaster = min(pepsets[peps])
         for pep in peps:
             try:
                 masters[pep].add(premaster)
@@ -155,26 +269,37 @@ def get_masters(ppgraph):
     return masters
 
 
-def generate_coverage(seqinfo):
-    """From a dict containing protein accessions and sequences/PSM sequences,
-    this function returns a generator that calculates coverages for each
-    protein and returns the accession and coverage percentage.
-    Coverage is done by finding peptides in the protein seq using seq.index
-    and marking the range. May be slow."""
-    for acc, protinfo in seqinfo.items():
-        coverage_aa_indices = set()
-        seq = protinfo['seq']
-        for psmseq in protinfo['psms']:
-            psmseq = tsvreader.strip_modifications(psmseq)
-            # FIXME try block is for problems with coverage, see if it is
-            # needed
-            try:
-                start = seq.index(psmseq)
-            except:
+def generate_coverage(protein_psm_seqs):
+    """From (protein accession, protein sequence, PSM sequence) rows, sorted
+    by protein accession, this function returns a generator that calculates
+    coverages for each protein and returns the accession and coverage
+    percentage. Peptides are deduplicated per protein, and all their
+    occurrences in the protein sequence are marked as covered. Stripped
+    peptide sequences are cached over proteins."""
+    stripped_seqs = {}
+    for acc, rows in groupby(protein_psm_seqs, key=itemgetter(0)):
+        psmseqs = set()
+        for _, seq, psmseq in rows:
+            psmseqs.add(psmseq)
+        covered = bytearray(len(seq))
+        for pepseq in {get_stripped_sequence(psmseq, stripped_seqs)
+                       for psmseq in psmseqs}:
+            start = seq.find(pepseq)
+            if start == -1:
                 print('CANNOT FIND PSM seq {0} in seq {1} '
-                      'for acc {2}'.format(psmseq, seq, acc))
-            coverage_aa_indices.update(range(start, start + len(psmseq)))
-        yield (acc, len(coverage_aa_indices) / len(seq))
+                      'for acc {2}'.format(pepseq, seq, acc))
+            while start != -1:
+                covered[start:start + len(pepseq)] = b'\x01' * len(pepseq)
+                start = seq.find(pepseq, start + 1)
+        yield (acc, (len(seq) - covered.count(0)) / len(seq))
+
+
+def get_stripped_sequence(psmseq, stripped_seqs):
+    try:
+        return stripped_seqs[psmseq]
+    except KeyError:
+        stripped_seqs[psmseq] = tsvreader.strip_modifications(psmseq)
+        return stripped_seqs[psmseq]
 
 
 def get_protein_group_content(pgmap, master):
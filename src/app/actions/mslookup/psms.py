@@ -1,5 +1,3 @@
-from collections import OrderedDict
-
 from app.dataformats import mzidtsv as mzidtsvdata
 from app.readers import tsv as tsvreader
 from app.readers import fasta as fastareader
@@ -9,35 +7,92 @@ DB_STORE_CHUNK = 100000
 def create_psm_lookup(fn, fastafn, mapfn, header, pgdb, unroll=False,
                       specfncol=None, decoy=False,
                       fastadelim=None, genefield=None):
-    """Reads PSMs from file, stores them to a database backend in chunked PSMs.
+    """Reads PSMs from file in a single pass and stores peptide sequences,
+    PSMs, PSM rows and protein-PSM relations to a database backend in
+    chunks. Proteins are stored from FASTA beforehand when it is passed,
+    otherwise they are collected from the PSM table on the fly.
     """
-    proteins = store_proteins_descriptions(pgdb, fastafn, fn, mapfn, header,
-                                           decoy, fastadelim, genefield)
+    if fastafn:
+        proteins = store_fasta_proteins(pgdb, fastafn, mapfn, fastadelim,
+                                        genefield)
+    else:
+        proteins = False
     mzmlmap = pgdb.get_mzmlfile_map()
-    sequences = {}
-    for psm in tsvreader.generate_tsv_psms(fn, header):
-        seq = tsvreader.get_psm_sequence(psm, unroll)
-        sequences[seq] = 1
-    pgdb.store_pepseqs(((seq,) for seq in sequences))
-    pepseqmap = pgdb.get_peptide_seq_map()
-    psms = []
-    for row, psm in enumerate(tsvreader.generate_tsv_psms(fn, header)):
-        specfn, psm_id, scan, seq, score = tsvreader.get_psm(psm, unroll,
-                                                             specfncol)
-        if len(psms) % DB_STORE_CHUNK == 0:
-            pgdb.store_psms(psms)
-            psms = []
-        psms.append({'rownr': row,
-                     'psm_id': psm_id,
-                     'seq': pepseqmap[seq],
-                     'score': score,
-                     'specfn': mzmlmap[specfn],
-                     'scannr': scan,
-                     'spec_id': '{}_{}'.format(mzmlmap[specfn], scan),
-                     })
-    pgdb.store_psms(psms)
+    proteins = store_psms_proteins(fn, header, pgdb, mzmlmap, proteins,
+                                   unroll, specfncol)
+    pgdb.index_proteins()
+    if mapfn:
+        store_protein_gene_map(pgdb, mapfn, proteins, decoy)
     pgdb.index_psms()
-    store_psm_protein_relations(fn, header, pgdb, proteins)
+    pgdb.index_protein_peptides()
+
+
+def store_psms_proteins(fn, header, pgdb, mzmlmap, proteins, unroll,
+                        specfncol):
+    """Parses each PSM line once and passes new peptide sequences, PSMs,
+    PSM rows and protein-PSM relations to the database in chunks. Peptide
+    IDs are assigned here instead of by the database. When proteins is
+    False (no FASTA), proteins are stored as they are encountered.
+    Returns list of (protein,) tuples of proteins in lookup.
+    """
+    store_new_proteins = proteins is False
+    if store_new_proteins:
+        proteins = []
+    protein_set = set(x[0] for x in proteins)
+    pepseqmap = {}
+    last_pep_id = pgdb.get_highest_pep_id()
+    last_psm_id = pgdb.get_highest_psm_id() if pgdb.integer_keys else None
+    last_psm_key, psm_id = None, None
+    newprots, newseqs, psms, psmrows, protpsms = [], [], [], [], []
+    for row, psm in enumerate(tsvreader.generate_tsv_psms(fn, header)):
+        specfn, psm_key, scan, seq, score = tsvreader.get_psm(psm, unroll,
+                                                              specfncol)
+        if psm_key != last_psm_key:
+            # Unrolled PSM tables have one line per protein for a PSM
+            if pgdb.integer_keys:
+                last_psm_id += 1
+                psm_id = last_psm_id
+            else:
+                psm_id = psm_key
+            try:
+                pep_id = pepseqmap[seq]
+            except KeyError:
+                last_pep_id += 1
+                pep_id = pepseqmap[seq] = last_pep_id
+                newseqs.append((pep_id, seq))
+            psms.append({'psm_id': psm_id,
+                         'psm_key': psm_key,
+                         'seq': pep_id,
+                         'score': score,
+                         'specfn': mzmlmap[specfn],
+                         'scannr': scan,
+                         'spec_id': '{}_{}'.format(mzmlmap[specfn], scan),
+                         })
+            last_psm_key = psm_key
+        psmrows.append((psm_id, row))
+        for protein in tsvreader.get_proteins_from_psm(psm):
+            if protein not in protein_set:
+                if not store_new_proteins:
+                    continue
+                protein_set.add(protein)
+                newprots.append((protein,))
+            protpsms.append((protein, psm_id))
+        if len(psmrows) >= DB_STORE_CHUNK:
+            store_psm_chunk(pgdb, newprots, newseqs, psms, psmrows, protpsms)
+            proteins.extend(newprots)
+            newprots, newseqs, psms, psmrows, protpsms = [], [], [], [], []
+    store_psm_chunk(pgdb, newprots, newseqs, psms, psmrows, protpsms)
+    proteins.extend(newprots)
+    return proteins
+
+
+def store_psm_chunk(pgdb, proteins, sequences, psms, psmrows, protein_psms):
+    """Stores a chunk in order of foreign key dependencies"""
+    if proteins:
+        pgdb.store_proteins(proteins)
+    pgdb.store_pepseqs(sequences)
+    pgdb.store_psms(psms, psmrows)
+    pgdb.store_peptides_proteins(protein_psms)
 
 
 def get_protein_gene_map(mapfn, proteins, decoy):
@@ -53,68 +108,33 @@ def get_protein_gene_map(mapfn, proteins, decoy):
     return gpmap
 
 
-def store_proteins_descriptions(pgdb, fastafn, tsvfn, mapfn, header, decoy,
-                                fastadelim, genefield):
-    if not fastafn:
-        proteins = {}
-        for psm in tsvreader.generate_tsv_psms(tsvfn, header):
-            proteins.update({x: 1 for x in
-                             tsvreader.get_proteins_from_psm(psm)})
-        proteins = [(protein,) for protein in proteins.keys()]
-        pgdb.store_proteins(proteins)
-    else:
-        proteins, sequences, evidences = fastareader.get_proteins_for_db(
-            fastafn)
-        proteins = [x for x in proteins]
-        pgdb.store_proteins(proteins, evidences, sequences)
-        if not mapfn:
-            associations = fastareader.get_proteins_genes(fastafn, fastadelim,
-                                                          genefield)
-            genes, descriptions = [], []
-            for assoc in associations:
-                genes.append((assoc[1], assoc[0]))
-                descriptions.append((assoc[0], assoc[3]))
-            pgdb.store_descriptions(descriptions)
-            pgdb.store_genes(genes)
-    if mapfn:
-        proteins_with_versions = {}
-        for protein in proteins:
-            proteins_with_versions[protein[0].split('.')[0]] = protein
-        if decoy:
-            mod = fastareader.get_decoy_mod_string(proteins[0][0])
-            proteins_with_versions = {k.replace(mod, ''): v for k, v
-                                      in proteins_with_versions.items()}
-        gpmap = get_protein_gene_map(mapfn, proteins_with_versions, decoy)
-        pgdb.store_gene_and_associated_id(gpmap)
-    return set([x[0] for x in proteins])
+def store_fasta_proteins(pgdb, fastafn, mapfn, fastadelim, genefield):
+    """Stores proteins, sequences and evidence levels from FASTA, and genes
+    and descriptions when no map file is used. Returns stored proteins as
+    list of (protein,) tuples"""
+    proteins, sequences, evidences = fastareader.get_proteins_for_db(
+        fastafn)
+    proteins = [x for x in proteins]
+    pgdb.store_proteins(proteins, evidences, sequences)
+    if not mapfn:
+        associations = fastareader.get_proteins_genes(fastafn, fastadelim,
+                                                      genefield)
+        genes, descriptions = [], []
+        for assoc in associations:
+            genes.append((assoc[1], assoc[0]))
+            descriptions.append((assoc[0], assoc[3]))
+        pgdb.store_descriptions(descriptions)
+        pgdb.store_genes(genes)
+    return proteins
 
 
-def store_psm_protein_relations(fn, header, pgdb, proteins):
-    """Reads PSMs from file, extracts their proteins and peptides and passes
-    them to a database backend in chunks.
-    """
-    # TODO do we need an OrderedDict or is regular dict enough?
-    # Sorting for psm_id useful?
-    allpsms = OrderedDict()
-    last_id, psmids_to_store = None, set()
-    store_soon = False
-    for psm in tsvreader.generate_tsv_psms(fn, header):
-        psm_id, prots = tsvreader.get_pepproteins(psm)
-        prots = [x for x in prots if x in proteins]
-        try:
-            # In case the PSMs are presented unrolled
-            allpsms[psm_id].extend(prots)
-        except KeyError:
-            allpsms[psm_id] = prots
-        if len(psmids_to_store) % DB_STORE_CHUNK == 0:
-            store_soon = True
-        if store_soon and last_id != psm_id:
-            pgdb.store_peptides_proteins(allpsms, psmids_to_store)
-            store_soon = False
-            psmids_to_store = set()
-        psmids_to_store.add(psm_id)
-        last_id = psm_id
-    if len(psmids_to_store) > 0:
-        pgdb.store_peptides_proteins(allpsms, psmids_to_store)
-    pgdb.index_protein_peptides()
-    return allpsms
+def store_protein_gene_map(pgdb, mapfn, proteins, decoy):
+    proteins_with_versions = {}
+    for protein in proteins:
+        proteins_with_versions[protein[0].split('.')[0]] = protein
+    if decoy:
+        mod = fastareader.get_decoy_mod_string(proteins[0][0])
+        proteins_with_versions = {k.replace(mod, ''): v for k, v
+                                  in proteins_with_versions.items()}
+    gpmap = get_protein_gene_map(mapfn, proteins_with_versions, decoy)
+    pgdb.store_gene_and_associated_id(gpmap)
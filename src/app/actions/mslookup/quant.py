@@ -1,9 +1,14 @@
+from bisect import bisect_left
 from decimal import Decimal
+from multiprocessing import Pool
+
+import numpy as np
 
 from app.readers import openms as openmsreader
 DB_STORE_CHUNK = 500000
-FEATURE_ALIGN_WINDOW_AMOUNT = 1000
 PROTON_MASS = 1.0072
+# Minutes, for matching consensusXML retention times to spectra
+ISOQUANT_RT_TOLERANCE = 0.00001
 
 
 def create_isobaric_quant_lookup(quantdb, specfn_consensus_els, channelmap):
@@ -19,23 +24,57 @@ def create_isobaric_quant_lookup(quantdb, specfn_consensus_els, channelmap):
                        quantdb.get_channelmap()}
     quants = []
     mzmlmap = quantdb.get_mzmlfile_map()
+    last_specfn, matched, unmatched = None, 0, 0
     for specfn, consensus_el in specfn_consensus_els:
+        if specfn != last_specfn:
+            spec_rts, spec_ids = get_spectra_rt_map(quantdb, mzmlmap[specfn])
+            last_specfn = specfn
         rt = openmsreader.get_consxml_rt(consensus_el)
         rt = round(float(Decimal(rt) / 60), 12)
+        spectra_id = match_spectra_rt(spec_rts, spec_ids, rt,
+                                      ISOQUANT_RT_TOLERANCE)
+        if spectra_id is None:
+            unmatched += 1
+            continue
+        matched += 1
         qdata = get_quant_data(consensus_el)
-        spectra_id = quantdb.get_spectra_id(mzmlmap[specfn],
-                                            retention_time=rt)
         for channel_no in sorted(qdata.keys()):
             quants.append((spectra_id, channelmap_dbid[channel_no],
                            qdata[channel_no]))
             if len(quants) == DB_STORE_CHUNK:
                 quantdb.store_isobaric_quants(quants)
+                quants = []
     quantdb.store_isobaric_quants(quants)
     quantdb.index_isobaric_quants()
+    print('Stored isobaric quant data of {} consensus elements, {} elements '
+          'could not be matched to a spectrum'.format(matched, unmatched))
+
+
+def get_spectra_rt_map(quantdb, fn_id):
+    """Returns retention times and spectra ids of a spectra file as two
+    lists sorted on retention time"""
+    spec_rts, spec_ids = [], []
+    for rt, spectra_id in quantdb.get_spectra_rts_ids(fn_id):
+        spec_rts.append(rt)
+        spec_ids.append(spectra_id)
+    return spec_rts, spec_ids
+
+
+def match_spectra_rt(spec_rts, spec_ids, rt, tolerance):
+    """Binary searches sorted retention times for the spectrum closest to
+    rt, returns its id or None if it is not within tolerance"""
+    ix = bisect_left(spec_rts, rt)
+    candidates = [i for i in (ix - 1, ix) if 0 <= i < len(spec_rts)]
+    if not candidates:
+        return None
+    best = min(candidates, key=lambda i: abs(spec_rts[i] - rt))
+    if abs(spec_rts[best] - rt) > tolerance:
+        return None
+    return spec_ids[best]
 
 
 def create_precursor_quant_lookup(quantdb, mzmlfn_feats, quanttype,
-                                  rttol, mztol, mztoltype):
+                                  rttol, mztol, mztoltype, workers=1):
     """Fills quant sqlite with precursor quant from:
         features - generator of xml features from openms
     """
@@ -54,70 +93,106 @@ def create_precursor_quant_lookup(quantdb, mzmlfn_feats, quanttype,
             features = []
     quantdb.store_ms1_quants(features)
     quantdb.index_precursor_quants()
-    align_quants_psms(quantdb, rttol, mztol, mztoltype)
-
-
-def get_minmax(center, tolerance, toltype=None):
-    center = float(center)
-    if toltype == 'ppm':
-        tolerance = int(tolerance) / 1000000 * center
+    align_quants_psms(quantdb, rttol, mztol, mztoltype, workers)
+
+
+def align_quants_psms(quantdb, rt_tolerance, mz_tolerance, mz_toltype,
+                      workers=1):
+    """Aligns MS1 features to spectra of the same spectra file and charge.
+    Files are aligned in parallel when passing more than one worker,
+    alignments are stored in file order"""
+    fileargs = [(spectra, features, rt_tolerance, mz_tolerance, mz_toltype)
+                for spectra, features in get_spectra_features_per_file(
+                    quantdb)]
+    if workers > 1:
+        with Pool(workers) as pool:
+            store_file_alignments(quantdb, pool.imap(align_file_star,
+                                                     fileargs))
     else:
-        tolerance = float(tolerance)
-    return center - tolerance, center + tolerance
+        store_file_alignments(quantdb, map(align_file_star, fileargs))
 
 
-def align_quants_psms(quantdb, rt_tolerance, mz_tolerance, mz_toltype):
-    allspectra = quantdb.get_spectra_mz_sorted()
-    featwindow_max_mz = -1
+def store_file_alignments(quantdb, file_alignments):
     spec_feat_store = []
-    for spec_id, fn_id, charge, mz, rt in allspectra:
-        minmz, maxmz = get_minmax(mz, mz_tolerance, mz_toltype)
-        if maxmz > featwindow_max_mz:
-            feat_map, featwindow_max_mz = get_precursors_from_window(quantdb,
-                                                                     minmz)
-        best_feat_id = align_psm(mz, rt, fn_id, charge, feat_map, rt_tolerance)
-        if not best_feat_id:
-            continue
-        spec_feat_store.append((spec_id, best_feat_id))
+    for alignments in file_alignments:
+        spec_feat_store.extend(alignments)
         if len(spec_feat_store) > DB_STORE_CHUNK:
             quantdb.store_ms1_alignments(spec_feat_store)
             spec_feat_store = []
     quantdb.store_ms1_alignments(spec_feat_store)
 
 
-def align_psm(psm_mz, psm_rt, fn_id, charge, featmap, rttol):
-    minrt, maxrt = get_minmax(psm_rt, rttol / 60)
-    alignments = {}
+def get_spectra_features_per_file(quantdb):
+    """Generates for each spectra file a tuple of its spectra and its
+    features, both being dicts with charge keys and lists of
+    (id, mz, rt) values"""
+    allfeats = {}
+    for feat_id, fn_id, charge, mz, rt in quantdb.get_all_precursor_quants():
+        add_to_file_charge_map(allfeats, fn_id, charge, (feat_id, mz, rt))
+    allspectra = {}
+    for spec_id, fn_id, charge, mz, rt in quantdb.get_all_spectra():
+        add_to_file_charge_map(allspectra, fn_id, charge, (spec_id, mz, rt))
+    for fn_id in sorted(allspectra):
+        if fn_id in allfeats:
+            yield allspectra[fn_id], allfeats.pop(fn_id)
+
+
+def add_to_file_charge_map(fncharge_map, fn_id, charge, values):
     try:
-        featlist = featmap[fn_id][charge]
+        fncharge_map[fn_id][charge].append(values)
     except KeyError:
-        return False
-    for feat_mz, feat_rt, feat_id in featlist:
-        if abs(psm_rt - feat_rt) > rttol:
-            continue
-        alignments[abs(psm_mz - feat_mz)] = feat_id
-    try:
-        return alignments[min(alignments)]
-    except ValueError:
-        return False
-
-
-def get_precursors_from_window(quantdb, minmz):
-    """Returns a dict of a specified amount of features from the
-    ms1 quant database, and the highest mz of those features"""
-    featmap = {}
-    mz = False
-    features = quantdb.get_precursor_quant_window(FEATURE_ALIGN_WINDOW_AMOUNT,
-                                                  minmz)
-    for feat_id, fn_id, charge, mz, rt in features:
         try:
-            featmap[fn_id][charge].append((mz, rt, feat_id))
+            fncharge_map[fn_id][charge] = [values]
+        except KeyError:
+            fncharge_map[fn_id] = {charge: [values]}
+
+
+def align_file_star(args):
+    return align_file(*args)
+
+
+def align_file(spectra, features, rt_tolerance, mz_tolerance, mz_toltype):
+    """Aligns spectra of a single file with features of that file. Features
+    are sorted on m/z per charge, candidates for a spectrum are found by
+    binary search in its m/z window and filtered on retention time
+    (tolerance in seconds). The candidate closest in m/z is aligned.
+    Returns list of (spectra_id, feature_id)"""
+    alignments = []
+    rt_tolerance = rt_tolerance / 60
+    for charge, charge_spectra in sorted(spectra.items()):
+        try:
+            charge_feats = features[charge]
         except KeyError:
-            try:
-                featmap[fn_id][charge] = [(mz, rt, feat_id)]
-            except KeyError:
-                featmap[fn_id] = {charge: [(mz, rt, feat_id)]}
-    return featmap, mz
+            continue
+        charge_feats.sort(key=lambda x: x[1])
+        feat_ids = [x[0] for x in charge_feats]
+        feat_mzs = np.array([x[1] for x in charge_feats], dtype=np.float64)
+        feat_rts = np.array([x[2] for x in charge_feats], dtype=np.float64)
+        spec_mzs = np.array([x[1] for x in charge_spectra], dtype=np.float64)
+        minmzs, maxmzs = get_minmax(spec_mzs, mz_tolerance, mz_toltype)
+        starts = np.searchsorted(feat_mzs, minmzs, side='left')
+        ends = np.searchsorted(feat_mzs, maxmzs, side='right')
+        for (spec_id, mz, rt), start, end in zip(charge_spectra, starts,
+                                                 ends):
+            if start == end:
+                continue
+            rtmatch = np.abs(feat_rts[start:end] - rt) <= rt_tolerance
+            if not rtmatch.any():
+                continue
+            mzdiff = np.abs(feat_mzs[start:end] - mz)
+            mzdiff[~rtmatch] = np.inf
+            alignments.append((spec_id, feat_ids[start + mzdiff.argmin()]))
+    return alignments
+
+
+def get_minmax(center, tolerance, toltype=None):
+    """Returns lower and upper bounds of center, which can be a number or
+    a numpy array, with a tolerance in ppm or Da"""
+    if toltype == 'ppm':
+        tolerance = float(tolerance) / 1000000 * center
+    else:
+        tolerance = float(tolerance)
+    return center - tolerance, center + tolerance
 
 
 def kronik_featparser(feature):
@@ -1,9 +1,9 @@
-from Bio import SeqIO
+from app.readers import fasta as fastareader
 PROTEIN_STORE_CHUNK_SIZE = 100000
 
 
 def create_searchspace_wholeproteins(lookup, fastafn, minpeplen):
-    fasta = SeqIO.parse(fastafn, 'fasta')
+    fasta = fastareader.parse_fasta(fastafn)
     prots = {str(prot.seq).replace('L', 'I'): prot.id for prot in fasta}
     storeseqs = []
     peptotal = 0
@@ -26,7 +26,7 @@ def create_searchspace(lookup, fastafn, proline_cut=False,
     """Given a FASTA database, proteins are trypsinized and resulting peptides
     stored in a database or dict for lookups"""
     allpeps = []
-    for record in SeqIO.parse(fastafn, 'fasta'):
+    for record in fastareader.parse_fasta(fastafn):
         if do_trypsinize:
             pepseqs = trypsinize(record.seq, proline_cut)
         else:
@@ -40,7 +40,6 @@ def create_searchspace(lookup, fastafn, proline_cut=False,
     # write remaining peps to sqlite
     lookup.write_peps(allpeps, reverse_seqs)
     lookup.index_peps(reverse_seqs)
-    lookup.close_connection()
 
 
 def trypsinize(proseq, proline_cut=False):
@@ -1,8 +1,7 @@
 from app.actions.mzidtsv import confidencefilters as conffilt
-from app.readers import tsv as tsvreader
 
 
-def generate_psms(fn, header, confkey, conflvl, lower_is_better):
-    for psm in tsvreader.generate_tsv_psms(fn, header):
+def filter_psms(psms, confkey, conflvl, lower_is_better):
+    for psm in psms:
         if conffilt.passes_filter(psm, conflvl, confkey, lower_is_better):
             yield psm
@@ -1,100 +1,143 @@
 import sys
-from statistics import median, StatisticsError
-from collections import OrderedDict
+import tempfile
+from itertools import islice
+
+import numpy as np
 
 from app.dataformats import prottable as prottabledata
 from app.readers import tsv as reader
-from app.actions import isonormalizing
 
 
 ISOQUANTRATIO_FEAT_ACC = '##isoquant_target_acc##'
+MATRIX_CHUNK = 100000
+LOWMEM_CHUNK = 10000
 
 
 def get_isobaric_ratios(psmfn, psmheader, channels, denom_channels, min_int,
-                        targetfn, accessioncol, normalize, normratiofn):
+                        targetfn, accessioncol, normalize, normratiofn,
+                        lowmemory=False):
     """Main function to calculate ratios for PSMs, peptides, proteins, genes.
     Can do simple ratios, median-of-ratios and median-centering
-    normalization."""
-    psm_or_feat_ratios = get_psmratios(psmfn, psmheader, channels,
-                                       denom_channels, min_int, accessioncol)
+    normalization. Ratios are kept in a matrix of PSMs or features by
+    channels, with NaN for NA values."""
+    if lowmemory:
+        return generate_lowmem_psmratios(psmfn, psmheader, channels,
+                                         denom_channels, min_int, normalize,
+                                         normratiofn)
+    ratios, accessions, nopsms = get_psmratios(psmfn, psmheader, channels,
+                                               denom_channels, min_int,
+                                               accessioncol)
     if normalize and normratiofn:
         normheader = reader.get_tsv_header(normratiofn)
         normratios = get_ratios_from_fn(normratiofn, normheader, channels)
         ch_medians = get_medians(channels, normratios, report=True)
-        outratios = calculate_normalized_ratios(psm_or_feat_ratios, ch_medians,
-                                                channels)
+        ratios = calculate_normalized_ratios(ratios, ch_medians)
     elif normalize:
-        flatratios = [[feat[ch] for ch in channels]
-                      for feat in psm_or_feat_ratios]
-        ch_medians = get_medians(channels, flatratios, report=True)
-        outratios = calculate_normalized_ratios(psm_or_feat_ratios, ch_medians,
-                                                channels)
-    else:
-        outratios = psm_or_feat_ratios
-    # at this point, outratios look like:
-    # [{ch1: 123, ch2: 456, ISOQUANTRATIO_FEAT_ACC: ENSG1244}, ]
+        ch_medians = get_medians(channels, ratios, report=True)
+        ratios = calculate_normalized_ratios(ratios, ch_medians)
     if accessioncol and targetfn:
-        outratios = {x[ISOQUANTRATIO_FEAT_ACC]: x for x in outratios}
+        outratios = {acc: quants for acc, quants in zip(
+            accessions, generate_feature_quants(channels, ratios, nopsms))}
         return output_to_target_accession_table(targetfn, outratios, channels)
     elif not accessioncol and not targetfn:
-        return paste_to_psmtable(psmfn, psmheader, outratios)
+        return paste_to_psmtable(psmfn, psmheader, channels, ratios)
     elif accessioncol and not targetfn:
         # generate new table with accessions
-        return ({(k if not k == ISOQUANTRATIO_FEAT_ACC
-                  else prottabledata.HEADER_ACCESSION): v
-                 for k, v in ratio.items()} for ratio in outratios)
+        return ({prottabledata.HEADER_ACCESSION: acc, **quants}
+                for acc, quants in zip(accessions, generate_feature_quants(
+                    channels, ratios, nopsms)))
 
 
 def get_psmratios(psmfn, header, channels, denom_channels, min_int, acc_col):
-    allfeats, feat_order, psmratios = {}, OrderedDict(), []
-    for psm in reader.generate_tsv_psms(psmfn, header):
-        ratios = calc_psm_ratios(psm, channels, denom_channels, min_int)
-        # remove uninformative psms when adding to features
-        if acc_col and (psm[acc_col] == '' or ';' in psm[acc_col] or
-                        not {psm[q] for q in channels}.difference(
-                            {'NA', None, False, ''})):
-            continue
-        elif acc_col:
-            try:
-                allfeats[psm[acc_col]].append(ratios)
-            except KeyError:
-                allfeats[psm[acc_col]] = [ratios]
-            feat_order[psm[acc_col]] = 1
-        else:
-            psmquant = {ch: str(ratios[ix]) if ratios[ix] != 'NA' else 'NA'
-                        for ix, ch in enumerate(channels)}
-            psmquant[ISOQUANTRATIO_FEAT_ACC] = False
-            psmratios.append(psmquant)
+    """Returns a matrix of PSM ratios, or when passing an accession column,
+    a matrix of median PSM ratios per accession, the accessions and a
+    matrix of amounts of quantified PSMs per accession"""
+    feat_order, psmgroups = {}, []
+
+    def generate_psm_quants():
+        for psm in reader.generate_tsv_psms(psmfn, header):
+            quants = [psm[ch] for ch in channels]
+            # remove uninformative psms when adding to features
+            if acc_col and (psm[acc_col] == '' or ';' in psm[acc_col] or
+                            not set(quants).difference(
+                                {'NA', None, False, ''})):
+                continue
+            elif acc_col:
+                psmgroups.append(feat_order.setdefault(psm[acc_col],
+                                                       len(feat_order)))
+            yield quants
+    intensities = get_quant_matrix(generate_psm_quants(), len(channels))
+    ratios = calc_psm_ratios(intensities,
+                             [channels.index(ch) for ch in denom_channels],
+                             min_int)
     if not acc_col:
-        return psmratios
-    else:
-        outfeatures = []
-        for feat in feat_order.keys():
-            quants = allfeats[feat]
-            outfeature = {ISOQUANTRATIO_FEAT_ACC: feat}
-            outfeature.update(get_medians(channels, quants))
-            outfeature.update(get_no_psms(channels, quants))
-            outfeatures.append(outfeature)
-    return outfeatures
+        return ratios, False, False
+    medians, nopsms = get_grouped_medians(
+        ratios, np.array(psmgroups, dtype=np.int64), len(feat_order))
+    return medians, list(feat_order), nopsms
+
+
+def get_quant_matrix(quants, amount_channels):
+    """Parses lists of quant values into a float matrix, NA values
+    become NaN"""
+    chunks, chunk = [], []
+    for values in quants:
+        chunk.append([float(x) if x != 'NA' else np.nan for x in values])
+        if len(chunk) == MATRIX_CHUNK:
+            chunks.append(np.array(chunk, dtype=np.float64))
+            chunk = []
+    chunks.append(np.array(chunk, dtype=np.float64).reshape(
+        -1, amount_channels))
+    return np.concatenate(chunks)
 
 
 def get_ratios_from_fn(fn, header, channels):
-    ratios = []
-    for feat in reader.generate_tsv_psms(fn, header):
-        ratios.append([float(feat[ch]) if feat[ch] != 'NA' else 'NA'
-                       for ch in channels])
-    return ratios
+    return get_quant_matrix(([feat[ch] for ch in channels] for feat in
+                             reader.generate_tsv_psms(fn, header)),
+                            len(channels))
 
 
-def paste_to_psmtable(psmfn, header, ratios):
+def format_quants(values):
+    """Formats a row of quant values, NaN becomes NA. Single precision
+    values are formatted by NumPy to get their shortest representation"""
+    if values.dtype == np.float64:
+        values = values.tolist()
+    return [str(x) if x == x else 'NA' for x in values]
+
+
+def paste_to_psmtable(psmfn, header, channels, ratios):
     # loop psms in psmtable, paste the outratios in memory
+    ratiofields = ['ratio_{}'.format(ch) for ch in channels]
     for psm, ratio in zip(reader.generate_tsv_psms(psmfn, header), ratios):
-        ratio.pop(ISOQUANTRATIO_FEAT_ACC)
-        ratio = {'ratio_{}'.format(ch): val for ch, val in ratio.items()}
-        psm.update(ratio)
+        psm.update(zip(ratiofields, format_quants(ratio)))
+        yield psm
+
+
+def add_psm_ratios(psms, channels, denom_channels, min_int):
+    """Adds ratio fields to PSMs, for when no accessions or normalization
+    are involved and PSMs can be processed in independent chunks"""
+    psms = list(psms)
+    intensities = get_quant_matrix(([psm[ch] for ch in channels]
+                                    for psm in psms), len(channels))
+    ratios = calc_psm_ratios(intensities,
+                             [channels.index(ch) for ch in denom_channels],
+                             min_int)
+    ratiofields = ['ratio_{}'.format(ch) for ch in channels]
+    for psm, ratio in zip(psms, ratios):
+        psm.update(zip(ratiofields, format_quants(ratio)))
         yield psm
 
 
+def generate_feature_quants(channels, ratios, nopsms):
+    """Yields dicts of median ratios and amount of quantified PSMs
+    per channel for each feature"""
+    nopsms_fields = [get_no_psms_field(ch) for ch in channels]
+    for ratio, amounts in zip(ratios, nopsms):
+        quants = dict(zip(channels, format_quants(ratio)))
+        quants.update(zip(nopsms_fields, amounts.tolist()))
+        yield quants
+
+
 def output_to_target_accession_table(targetfn, featratios, channels):
     #loop prottable, add ratios from dict, acc = key
     theader = reader.get_tsv_header(targetfn)
@@ -105,91 +148,245 @@ def output_to_target_accession_table(targetfn, featratios, channels):
         except KeyError:
             quants = {ch: 'NA' for ch in channels}
             quants.update({get_no_psms_field(ch): 'NA' for ch in channels})
-        else:
-            quants.pop(ISOQUANTRATIO_FEAT_ACC)
         feat.update(quants)
         yield feat
 
 
-def calc_psm_ratios(psm, channels, denom_channels, min_intensity):
-    # set values below min_intensity to NA
-    psm_intensity = {ch: float(psm[ch])
-                     if psm[ch] != 'NA' and float(psm[ch]) > min_intensity
-                     else 'NA' for ch in channels}
-    denomvalues = [psm_intensity[ch] for ch in denom_channels
-                   if psm_intensity[ch] != 'NA']
-    if sum(denomvalues) == 0 or len(denomvalues) == 0:
-        return ['NA'] * len(channels)
-    denom = sum(denomvalues) / len(denomvalues)
-    return [psm_intensity[ch] / denom
-            if psm_intensity[ch] != 'NA' else 'NA' for ch in channels]
+def calc_psm_ratios(intensities, denom_ixs, min_intensity):
+    """Divides intensities by the mean of the denominator channels per
+    PSM. Values below min_intensity are set to NaN, PSMs without
+    denominator intensity get NaN ratios. Denominator values are summed
+    one column at a time to get the same sums as when adding them up per
+    PSM."""
+    with np.errstate(invalid='ignore'):
+        intensities = np.where(intensities > min_intensity, intensities,
+                               np.nan)
+    denomsum = np.zeros(len(intensities))
+    denomcount = np.zeros(len(intensities))
+    for ix in denom_ixs:
+        isquant = ~np.isnan(intensities[:, ix])
+        denomsum += np.where(isquant, intensities[:, ix], 0)
+        denomcount += isquant
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denom = denomsum / denomcount
+    denom[(denomsum == 0) | (denomcount == 0)] = np.nan
+    return intensities / denom[:, np.newaxis]
 
 
 def get_medians(channels, ratios, report=False):
-    ch_medians = {}
-    for ix, channel in enumerate(channels):
-        try:
-            ch_medians[channel] = median([x[ix] for x in ratios
-                                          if x[ix] != 'NA'])
-        except StatisticsError:
-            # channel is empty, common in protein quant but not in normalizing
-            ch_medians[channel] = 'NA'
+    """Returns channel medians of a ratio matrix, NaN for empty
+    channels, which is common in protein quant but not in normalizing"""
+    ch_medians = np.full(len(channels), np.nan)
+    hasquant = ~np.all(np.isnan(ratios), axis=0)
+    ch_medians[hasquant] = np.nanmedian(ratios[:, hasquant], axis=0)
     if report:
-        report = ('Channel intensity medians used for normalization:\n'
-                  '{}'.format('\n'.join(['{} - {}'.format(ch, ch_medians[ch])
-                                         for ch in channels])))
-        sys.stdout.write(report)
+        report_medians(channels, ch_medians)
     return ch_medians
 
 
+def report_medians(channels, ch_medians):
+    report = ('Channel intensity medians used for normalization:\n'
+              '{}'.format('\n'.join(['{} - {}'.format(ch, median)
+                                     for ch, median in zip(
+                                         channels,
+                                         format_quants(ch_medians))])))
+    sys.stdout.write(report)
+
+
+def get_grouped_medians(ratios, groups, amount_groups):
+    """Returns medians and amounts of non-NaN ratios per group and channel.
+    Ratios are sorted on group and value for each channel, NaN sorts
+    last within a group, so medians can be picked at the center of the
+    values of each group."""
+    medians = np.full((amount_groups, ratios.shape[1]), np.nan)
+    group_order = np.argsort(groups, kind='stable')
+    group_sizes = np.bincount(groups, minlength=amount_groups)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    nopsms = np.add.reduceat(~np.isnan(ratios[group_order]),
+                             group_starts, axis=0) if len(groups) else \
+        np.zeros(medians.shape, dtype=np.int64)
+    for ch in range(ratios.shape[1]):
+        sorted_ratios = ratios[np.lexsort((ratios[:, ch], groups)), ch]
+        hasquant = nopsms[:, ch] > 0
+        starts, amounts = group_starts[hasquant], nopsms[hasquant, ch]
+        medians[hasquant, ch] = (
+            sorted_ratios[starts + (amounts - 1) // 2] +
+            sorted_ratios[starts + amounts // 2]) / 2
+    return medians, nopsms
+
+
 def get_no_psms_field(quantfield):
     return '{}{}'.format(quantfield, prottabledata.HEADER_NO_PSMS_SUFFIX)
 
 
-def get_no_psms(channels, ratios):
-    ch_nopsms = {}
-    for ix, channel in enumerate(channels):
-        fieldname = get_no_psms_field(channel)
-        ch_nopsms[fieldname] = len([x[ix] for x in ratios if x[ix] != 'NA'])
-    return ch_nopsms
+def calculate_normalized_ratios(ratios, ch_medians):
+    """Normalizes a ratio matrix by channel medians"""
+    return ratios / ch_medians
 
 
-def calculate_normalized_ratios(ratios, ch_medians, channels):
+def get_normalized_ratios(psmfn, header, channels, denom_channels,
+                          min_intensity, second_psmfn, secondheader,
+                          lowmemory=False):
     """Calculates ratios for PSM tables containing isobaric channels with
     raw intensities. Normalizes the ratios by median. NA values or values
     below min_intensity are excluded from the normalization."""
-    outratios = []
-    for quant in ratios:
-        quant.update({ch: str(quant[ch] / ch_medians[ch])
-                      if quant[ch] != 'NA' else 'NA' for ch in channels})
-        outratios.append(quant)
-    return outratios
+    if lowmemory:
+        return generate_lowmem_normalized_ratios(
+            psmfn, header, channels, denom_channels, min_intensity,
+            second_psmfn, secondheader)
+    return generate_normalized_ratios(psmfn, header, channels,
+                                      denom_channels, min_intensity,
+                                      second_psmfn, secondheader)
 
 
-def get_normalized_ratios(psmfn, header, channels, denom_channels,
-                          min_intensity, second_psmfn, secondheader):
-    """Calculates ratios for PSM tables containing isobaric channels with
-    raw intensities. Normalizes the ratios by median. NA values or values
-    below min_intensity are excluded from the normalization."""
-    ratios = []
+def generate_normalized_ratios(psmfn, header, channels, denom_channels,
+                               min_intensity, second_psmfn, secondheader):
+    denom_ixs = [channels.index(ch) for ch in denom_channels]
+    ratios = calc_psm_ratios(get_ratios_from_fn(psmfn, header, channels),
+                             denom_ixs, min_intensity)
     if second_psmfn is not None:
-        median_psmfn = second_psmfn
-        medianheader = secondheader
+        median_ratios = calc_psm_ratios(
+            get_ratios_from_fn(second_psmfn, secondheader, channels),
+            denom_ixs, min_intensity)
     else:
-        median_psmfn = psmfn
-        medianheader = header
-    for psm in reader.generate_tsv_psms(median_psmfn, medianheader):
-        ratios.append(calc_psm_ratios(psm, channels, denom_channels,
-                                      min_intensity))
-    ch_medians = isonormalizing.get_medians(channels, ratios)
-    report = ('Channel intensity medians used for normalization:\n'
-              '{}'.format('\n'.join(['{} - {}'.format(ch, ch_medians[ch])
-                                     for ch in channels])))
-    sys.stdout.write(report)
-    for psm in reader.generate_tsv_psms(psmfn, header):
-        psmratios = calc_psm_ratios(psm, channels, denom_channels,
-                                    min_intensity)
-        psm.update({ch: str(psmratios[ix] / ch_medians[ch])
-                    if psmratios[ix] != 'NA' else 'NA'
-                    for ix, ch in enumerate(channels)})
+        median_ratios = ratios
+    ch_medians = get_medians(channels, median_ratios, report=True)
+    normalized = calculate_normalized_ratios(ratios, ch_medians)
+    for psm, psmratios in zip(reader.generate_tsv_psms(psmfn, header),
+                              normalized):
+        psm.update(zip(channels, format_quants(psmratios)))
         yield psm
+
+
+def generate_lowmem_psmratios(psmfn, header, channels, denom_channels,
+                              min_int, normalize, normratiofn):
+    """Two pass PSM ratio calculation in bounded memory. The first pass
+    writes ratios to a temporary memory-mapped single precision matrix,
+    from which medians are taken. The second pass pastes (normalized)
+    ratios to the PSM table."""
+    denom_ixs = [channels.index(ch) for ch in denom_channels]
+    ratiofields = ['ratio_{}'.format(ch) for ch in channels]
+    with tempfile.TemporaryFile() as ratiofp:
+        ratios = write_ratio_memmap(ratiofp, psmfn, header, channels,
+                                    denom_ixs, min_int)
+        if normalize and normratiofn:
+            normheader = reader.get_tsv_header(normratiofn)
+            normratios = get_ratios_from_fn(normratiofn, normheader, channels)
+            ch_medians = get_medians(channels, normratios,
+                                     report=True).astype(np.float32)
+        elif normalize:
+            ch_medians = get_memmap_medians(channels, ratios, report=True)
+        else:
+            ch_medians = np.ones(len(channels), dtype=np.float32)
+        for psm, ratio in zip(reader.generate_tsv_psms(psmfn, header),
+                              generate_normalized_rows(ratios, ch_medians)):
+            psm.update(zip(ratiofields, format_quants(ratio)))
+            yield psm
+
+
+def generate_lowmem_normalized_ratios(psmfn, header, channels,
+                                      denom_channels, min_intensity,
+                                      second_psmfn, secondheader):
+    """Bounded memory variant of normalizing PSM ratios, see
+    generate_lowmem_psmratios"""
+    denom_ixs = [channels.index(ch) for ch in denom_channels]
+    with tempfile.TemporaryFile() as ratiofp, \
+            tempfile.TemporaryFile() as medianfp:
+        ratios = write_ratio_memmap(ratiofp, psmfn, header, channels,
+                                    denom_ixs, min_intensity)
+        if second_psmfn is not None:
+            median_ratios = write_ratio_memmap(medianfp, second_psmfn,
+                                               secondheader, channels,
+                                               denom_ixs, min_intensity)
+        else:
+            median_ratios = ratios
+        ch_medians = get_memmap_medians(channels, median_ratios, report=True)
+        for psm, psmratios in zip(reader.generate_tsv_psms(psmfn, header),
+                                  generate_normalized_rows(ratios,
+                                                           ch_medians)):
+            psm.update(zip(channels, format_quants(psmratios)))
+            yield psm
+
+
+def write_ratio_memmap(fp, psmfn, header, channels, denom_ixs, min_int):
+    """Calculates PSM ratios in chunks and writes them to a file as single
+    precision values. Returns the file memory-mapped as a matrix."""
+    quants = ([psm[ch] for ch in channels]
+              for psm in reader.generate_tsv_psms(psmfn, header))
+    intensities = get_quant_matrix(islice(quants, LOWMEM_CHUNK),
+                                   len(channels))
+    while len(intensities):
+        calc_psm_ratios(intensities, denom_ixs, min_int).astype(
+            np.float32).tofile(fp)
+        intensities = get_quant_matrix(islice(quants, LOWMEM_CHUNK),
+                                       len(channels))
+    fp.flush()
+    amount_psms = fp.tell() // (4 * len(channels))
+    if not amount_psms:
+        return np.empty((0, len(channels)), dtype=np.float32)
+    return np.memmap(fp, dtype=np.float32, mode='r',
+                     shape=(amount_psms, len(channels)))
+
+
+def generate_matrix_chunks(matrix):
+    for start in range(0, len(matrix), LOWMEM_CHUNK):
+        yield np.asarray(matrix[start:start + LOWMEM_CHUNK])
+
+
+def generate_normalized_rows(ratios, ch_medians):
+    for chunk in generate_matrix_chunks(ratios):
+        yield from chunk / ch_medians
+
+
+def get_memmap_medians(channels, ratios, report=False):
+    """Returns single precision channel medians of a (memory-mapped) ratio
+    matrix, reading it in chunks. NaN for empty channels."""
+    amounts = np.zeros(len(channels), dtype=np.int64)
+    for chunk in generate_matrix_chunks(ratios):
+        amounts += np.sum(~np.isnan(chunk), axis=0)
+    lower = select_ranked_values(ratios, (amounts - 1) // 2)
+    upper = select_ranked_values(ratios, amounts // 2)
+    ch_medians = np.where(amounts > 0, (lower + upper) / np.float32(2),
+                          np.nan).astype(np.float32)
+    if report:
+        report_medians(channels, ch_medians)
+    return ch_medians
+
+
+def select_ranked_values(matrix, ranks):
+    """Returns the value of passed rank (0 is lowest, NaN excluded) for
+    each column of a single precision matrix. Uses radix selection on
+    sortable integer keys of the values, with one pass over the matrix
+    for each of the four key bytes, most significant first."""
+    columns = np.arange(matrix.shape[1])
+    ranks = np.maximum(ranks, 0)
+    prefix = np.zeros(matrix.shape[1], dtype=np.uint32)
+    for shift in (24, 16, 8, 0):
+        histogram = np.zeros(len(columns) * 256, dtype=np.int64)
+        for chunk in generate_matrix_chunks(matrix):
+            keys = get_sortable_keys(chunk)
+            selected = ~np.isnan(chunk)
+            if shift < 24:
+                selected &= (keys >> (shift + 8)) == (prefix >> (shift + 8))
+            bins = columns * 256 + ((keys >> shift) & 0xFF)
+            histogram += np.bincount(bins[selected],
+                                     minlength=len(histogram))
+        cumulative = np.cumsum(histogram.reshape(len(columns), 256), axis=1)
+        keybyte = np.minimum(np.sum(cumulative <= ranks[:, np.newaxis],
+                                    axis=1), 255)
+        ranks = ranks - np.where(keybyte > 0,
+                                 cumulative[columns, keybyte - 1], 0)
+        prefix |= keybyte.astype(np.uint32) << shift
+    return get_values_from_keys(prefix)
+
+
+def get_sortable_keys(values):
+    """Maps single precision floats to unsigned integers of the same
+    order"""
+    bits = values.view(np.uint32)
+    return np.where(bits >> 31, ~bits, bits | np.uint32(0x80000000))
+
+
+def get_values_from_keys(keys):
+    bits = np.where(keys >> 31, keys & np.uint32(0x7fffffff), ~keys)
+    return bits.astype(np.uint32).view(np.float32)
@@ -0,0 +1,40 @@
+from multiprocessing import Pool
+from itertools import islice
+
+from app.readers import tsv as tsvreader
+from app.writers import tsv as tsvwriter
+
+WORKER_TRANSFORM = {}
+
+
+def generate_transformed_chunks(fn, header, outheader, transform,
+                                transform_args, workers):
+    """Runs a stateless per-PSM transform over a PSM table in parallel. The
+    table is split in byte ranges that end at a newline, each of which is
+    parsed, transformed and formatted to output lines by a worker process.
+    Yields the formatted chunks in table order. The transform is a
+    generator function taking an iterable of PSMs and transform_args, and
+    is passed to the workers once."""
+    ranges = iter(tsvreader.get_tsv_chunk_ranges(fn))
+    with Pool(workers, initializer=set_worker_transform,
+              initargs=(transform, transform_args)) as pool:
+        # Read a few ranges ahead only, so output chunks do not pile up
+        # when writing is slower than transforming
+        while True:
+            jobs = [(fn, header, outheader, start, end)
+                    for start, end in islice(ranges, workers * 2)]
+            if not jobs:
+                break
+            yield from pool.imap(transform_range, jobs)
+
+
+def set_worker_transform(transform, transform_args):
+    WORKER_TRANSFORM['transform'] = transform
+    WORKER_TRANSFORM['args'] = transform_args
+
+
+def transform_range(job):
+    fn, header, outheader, start, end = job
+    psms = tsvreader.generate_tsv_range_rows(fn, header, start, end)
+    outpsms = WORKER_TRANSFORM['transform'](psms, *WORKER_TRANSFORM['args'])
+    return ''.join(tsvwriter.generate_tsv_lines(outheader, outpsms))
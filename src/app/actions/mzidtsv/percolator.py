@@ -1,9 +1,8 @@
 from app.readers import mzidplus as readers
-from app.readers import tsv as tsvreader
 from app.dataformats import mzidtsv as mzidtsvdata
 
 
-def add_percolator_to_mzidtsv(mzidfn, tsvfn, multipsm, oldheader):
+def add_percolator_to_mzidtsv(mzidfn, psms, multipsm):
     """Takes a MSGF+ tsv and corresponding mzId, adds percolatordata
     to tsv lines. Generator yields the lines. Multiple PSMs per scan
     can be delivered, in which case rank is also reported.
@@ -30,11 +29,10 @@ def add_percolator_to_mzidtsv(mzidfn, tsvfn, multipsm, oldheader):
                 mzidpercomap[fn][scan] = {mzidpepmap[pepid]: percodata}
             except KeyError:
                 mzidpercomap[fn] = {scan: {mzidpepmap[pepid]: percodata}}
-    for line in tsvreader.generate_tsv_psms(tsvfn, oldheader):
-        outline = {k: v for k, v in line.items()}
-        fn = line[mzidtsvdata.HEADER_SPECFILE]
-        scan = line[mzidtsvdata.HEADER_SCANNR]
-        seq = line[mzidtsvdata.HEADER_PEPTIDE]
+    for outline in psms:
+        fn = outline[mzidtsvdata.HEADER_SPECFILE]
+        scan = outline[mzidtsvdata.HEADER_SCANNR]
+        seq = outline[mzidtsvdata.HEADER_PEPTIDE]
         outline.update(mzidpercomap[fn][scan][seq])
         yield outline
 
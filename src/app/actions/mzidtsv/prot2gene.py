@@ -12,11 +12,9 @@ def create_header(oldheader):
     return oldheader[:p_ix] + newfields + oldheader[p_ix:]
 
 
-def add_genes_to_psm_table(psmfn, oldheader, pgdb):
-    gpmap = pgdb.get_protein_gene_map()
-    for psm in tsvreader.generate_tsv_psms(psmfn, oldheader):
-        outpsm = {x: y for x, y in psm.items()}
-        proteins = tsvreader.get_proteins_from_psm(psm)
+def add_genes_to_psms(psms, gpmap):
+    for outpsm in psms:
+        proteins = tsvreader.get_proteins_from_psm(outpsm)
         outpsm[mzidtsvdata.HEADER_GENE] = ';'.join(get_genes(proteins, gpmap))
         symbols = get_symbols(proteins, gpmap)
         desc = get_descriptions(proteins, gpmap)
@@ -13,13 +13,12 @@ def get_all_proteins_from_unrolled_psm(rownr, pgdb):
     return pgdb.get_proteins_for_peptide([rownr])
 
 
-def generate_psms_with_proteingroups(fn, oldheader, newheader, pgdb,
-                                     unroll=False):
+def generate_psms_with_proteingroups(psms, pgdb, unroll=False):
     rownr = 0
     use_evi = pgdb.check_evidence_tables()
     all_protein_group_content = pgdb.get_all_psms_proteingroups(use_evi)
     protein = next(all_protein_group_content)
-    for psm in tsvreader.generate_tsv_psms(fn, oldheader):
+    for psm in psms:
         if unroll:
             psm_id = tsvreader.get_psm_id(psm)
             lineproteins = get_all_proteins_from_unrolled_psm(psm_id, pgdb)
@@ -43,15 +42,13 @@ def generate_psms_with_proteingroups(fn, oldheader, newheader, pgdb,
             psm_masters.append(master)
             psm_pg_proteins.append([protein[lookups.PROTEIN_ACC_INDEX]
                                     for protein in group])
-        outpsm = {mzidtsvdata.HEADER_MASTER_PROT: ';'.join(psm_masters),
-                  mzidtsvdata.HEADER_PG_CONTENT: ';'.join(
-                      [','.join([y for y in x]) for x in psm_pg_proteins]),
-                  mzidtsvdata.HEADER_PG_AMOUNT_PROTEIN_HITS: ';'.join(
-                      count_protein_group_hits(lineproteins, psm_pg_proteins))
-                  }
-        outpsm.update(psm)
+        psm.setdefault(mzidtsvdata.HEADER_MASTER_PROT, ';'.join(psm_masters))
+        psm.setdefault(mzidtsvdata.HEADER_PG_CONTENT, ';'.join(
+            [','.join([y for y in x]) for x in psm_pg_proteins]))
+        psm.setdefault(mzidtsvdata.HEADER_PG_AMOUNT_PROTEIN_HITS, ';'.join(
+            count_protein_group_hits(lineproteins, psm_pg_proteins)))
         rownr += 1
-        yield outpsm
+        yield psm
 
 
 def count_protein_group_hits(lineproteins, groups):
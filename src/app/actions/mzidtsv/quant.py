@@ -1,15 +1,13 @@
-from app.readers import tsv as readers
 from app.dataformats import mzidtsv as mzidtsvdata
 
 
-def generate_psms_quanted(quantdb, tsvfn, isob_header, oldheader,
-                          isobaric=False, precursor=False):
-    """Takes dbfn and connects, gets quants for each line in tsvfn, sorts
+def generate_psms_quanted(quantdb, psms, isob_header, isobaric=False,
+                          precursor=False):
+    """Takes dbfn and connects, gets quants for each PSM, sorts
     them in line by using keys in quantheader list."""
     allquants, sqlfields = quantdb.select_all_psm_quants(isobaric, precursor)
     quant = next(allquants)
-    for rownr, psm in enumerate(readers.generate_tsv_psms(tsvfn, oldheader)):
-        outpsm = {x: y for x, y in psm.items()}
+    for rownr, outpsm in enumerate(psms):
         if precursor:
             pquant = quant[sqlfields['precursor']]
             if pquant is None:
@@ -49,7 +47,7 @@ def get_full_and_isobaric_headers(oldheader, quantdb, isobaric=False,
     # is we're outputting a set, we should do this as a general method for tsv
     # driven stuff. then output here oldheader and new fields as tuple
     # FIXME Make sure header is in mass-order, not alphabetical as it is now
-    fullheader = oldheader
+    fullheader = oldheader[:]
     if precursor:
         fullheader += [mzidtsvdata.HEADER_PRECURSOR_QUANT]
     if isobaric:
@@ -1,4 +1,3 @@
-from app.readers import tsv as readers
 from app.dataformats import mzidtsv as mzidtsvdata
 
 
@@ -8,11 +7,9 @@ def create_header(oldheader, spectracol):
     return header
 
 
-def generate_psms_spectradata(lookup, tsvfn, oldheader):
-    psm_specdata = zip(enumerate(readers.generate_tsv_psms(tsvfn, oldheader)),
-                       lookup.get_exp_spectra_data_rows())
-    for (row, psm), specdata in psm_specdata:
-        outpsm = {x: y for x, y in psm.items()}
+def generate_psms_spectradata(lookup, psms):
+    psm_specdata = zip(enumerate(psms), lookup.get_exp_spectra_data_rows())
+    for (row, outpsm), specdata in psm_specdata:
         if row == int(specdata[0]):
             outpsm.update({mzidtsvdata.HEADER_SETNAME: specdata[1],
                            mzidtsvdata.HEADER_RETENTION_TIME: str(specdata[2]),
@@ -1,14 +1,26 @@
 from app.readers import tsv as tsvreader
+from app.readers.compressed import open_input
 from app.dataformats import mzidtsv as mzidtsvdata
 
+MERGE_COPY_CHUNK = 16777216
+
 
 def merge_mzidtsvs(fns, header):
+    """Checks that all files have the same header, then yields the PSM
+    lines of all files as large chunks of unparsed bytes"""
     for fn in fns:
         if header != tsvreader.get_tsv_header(fn):
             raise RuntimeError('Headers of TSV files to concatenate are '
                                'not identical')
-    for psm in tsvreader.generate_tsv_lines_multifile(fns, header):
-        yield psm
+    for fn in fns:
+        with open_input(fn, 'rb') as fp:
+            fp.readline()
+            lastchunk = b'\n'
+            for chunk in iter(lambda: fp.read(MERGE_COPY_CHUNK), b''):
+                yield chunk
+                lastchunk = chunk
+            if not lastchunk.endswith(b'\n'):
+                yield b'\n'
 
 
 def get_splitcolnr(header, bioset, splitcol):
@@ -23,16 +35,24 @@ def get_splitcolnr(header, bioset, splitcol):
 
 
 def generate_psms_split(fn, oldheader, bioset, splitcol):
-    """Loops PSMs and outputs dictionaries passed to writer. Dictionaries
-    contain the PSMs and info to which split pool the
-    respective PSM belongs"""
+    """Loops PSM lines and yields tuples of the split pool the PSM belongs
+    to and the unparsed bytes of the line. Only the line up to the split
+    column is split to get the pool."""
     try:
         splitcolnr = get_splitcolnr(oldheader, bioset, splitcol)
-    except IndexError:
+    except ValueError:
         raise RuntimeError('Cannot find bioset header column in '
                            'input file {}, though --bioset has '
                            'been passed'.format(fn))
-    for psm in tsvreader.generate_tsv_psms(fn, oldheader):
-        yield {'psm': psm,
-               'split_pool': psm[oldheader[splitcolnr]]
-               }
+    with open_input(fn, 'rb') as fp:
+        fp.readline()
+        for line in fp:
+            fields = line.split(b'\t', splitcolnr + 1)
+            split_pool = fields[splitcolnr]
+            if len(fields) == splitcolnr + 1:
+                split_pool = split_pool.rstrip()
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            if splitcolnr == 0:
+                split_pool = split_pool.lstrip()
+            yield split_pool.decode(), line
@@ -1,9 +1,13 @@
+from itertools import islice
+
 from app.actions.pycolator import reassign as pyreassign
 from app.dataformats import prottable as prottabledata
 from app.dataformats import mzidtsv as mzidtsvdata
 from app.readers import tsv as reader
 from app.readers import fasta
 
+FDR_BATCH_SIZE = 100000
+
 
 def generate_protein_fdr(target, decoy, theader, dheader, headerfields):
     tproteins = [x for x in reader.generate_tsv_proteins(target, theader)
@@ -143,16 +147,28 @@ def pick_target_decoy(tfeature, dfeature):
 
 
 def add_protein_fdr(qvalityfn, proteins, headerfields, scorefield):
+    """Looks up q-values and PEPs for protein scores from qvality output,
+    in batches of proteins"""
     qvalityout = pyreassign.parse_qvality_output(qvalityfn)
     fdrheader = headerfields['proteinfdr'][prottabledata.HEADER_QVAL][None]
     pepheader = headerfields['proteinpep'][prottabledata.HEADER_PEP][None]
-    for protein in proteins:
-        outprotein = {k: v for k, v in protein.items()}
-        try:
-            score = round(float(outprotein[scorefield]), 5)
-        except ValueError:
-            qval, pep = 'NA', 'NA'
-        else:
-            qval, pep, warning = pyreassign.lookup_statistic(score, qvalityout)
-        outprotein.update({fdrheader: qval, pepheader: pep})
-        yield outprotein
+    proteins = iter(proteins)
+    batch = list(islice(proteins, FDR_BATCH_SIZE))
+    while batch:
+        scores, scored = [], []
+        for protein in batch:
+            try:
+                scores.append(round(float(protein[scorefield]), 5))
+            except ValueError:
+                scored.append(False)
+            else:
+                scored.append(True)
+        qvals, peps, warnings = pyreassign.lookup_statistics(scores,
+                                                             qvalityout)
+        stats = zip(qvals, peps)
+        for protein, is_scored in zip(batch, scored):
+            outprotein = {k: v for k, v in protein.items()}
+            qval, pep = next(stats) if is_scored else ('NA', 'NA')
+            outprotein.update({fdrheader: qval, pepheader: pep})
+            yield outprotein
+        batch = list(islice(proteins, FDR_BATCH_SIZE))
@@ -19,25 +19,29 @@ def filter_peptide_length(features, elementtype, ns, minlen=0, maxlen=None):
         maxlen = float('inf')
     else:
         maxlen = int(maxlen)
-    for feat in features:
+    for feat, raw in features:
         seq = get_either_seq(elementtype, feat, ns)
         seq = strip_modifications(seq)
+        formatting.clear_el(feat)
         if len(seq) >= minlen and len(seq) <= maxlen:
-            yield formatting.string_and_clear(feat, ns)
-        else:
-            formatting.clear_el(feat)
+            yield raw
 
 
 def strip_modifications(seq):
     return re.sub('\[UNIMOD:\d*\]', '', seq)
 
 
-def filter_whole_proteins(elements, protein_fasta, lookup, seqtype, ns,
-                          deamidation, minpeplen, enforce_tryp):
+def get_whole_proteins(protein_fasta):
+    """Returns protein sequences with leucines exchanged for isoleucines,
+    keyed by protein ID"""
     whole_proteins = {str(prot.seq).replace('L', 'I'): prot.id for prot in
                       fasta.parse_fasta(protein_fasta)}
-    whole_proteins = {v: k for k, v in whole_proteins.items()}
-    for element in elements:
+    return {v: k for k, v in whole_proteins.items()}
+
+
+def filter_whole_proteins(elements, whole_proteins, lookup, seqtype, ns,
+                          deamidation, minpeplen, enforce_tryp):
+    for element, raw in elements:
         seq_matches_protein = False
         element_seqs = get_seqs_from_element(element, seqtype, ns, deamidation)
         element_prots = {seq: [(protid, pos) for protid, pos in
@@ -58,10 +62,9 @@ def filter_whole_proteins(elements, protein_fasta, lookup, seqtype, ns,
                     elif not enforce_tryp:
                         seq_matches_protein = True
                         break
-        if seq_matches_protein:
-            formatting.clear_el(element)
-        else:
-            yield formatting.string_and_clear(element, ns)
+        formatting.clear_el(element)
+        if not seq_matches_protein:
+            yield raw
 
 
 def filter_known_searchspace(elements, seqtype, lookup, ns, ntermwildcards,
@@ -69,16 +72,15 @@ def filter_known_searchspace(elements, seqtype, lookup, ns, ntermwildcards,
     """Yields peptides from generator as long as their sequence is not found in
     known search space dict. Useful for excluding peptides that are found in
     e.g. ENSEMBL or similar"""
-    for element in elements:
+    for element, raw in elements:
         seq_is_known = False
         for seq in get_seqs_from_element(element, seqtype, ns, deamidation):
             if lookup.check_seq_exists(seq, ntermwildcards):
                 seq_is_known = True
                 break
-        if seq_is_known:
-            formatting.clear_el(element)
-        else:
-            yield formatting.string_and_clear(element, ns)
+        formatting.clear_el(element)
+        if not seq_is_known:
+            yield raw
 
 
 def get_seqs_from_element(element, seqtype, ns, deamidation):
@@ -109,27 +111,19 @@ def filter_unique_peptides(peptides, score, ns):
               'p': 'p_value',
               'svm': 'svm_score'}
     highest = {}
-    for el in peptides:
-        featscore = float(el.xpath('xmlns:%s' % scores[score],
-                                   namespaces=ns)[0].text)
+    for el, raw in peptides:
+        featscore = float(reader.get_child_element(el, scores[score],
+                                                   ns).text)
         seq = reader.get_peptide_seq(el, ns)
 
         if seq not in highest:
-            highest[seq] = {
-                'pep_el': formatting.stringify_strip_namespace_declaration(
-                    el, ns), 'score': featscore}
+            highest[seq] = {'pep_el': raw, 'score': featscore}
         if score == 'svm':  # greater than score is accepted
             if featscore > highest[seq]['score']:
-                highest[seq] = {
-                    'pep_el':
-                    formatting.stringify_strip_namespace_declaration(el, ns),
-                    'score': featscore}
+                highest[seq] = {'pep_el': raw, 'score': featscore}
         else:  # lower than score is accepted
             if featscore < highest[seq]['score']:
-                highest[seq] = {
-                    'pep_el':
-                    formatting.stringify_strip_namespace_declaration(el, ns),
-                    'score': featscore}
+                highest[seq] = {'pep_el': raw, 'score': featscore}
         formatting.clear_el(el)
 
     for pep in list(highest.values()):
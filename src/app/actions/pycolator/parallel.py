@@ -0,0 +1,73 @@
+import pickle
+from multiprocessing import Pool
+from itertools import islice
+
+from lxml import etree
+
+from app.readers import xml as basereader
+
+XML_CHUNK_SIZE = 4194304
+WORKER_TRANSFORM = {}
+
+
+def generate_transformed_chunks(fn, ns, feattypes, transform,
+                                transform_args, workers, with_type=False):
+    """Runs a per-element transform over percolator PSMs and/or peptides in
+    parallel. Elements of feattypes are found in the file by their bytes,
+    in chunks that are parsed and transformed by a worker process. Yields
+    the transformed features of each chunk in file order. The transform is
+    a generator function taking (element, bytes) tuples, or (feature type,
+    element, bytes) tuples when with_type is True, and transform_args,
+    which are passed to the workers once. Lookups in transform_args are
+    reconnected in the workers."""
+    chunks = generate_raw_chunks(fn, feattypes)
+    with Pool(workers, initializer=set_worker_transform,
+              initargs=(transform, pickle.dumps(transform_args), ns,
+                        with_type)) as pool:
+        # Read a few chunks ahead only, so output chunks do not pile up
+        # when writing is slower than transforming
+        while True:
+            jobs = list(islice(chunks, workers * 2))
+            if not jobs:
+                break
+            for outfeats in pool.imap(transform_chunk, jobs):
+                yield from outfeats
+
+
+def generate_raw_chunks(fn, feattypes):
+    """Yields lists of (feature type, bytes) tuples of elements in the
+    file, with lists of at least XML_CHUNK_SIZE bytes"""
+    chunk, chunksize = [], 0
+    for feattype, raw in basereader.generate_raw_xmltags(fn, feattypes):
+        chunk.append((feattype, raw))
+        chunksize += len(raw)
+        if chunksize >= XML_CHUNK_SIZE:
+            yield chunk
+            chunk, chunksize = [], 0
+    if chunk:
+        yield chunk
+
+
+def set_worker_transform(transform, transform_args, ns, with_type):
+    WORKER_TRANSFORM['transform'] = transform
+    WORKER_TRANSFORM['args'] = pickle.loads(transform_args)
+    WORKER_TRANSFORM['ns'] = ns
+    WORKER_TRANSFORM['with_type'] = with_type
+    # Elements in chunks are parsed inside a root that declares the
+    # namespaces of the percolator output
+    WORKER_TRANSFORM['root'] = '<percolator_output {}>'.format(' '.join(
+        '{}="{}"'.format(prefix, uri) for prefix, uri in ns.items()))
+
+
+def transform_chunk(chunk):
+    feattypes = [feattype for feattype, raw in chunk]
+    raws = [raw for feattype, raw in chunk]
+    root = etree.fromstring(b''.join([
+        WORKER_TRANSFORM['root'].encode('utf-8')] + raws +
+        [b'</percolator_output>']))
+    if WORKER_TRANSFORM['with_type']:
+        features = zip(feattypes, root, raws)
+    else:
+        features = zip(root, raws)
+    return list(WORKER_TRANSFORM['transform'](features,
+                                              *WORKER_TRANSFORM['args']))
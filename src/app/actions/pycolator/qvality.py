@@ -4,7 +4,7 @@ from app.readers import pycolator as readers
 
 def get_score(elements, ns, scoretype='svm_score'):
     for el in elements:
-        score = el.xpath('xmlns:{0}'.format(scoretype), namespaces=ns)[0].text
+        score = readers.get_child_element(el, scoretype, ns).text
         formatting.clear_el(el)
         yield score
 
@@ -1,9 +1,22 @@
 import sys
+from bisect import bisect_left
+
+import numpy as np
 
 from app.readers import xmlformatting as formatting
+from app.readers import pycolator as reader
+
+HIGHER_SCORE_WARNING = ('WARNING! Values found with higher svm_score than in '
+                        'qvality recalculation!')
+LOWER_SCORE_WARNING = ('WARNING! Values found with lower svm_score than in '
+                       'qvality recalculation were set to PEP=1, qval=1.')
 
 
 def parse_qvality_output(fn):
+    """Returns qvality statistics as a dict of arrays sorted on score: the
+    scores, q-values and PEPs as floats, and the q-values and PEPs as
+    reported by qvality, which are output for exact score matches. When a
+    score occurs more than once, its last statistics are used."""
     statistics = {}
     with open(fn) as fp:
         for line in fp:
@@ -14,43 +27,86 @@ def parse_qvality_output(fn):
                     score = float(line[0])
                 except ValueError:
                     continue
-                statistics[score] = {'PEP': line[1], 'q': line[2]}
-    return statistics
+                statistics[score] = (line[2], line[1])
+    if not statistics:
+        raise RuntimeError('No scores with statistics found in qvality '
+                           'output {}'.format(fn))
+    scores = sorted(statistics)
+    qtexts = [statistics[score][0] for score in scores]
+    peptexts = [statistics[score][1] for score in scores]
+    return {'score': np.array(scores, dtype=np.float64),
+            'q': np.array(qtexts, dtype=np.float64),
+            'PEP': np.array(peptexts, dtype=np.float64),
+            'qtext': qtexts, 'PEPtext': peptexts}
 
 
 def reassign_elements(elements, stats, ns):
     for el in elements:
-        score = round(float(el.xpath('xmlns:svm_score',
-                                     namespaces=ns)[0].text), 5)
-        oldq = el.xpath('xmlns:q_value', namespaces=ns)[0]
-        oldpep = el.xpath('xmlns:pep', namespaces=ns)[0]
+        score = round(float(reader.get_child_element(el, 'svm_score',
+                                                     ns).text), 5)
+        oldq = reader.get_child_element(el, 'q_value', ns)
+        oldpep = reader.get_child_element(el, 'pep', ns)
         newq, newpep, warning = lookup_statistic(score, stats)
         if warning is not None:
             sys.stdout.write(warning)
         oldq.text, oldpep.text = newq, newpep
-        yield formatting.string_and_clear(el, ns)
+        yield formatting.serialize_and_clear(el, ns)
+
+
+def check_statistics(stats):
+    if not len(stats['score']):
+        raise RuntimeError('Cannot look up statistics in an empty qvality '
+                           'table')
 
 
 def lookup_statistic(score, stats):
     """ Finds statistics that correspond to PSM/peptide/protein feature's
-    score. Loops through list of qvality generated scores until it finds
-    values closest to the feature's svm_score."""
-    if score in stats:
-        return stats[score]['q'], stats[score]['PEP'], None
-    else:
-        lower, warning = None, None
-        for stat_score in sorted(stats.keys()):
-            if score < stat_score:
-                break
-            lower = stat_score
-        if score > stat_score:
-            warning = ('WARNING! Values found with higher svm_score than in '
-                       'qvality recalculation!')
-        if not lower:
-            warning = ('WARNING! Values found with lower svm_score than in '
-                       'qvality recalculation were set to PEP=1, qval=1.')
-            return '1', '1', warning
-        qval = (float(stats[stat_score]['q']) + float(stats[lower]['q'])) / 2
-        pep = (float(stats[stat_score]['PEP']) +
-               float(stats[lower]['PEP'])) / 2
-    return str(qval), str(pep), warning
+    score. Binary searches the sorted qvality scores for the feature's
+    svm_score, and interpolates between the closest scores when there is
+    no exact match."""
+    check_statistics(stats)
+    ix = bisect_left(stats['score'], score)
+    if ix < len(stats['score']) and stats['score'][ix] == score:
+        return stats['qtext'][ix], stats['PEPtext'][ix], None
+    elif ix == 0:
+        return '1', '1', LOWER_SCORE_WARNING
+    upper, lower, warning = ix, ix - 1, None
+    if ix == len(stats['score']):
+        upper, lower, warning = ix - 1, ix - 1, HIGHER_SCORE_WARNING
+    qval = (stats['q'][upper] + stats['q'][lower]) / 2
+    pep = (stats['PEP'][upper] + stats['PEP'][lower]) / 2
+    return str(float(qval)), str(float(pep)), warning
+
+
+def lookup_statistics(scores, stats):
+    """Batch version of lookup_statistic, finds statistics for an array of
+    scores at once. Returns lists of q-values, PEPs and warnings, with one
+    item for each score"""
+    check_statistics(stats)
+    scores = np.asarray(scores, dtype=np.float64)
+    amount = len(stats['score'])
+    ixs = np.searchsorted(stats['score'], scores, side='left')
+    exact = stats['score'][np.minimum(ixs, amount - 1)] == scores
+    higher = ixs == amount
+    lower = (ixs == 0) & ~exact
+    upper_ixs = np.where(higher, amount - 1, ixs)
+    lower_ixs = np.where(higher, amount - 1, np.maximum(ixs - 1, 0))
+    qvals = ((stats['q'][upper_ixs] + stats['q'][lower_ixs]) / 2).tolist()
+    peps = ((stats['PEP'][upper_ixs] + stats['PEP'][lower_ixs]) / 2).tolist()
+    outq, outpep, warnings = [], [], []
+    for ix, qval, pep, is_exact, is_higher, is_lower in zip(
+            ixs.tolist(), qvals, peps, exact.tolist(), higher.tolist(),
+            lower.tolist()):
+        if is_exact:
+            outq.append(stats['qtext'][ix])
+            outpep.append(stats['PEPtext'][ix])
+            warnings.append(None)
+        elif is_lower:
+            outq.append('1')
+            outpep.append('1')
+            warnings.append(LOWER_SCORE_WARNING)
+        else:
+            outq.append(str(qval))
+            outpep.append(str(pep))
+            warnings.append(HIGHER_SCORE_WARNING if is_higher else None)
+    return outq, outpep, warnings
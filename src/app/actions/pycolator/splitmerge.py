@@ -1,75 +1,134 @@
-from lxml import etree
 import re
+import tempfile
+from array import array
+from xml.sax.saxutils import escape
 
 from app.readers import xmlformatting as formatting
 from app.readers import pycolator as reader
 
-
-def create_merge_psm_map(peptides, ns):
-    """Loops through peptides, stores sequences mapped to PSM ids."""
-    psmmap = {}
-    for peptide in peptides:
-        seq = reader.get_peptide_seq(peptide, ns)
-        psm_ids = reader.get_psm_ids_from_peptide(peptide, ns)
-        for psm_id in psm_ids:
-            try:
-                psmmap[seq][psm_id.text] = 1
-            except KeyError:
-                psmmap[seq] = {psm_id.text: 2}
-    for seq, psm_id_dict in psmmap.items():
-        psmmap[seq] = [x for x in psm_id_dict]
-    return psmmap
+WHITESPACE_RE = re.compile(rb'\s*')
 
 
 def merge_peptides(fns, ns):
-    """Loops peptides from multiple files, fetches PSMs from
-    sequence:PSM map, outputs correctly PSM mapped peptides"""
-    peptides_to_map = reader.generate_peptides_multiple_fractions(fns, ns)
-    psmmap = create_merge_psm_map(peptides_to_map, ns)
-    peptides = reader.generate_peptides_multiple_fractions(fns, ns)
-    for peptide in peptides:
-        seq = reader.get_peptide_seq(peptide, ns)
-        psm_ids = reader.get_psm_ids_from_peptide(peptide, ns)
-        # remove current psm ids, repopulate with stored ones
-        psm_ids.clear()
-        for new_psm_id in psmmap[seq]:
-            etree.SubElement(psm_ids, 'psm_id').text = new_psm_id
-        yield formatting.string_and_clear(peptide, ns)
-
-
-def target_decoy_generator(element_generator, decoy, ns):
-    for el in element_generator:
-        if el.attrib['{%s}decoy' % ns['xmlns']] == decoy:
-            yield formatting.string_and_clear(el, ns)
-        else:
-            formatting.clear_el(el)
-
-
-def split_target_decoy(elements, ns, filter_type):
-    td = {'target': 'false', 'decoy': 'true'}
-    feats_to_process = {'psm': None, 'peptide': None}
-    for feat in feats_to_process:
-        feats_to_process[feat] = target_decoy_generator(
-            elements[feat], td[filter_type], ns)
-    return feats_to_process
-
-
-def protein_header_split_generator(elements, headers, ns):
-    """Loop through proteins of each PSM/peptide. If a protein does not
-    match any of headers, discard PSM/peptide immediately"""
-    for el in elements:
-        header_not_matching = False
-        for protein in el.findall('{%s}protein_id' % ns['xmlns']):
-            if not any((re.search(h, protein.text) for h in headers)):
-                header_not_matching = True
+    """Loops peptides from multiple files and outputs them with the PSM ids
+    of all peptides with the same sequence. Files are parsed once: peptides
+    are spilled as bytes without their PSM ids to a temporary file, and
+    PSM ids are stored per sequence as integers. Then the peptides are
+    read back in order and output with the merged PSM ids."""
+    seq_ixs, seq_psms, psm_ixs = {}, [], {}
+    pep_seqs, prefix_lengths, suffix_lengths = (array('L'), array('L'),
+                                                array('L'))
+    with tempfile.TemporaryFile() as spillfp:
+        for fn in fns:
+            for peptide, raw in reader.generate_peptides_with_raw(fn):
+                prefix, suffix = split_peptide_on_psm_ids(raw, fn)
+                seq = reader.get_peptide_seq(peptide, ns)
+                try:
+                    seq_ix = seq_ixs[seq]
+                except KeyError:
+                    seq_ix = seq_ixs[seq] = len(seq_psms)
+                    seq_psms.append(array('L'))
+                for psm_id in reader.get_psm_ids_from_peptide(peptide, ns):
+                    seq_psms[seq_ix].append(psm_ixs.setdefault(
+                        psm_id.text, len(psm_ixs)))
+                formatting.clear_el(peptide)
+                spillfp.write(prefix)
+                spillfp.write(suffix)
+                pep_seqs.append(seq_ix)
+                prefix_lengths.append(len(prefix))
+                suffix_lengths.append(len(suffix))
+        del(seq_ixs)
+        # PSM ids in order of first occurrence, without duplicates
+        for seq_ix, psms in enumerate(seq_psms):
+            seq_psms[seq_ix] = array('L', dict.fromkeys(psms))
+        psm_ids = [b'<psm_id>' + escape(psm_id).encode('utf-8') + b'</psm_id>'
+                   for psm_id in psm_ixs]
+        del(psm_ixs)
+        spillfp.seek(0)
+        for seq_ix, prefix_len, suffix_len in zip(pep_seqs, prefix_lengths,
+                                                  suffix_lengths):
+            merged_ids = b''.join(psm_ids[psm_ix] for psm_ix in
+                                  seq_psms[seq_ix])
+            merged_ids = (b'<psm_ids>' + merged_ids + b'</psm_ids>'
+                          if merged_ids else b'<psm_ids/>')
+            yield b''.join([spillfp.read(prefix_len), merged_ids,
+                            spillfp.read(suffix_len)])
+
+
+def split_peptide_on_psm_ids(raw, fn):
+    """Returns the bytes of a peptide element before and after its psm_ids
+    element. Like an emptied psm_ids element, the whitespace after it
+    is left out"""
+    start = raw.find(b'<psm_ids')
+    if start == -1:
+        raise RuntimeError('Could not locate psm_ids element of peptide in '
+                           'file {}'.format(fn))
+    end = raw.find(b'</psm_ids>', start)
+    if end == -1:
+        end = raw.index(b'/>', start) + 2
+    else:
+        end += len(b'</psm_ids>')
+    return raw[:start], raw[WHITESPACE_RE.match(raw, end).end():]
+
+
+def generate_split_features(features, ns, get_splits):
+    """Takes (feature type, element, bytes) tuples and yields tuples of
+    feature type, the splits the element belongs to according to
+    get_splits, and the element bytes. Elements are cleared after use."""
+    for feattype, el, raw in features:
+        splits = get_splits(el)
+        formatting.clear_el(el)
+        if splits:
+            yield feattype, splits, raw
+
+
+def split_target_decoy(features, ns):
+    decoy_attrib = '{%s}decoy' % ns['xmlns']
+    td = {'false': ['target'], 'true': ['decoy']}
+
+    def get_td(el):
+        return td.get(el.attrib[decoy_attrib])
+    return generate_split_features(features, ns, get_td)
+
+
+def split_protein_header_id_type(features, ns, protheaders):
+    """Splits PSMs and peptides on groups of protein headers, an element
+    belongs to a group (by index in protheaders) when all its proteins
+    match one of the group's headers. Headers of all groups are searched
+    for with a single regex, and results are cached per protein."""
+    protein_tag = '{%s}protein_id' % ns['xmlns']
+    header_re = get_protein_header_regex(protheaders)
+    protein_groups = {}
+    all_groups = set(range(len(protheaders)))
+
+    def get_protein_groups(protein):
+        try:
+            return protein_groups[protein]
+        except KeyError:
+            matches = header_re.match(protein).groupdict()
+            groups = {int(group[1:]) for group, match in matches.items()
+                      if match is not None}
+            protein_groups[protein] = groups
+            return groups
+
+    def get_groups(el):
+        groups = all_groups
+        for protein in el.iterfind(protein_tag):
+            groups = groups.intersection(get_protein_groups(protein.text))
+            if not groups:
                 break
-        if header_not_matching:
-            formatting.clear_el(el)
-        else:
-            yield formatting.string_and_clear(el, ns)
+        return sorted(groups)
+    return generate_split_features(features, ns, get_groups)
 
 
-def split_protein_header_id_type(elements, ns, protheaders):
-    headers = protheaders.strip(';').split(';')
-    return {x: protein_header_split_generator(elements[x], headers, ns)
-            for x in ['psm', 'peptide']}
+def get_protein_header_regex(protheaders):
+    """Combines groups of semicolon separated headers into a regex that
+    reports all groups with a header found in a text. Each group is an
+    optional lookahead searching for its headers, named g0, g1, etc."""
+    lookaheads = []
+    for ix, headers in enumerate(protheaders):
+        alternatives = '|'.join('(?:{})'.format(header) for header in
+                                headers.strip(';').split(';'))
+        lookaheads.append('(?:(?=.*?(?P<g{}>{})))?'.format(ix,
+                                                            alternatives))
+    return re.compile(''.join(lookaheads), re.DOTALL)
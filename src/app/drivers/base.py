@@ -3,6 +3,8 @@ import sys
 
 from app.lookups import base as lookups
 from app.drivers.options import shared_options
+from app.writers.compressed import (add_compression_extension,
+                                    strip_compression_extension)
 
 
 class BaseDriver(object):
@@ -17,7 +19,8 @@ class BaseDriver(object):
             self.lookup = None
 
     def set_options(self):
-        self.options = self.define_options(['fn', 'outdir', 'outfile'], {})
+        self.options = self.define_options(['fn', 'outdir', 'outfile',
+                                            'compress'], {})
         self.options['-i']['help'] = self.options['-i']['help'].format(
             self.infiletype)
 
@@ -79,11 +82,11 @@ class BaseDriver(object):
 
     def create_outfilepath(self, fn, suffix=None):
         if self.outfile is None:
-            basefn = os.path.basename(fn)
+            basefn = strip_compression_extension(os.path.basename(fn))
             outfn = os.path.join(self.outdir, basefn + suffix)
         else:
             outfn = self.outfile
-        return outfn
+        return add_compression_extension(outfn, self.compress)
 
     def number_to_headerfield(self, columnr, header):
         return header[int(columnr) - 1]
@@ -7,6 +7,7 @@ from app.drivers.options import mslookup_options
 
 class LookupDriver(BaseDriver):
     outfile, outdir = None, None
+    integer_keys = False
 
     def __init__(self):
         super().__init__()
@@ -16,7 +17,8 @@ class LookupDriver(BaseDriver):
         super().set_options()
         del(self.options['-o'])
         del(self.options['-d'])
-        self.options.update(self.define_options(['lookupfn'],
+        del(self.options['--compress'])
+        self.options.update(self.define_options(['lookupfn', 'bulkload'],
                                                 mslookup_options))
 
     def initialize_lookup(self):
@@ -28,8 +30,14 @@ class LookupDriver(BaseDriver):
                                             'mslookup_db.sqlite')
             self.lookup = lookups.create_new_lookup(self.outfile,
                                                     self.lookuptype)
+        if self.integer_keys:
+            self.lookup.use_integer_keys()
         self.lookup.add_tables()
 
     def run(self):
         self.initialize_lookup()
+        if self.bulkload:
+            self.lookup.start_bulk_load(self.bulkload)
         self.create_lookup()
+        if self.bulkload:
+            self.lookup.finish_bulk_load()
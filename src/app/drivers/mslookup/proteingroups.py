@@ -1,5 +1,6 @@
 from app.actions.mslookup import proteingrouping as lookups
 from app.drivers.mslookup import base
+from app.drivers.options import mslookup_options
 
 
 class ProteinGroupLookupDriver(base.LookupDriver):
@@ -12,5 +13,10 @@ class ProteinGroupLookupDriver(base.LookupDriver):
         super().__init__()
         self.infiletype = 'TSV PSM table (MSGF+)'
 
+    def set_options(self):
+        super().set_options()
+        self.options.update(self.define_options(['workers'],
+                                                mslookup_options))
+
     def create_lookup(self):
-        lookups.build_proteingroup_db(self.lookup)
+        lookups.build_proteingroup_db(self.lookup, self.workers)
@@ -53,7 +53,8 @@ class PrecursorQuantLookupDriver(QuantLookupDriver):
     def set_options(self):
         super().set_options()
         self.options.update(self.define_options(['quantfiletype', 'rttol',
-                                                 'mztol', 'mztoltype'],
+                                                 'mztol', 'mztoltype',
+                                                 'workers'],
                                                 mslookup_options))
 
     def parse_input(self, **kwargs):
@@ -71,4 +72,5 @@ class PrecursorQuantLookupDriver(QuantLookupDriver):
                                               self.quantfiletype,
                                               self.rt_tol,
                                               self.mz_tol,
-                                              self.mz_toltype)
+                                              self.mz_toltype,
+                                              self.workers)
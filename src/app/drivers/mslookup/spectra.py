@@ -30,12 +30,13 @@ class SpectraLookupDriver(base.LookupDriver):
     def set_options(self):
         super().set_options()
         self.options['--dbfile'].update({'required': False, 'default': None})
-        self.options.update(self.define_options(['multifiles', 'setnames'],
+        self.options.update(self.define_options(['multifiles', 'setnames',
+                                                 'intkeys', 'workers'],
                                                 mslookup_options))
 
     def create_lookup(self):
         biosetlookup.create_bioset_lookup(self.lookup, self.spectrafns,
                                           self.setnames)
         fn_spectra = spectrareader.mzmlfn_ms2_spectra_generator(
-            self.spectrafns)
+            self.spectrafns, self.workers)
         spectralookup.create_spectra_lookup(self.lookup, fn_spectra)
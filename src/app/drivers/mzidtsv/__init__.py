@@ -1,10 +1,18 @@
 from app.drivers import base
+from app.actions.mzidtsv import parallel
 from app.readers import tsv as tsvreader
 from app.writers import mzidtsv as writers
 from app.drivers.options import mzidtsv_options
 
 
 class MzidTSVDriver(base.BaseDriver):
+    """Drivers of stateless per-PSM steps can set psm_transform to a
+    (generator function, arguments) tuple, to be run on chunks of the
+    PSM table in parallel when using more than one worker"""
+    workers = 1
+    psm_transform = False
+    in_psms = None
+
     def __init__(self):
         super().__init__()
         self.infiletype = 'TSV PSM table (MSGF+)'
@@ -20,6 +28,25 @@ class MzidTSVDriver(base.BaseDriver):
         self.write()
         self.finish()
 
+    def get_input_psms(self):
+        """Returns PSMs to process, read from the input file, or passed
+        from a previous step when running in a pipeline"""
+        if self.in_psms is not None:
+            return self.in_psms
+        return tsvreader.generate_tsv_psm_rows(self.fn, self.oldheader)
+
+    def run_parallel(self):
+        """Returns True when the PSM transform will be run on chunks of the
+        input in parallel, in which case self.psms is not used"""
+        return bool(self.workers > 1 and self.psm_transform and
+                    tsvreader.get_tsv_chunk_ranges(self.first_infile))
+
     def write(self):
         outfn = self.create_outfilepath(self.first_infile, self.outsuffix)
-        writers.write_mzid_tsv(self.header, self.psms, outfn)
+        if self.run_parallel():
+            chunks = parallel.generate_transformed_chunks(
+                self.first_infile, self.oldheader, self.header,
+                *self.psm_transform, self.workers)
+            writers.write_mzid_tsv_chunks(self.header, chunks, outfn)
+        else:
+            writers.write_mzid_tsv(self.header, self.psms, outfn)
@@ -12,7 +12,8 @@ class ConfidenceFilterDriver(MzidTSVDriver):
     def set_options(self):
         super().set_options()
         options = self.define_options(['confcol', 'confpattern', 'conflvl',
-                                       'conftype', 'unroll'], mzidtsv_options)
+                                       'conftype', 'unroll', 'workers'],
+                                      mzidtsv_options)
         self.options.update(options)
 
     def parse_input(self, **kwargs):
@@ -29,8 +30,7 @@ class ConfidenceFilterDriver(MzidTSVDriver):
         else:
             raise RuntimeError('Must define either --confcol or '
                                '--confcolpattern')
-        self.psms = prep.generate_psms(self.fn,
-                                       self.oldheader,
-                                       confkey,
-                                       self.conflvl,
-                                       self.lowerbetter)
+        self.psms = prep.filter_psms(self.get_input_psms(), confkey,
+                                     self.conflvl, self.lowerbetter)
+        self.psm_transform = (prep.filter_psms,
+                              (confkey, self.conflvl, self.lowerbetter))
@@ -17,7 +17,8 @@ class PSMIsoquantRatioDriver(MzidTSVDriver):
                                                  'denompatterns', 'denomcols',
                                                  'minint', 'targettable',
                                                  'proteincol', 'normalize',
-                                                 'normalizeratios'],
+                                                 'normalizeratios',
+                                                 'lowmemory', 'workers'],
                                                 mzidtsv_options))
 
     def get_psms(self):
@@ -34,6 +35,9 @@ class PSMIsoquantRatioDriver(MzidTSVDriver):
         quantcols = tsv.get_columns_by_pattern(self.oldheader,
                                                self.quantcolpattern)
         self.get_column_header_for_number(['proteincol'], self.oldheader)
+        if self.lowmemory and (self.proteincol or self.targettable):
+            raise RuntimeError('Cannot calculate ratios with --lowmemory when '
+                               'using --protcol or --targettable')
         nopsms = [prep.get_no_psms_field(qf) for qf in quantcols]
         if self.proteincol and self.targettable:
             targetheader = tsv.get_tsv_header(self.targettable)
@@ -43,11 +47,18 @@ class PSMIsoquantRatioDriver(MzidTSVDriver):
                            ['ratio_{}'.format(x) for x in quantcols])
         elif self.proteincol and not self.targettable:
             self.header = [prottabledata.HEADER_ACCESSION] + quantcols + nopsms
+        if not self.proteincol and not self.targettable and not self.normalize:
+            self.psm_transform = (prep.add_psm_ratios,
+                                  (quantcols, list(denomcols), self.minint))
+        if self.run_parallel():
+            # Ratios are calculated per chunk by the workers instead
+            return
         self.psms = prep.get_isobaric_ratios(self.fn, self.oldheader,
                                              quantcols, denomcols, self.minint,
                                              self.targettable, self.proteincol,
                                              self.normalize,
-                                             self.normalizeratios)
+                                             self.normalizeratios,
+                                             self.lowmemory)
 
 
 class PSMIsoquantNormalizeDriver(MzidTSVDriver):
@@ -60,7 +71,8 @@ class PSMIsoquantNormalizeDriver(MzidTSVDriver):
         super().set_options()
         self.options.update(self.define_options(['quantcolpattern',
                                                  'medianpsms', 'denompatterns',
-                                                 'denomcols', 'minint'],
+                                                 'denomcols', 'minint',
+                                                 'lowmemory'],
                                                 mzidtsv_options))
 
     def get_psms(self):
@@ -84,4 +96,4 @@ class PSMIsoquantNormalizeDriver(MzidTSVDriver):
         self.psms = prep.get_normalized_ratios(self.fn, self.oldheader,
                                                quantcols, denomcols,
                                                self.minint, self.medianpsms,
-                                               medianheader)
+                                               medianheader, self.lowmemory)
@@ -24,6 +24,5 @@ class MzidPercoTSVDriver(MzidTSVDriver):
         self.header = prep.get_header_with_percolator(self.oldheader,
                                                       self.multipsm_per_scan)
         self.psms = prep.add_percolator_to_mzidtsv(self.mzidfn,
-                                                   self.fn,
-                                                   self.multipsm_per_scan,
-                                                   self.oldheader)
+                                                   self.get_input_psms(),
+                                                   self.multipsm_per_scan)
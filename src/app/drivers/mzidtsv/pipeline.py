@@ -0,0 +1,89 @@
+import shlex
+
+import yaml
+
+from app.drivers import startup
+from app.drivers.mzidtsv import (MzidTSVDriver, spectra, percolator,
+                                 proteingrouping, prot2gene, quant,
+                                 filter_confidence)
+from app.drivers.options import mzidtsv_options, shared_options
+
+
+class MzidTSVPipelineDriver(MzidTSVDriver):
+    """Chains the drivers of PSM table steps, each step processing the
+    PSMs yielded by the previous one, so the table is read and written
+    only once."""
+    outsuffix = '_pipeline.tsv'
+    command = 'pipeline'
+    commandhelp = ('Run several steps on a PSM table in a single pass, '
+                   'as listed in a YAML recipe passed with --recipe.')
+    step_drivers = [filter_confidence.ConfidenceFilterDriver,
+                    spectra.TSVSpectraDriver,
+                    quant.TSVQuantDriver,
+                    percolator.MzidPercoTSVDriver,
+                    proteingrouping.ProteinGroupDriver,
+                    prot2gene.TSVGeneFromProteinDriver]
+    # Steps which match lookup rows to PSMs by row number, and steps which
+    # remove PSMs and thereby shift those row numbers
+    rownr_steps = ['specdata', 'quant', 'proteingroup']
+    filter_steps = ['conffilt']
+    # Options of steps that would have no effect in a pipeline, which
+    # writes once and runs its steps serially, with their defaults
+    rejected_step_options = {'outfile': None, 'outdir': None,
+                             'compress': False, 'workers': 1}
+
+    def set_options(self):
+        super().set_options()
+        self.options.update(self.define_options(['recipe'], mzidtsv_options))
+
+    def get_psms(self):
+        self.header = self.oldheader[:]
+        self.psms = self.get_input_psms()
+        for step in self.get_steps():
+            step.oldheader = self.header
+            step.in_psms = self.psms
+            step.get_psms()
+            self.header, self.psms = step.header, step.psms
+
+    def get_steps(self):
+        """Parses the recipe steps with the command line options of their
+        drivers and returns a driver per step, ready to get PSMs"""
+        drivers = {driver.command: driver for driver in self.step_drivers}
+        parser = startup.populate_parser([driver() for driver in
+                                          self.step_drivers])
+        with open(self.recipe) as fp:
+            recipe = yaml.safe_load(fp)
+        if not isinstance(recipe, list):
+            raise RuntimeError('Recipe {} should contain a list of '
+                               'steps'.format(self.recipe))
+        steps, filtered = [], False
+        for step in recipe:
+            if isinstance(step, str):
+                args = shlex.split(step)
+            else:
+                args = [str(arg) for arg in step]
+            if not args or args[0] not in drivers:
+                raise RuntimeError('Cannot run step "{}" in a pipeline, steps '
+                                   'should be one of [{}]'.format(
+                                       step, ', '.join(drivers)))
+            if args[0] in self.rownr_steps and filtered:
+                raise RuntimeError('Step "{}" matches lookup data to PSMs by '
+                                   'their row number in the table and cannot '
+                                   'run after a filtering step [{}], put it '
+                                   'earlier in the recipe'.format(
+                                       step, ', '.join(self.filter_steps)))
+            filtered = filtered or args[0] in self.filter_steps
+            options = vars(parser.parse_args(args + ['-i', self.fn]))
+            for option, default in self.rejected_step_options.items():
+                if options.get(option, default) != default:
+                    clarg = shared_options[option]['clarg']
+                    raise RuntimeError('Cannot use option {} in pipeline '
+                                       'step "{}", steps are run serially '
+                                       'and output is set on the pipeline '
+                                       'command'.format(clarg, step))
+            driver = drivers[args[0]]()
+            driver.set_options()
+            driver.parse_input(**options)
+            driver.set_lookup()
+            steps.append(driver)
+        return steps
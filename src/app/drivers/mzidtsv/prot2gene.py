@@ -12,11 +12,13 @@ class TSVGeneFromProteinDriver(MzidTSVDriver):
 
     def set_options(self):
         super().set_options()
-        self.options.update(self.define_options(['lookupfn'], mzidtsv_options))
+        self.options.update(self.define_options(['lookupfn', 'workers'],
+                                                mzidtsv_options))
 
     def get_psms(self):
         """Creates iterator to write to new tsv. Contains input tsv
         lines plus quant data for these."""
         self.header = actions.create_header(self.oldheader)
-        self.psms = actions.add_genes_to_psm_table(self.fn, self.oldheader,
-                                                   self.lookup)
+        gpmap = self.lookup.get_protein_gene_map()
+        self.psms = actions.add_genes_to_psms(self.get_input_psms(), gpmap)
+        self.psm_transform = (actions.add_genes_to_psms, (gpmap,))
@@ -17,8 +17,5 @@ class ProteinGroupDriver(MzidTSVDriver):
 
     def get_psms(self):
         self.header = prep.get_header_with_proteingroups(self.oldheader)
-        self.psms = prep.generate_psms_with_proteingroups(self.fn,
-                                                          self.oldheader,
-                                                          self.header,
-                                                          self.lookup,
-                                                          self.unroll)
+        self.psms = prep.generate_psms_with_proteingroups(
+            self.get_input_psms(), self.lookup, self.unroll)
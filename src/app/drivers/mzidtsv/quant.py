@@ -22,6 +22,7 @@ class TSVQuantDriver(MzidTSVDriver):
         lines plus quant data for these."""
         self.header, isob_header = prep.get_full_and_isobaric_headers(
             self.oldheader, self.lookup, self.isobaric, self.precursor)
-        self.psms = prep.generate_psms_quanted(self.lookup, self.fn,
-                                               isob_header, self.oldheader,
-                                               self.isobaric, self.precursor)
+        self.psms = prep.generate_psms_quanted(self.lookup,
+                                               self.get_input_psms(),
+                                               isob_header, self.isobaric,
+                                               self.precursor)
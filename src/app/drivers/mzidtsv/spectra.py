@@ -19,5 +19,5 @@ class TSVSpectraDriver(MzidTSVDriver):
         """Creates iterator to write to new tsv. Contains input tsv
         lines plus quant data for these."""
         self.header = actions.create_header(self.oldheader, self.spectracol)
-        self.psms = actions.generate_psms_spectradata(self.lookup, self.fn,
-                                                      self.oldheader)
+        self.psms = actions.generate_psms_spectradata(self.lookup,
+                                                      self.get_input_psms())
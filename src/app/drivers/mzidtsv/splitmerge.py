@@ -4,6 +4,7 @@ from app.actions.mzidtsv import splitmerge as prep
 from app.drivers.mzidtsv import MzidTSVDriver
 from app.writers import mzidtsv as writers
 from app.drivers.options import mzidtsv_options
+from app.writers.compressed import add_compression_extension
 
 
 class MzidTSVConcatenateDriver(MzidTSVDriver):
@@ -22,6 +23,10 @@ class MzidTSVConcatenateDriver(MzidTSVDriver):
         self.header = self.oldheader
         self.psms = prep.merge_mzidtsvs(self.fn, self.oldheader)
 
+    def write(self):
+        outfn = self.create_outfilepath(self.first_infile, self.outsuffix)
+        writers.write_mzid_tsv_bytes(self.header, self.psms, outfn)
+
 
 class MzidTSVSplitDriver(MzidTSVDriver):
     """Splits MSGF PSM table on contents of certain column. Each
@@ -44,6 +49,6 @@ class MzidTSVSplitDriver(MzidTSVDriver):
                                              self.bioset, self.splitcol)
 
     def write(self):
-        base_outfile = os.path.join(self.outdir, '{}.tsv')
-        writers.write_multi_mzidtsv(self.header, self.oldheader, self.psms,
-                                    base_outfile)
+        base_outfile = add_compression_extension(
+            os.path.join(self.outdir, '{}.tsv'), self.compress)
+        writers.write_multi_mzidtsv(self.header, self.psms, base_outfile)
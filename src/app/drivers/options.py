@@ -8,6 +8,14 @@ shared_options = {
     'outdir': {'driverattr': 'outdir', 'dest': 'outdir', 'clarg': '-d',
                'help': 'Directory to output in', 'type': 'file',
                'required': False},
+    'compress': {'driverattr': 'compress', 'dest': 'compress',
+                 'clarg': '--compress', 'type': 'pick',
+                 'picks': ['gzip', 'zstd'], 'required': False,
+                 'default': False, 'help': 'Compress output files with '
+                 'gzip or zstd, adding a .gz or .zst extension to their '
+                 'names. Output files named with -o that end in .gz or '
+                 '.zst are always compressed. Compressed input files are '
+                 'detected automatically.'},
     'multifiles': {'driverattr': 'fn', 'dest': 'infile', 'clarg': '-i',
                    'help': 'Multiple input files of {} format',
                    'type': 'file', 'nargs': '+'},
@@ -115,6 +123,9 @@ shared_options = {
                   'dest': 'genefield', 'required': False, 'type': int,
                   'help': 'Field nr (first=1) in FASTA that contains gene '
                   'name when using --fastadelim to parse the gene names'},
+    'workers': {'driverattr': 'workers', 'dest': 'workers', 'default': 1,
+                'help': 'Number of worker processes to use, default 1',
+                'type': int, 'clarg': '--workers', 'required': False},
     'minlength': {'driverattr': 'minlength', 'dest': 'minlength', 'default': 0,
                   'help': 'Minimum length of peptide to be included',
                   'type': int, 'clarg': '--minlen', 'required': False},
@@ -145,6 +156,21 @@ mslookup_options = {
               'for decoy PSMs, use with --map in case there '
               'are no decoy symbols in the FASTA used to '
               'search.', 'required': False},
+    'bulkload': {'driverattr': 'bulkload', 'dest': 'bulkload',
+                 'clarg': '--bulkload', 'type': int, 'nargs': '?',
+                 'const': 1024, 'default': False, 'required': False,
+                 'help': 'Load lookup in bulk mode: a single transaction '
+                 'without foreign key checks or syncing to disk, with '
+                 'indexes built at the end. Optionally specify the memory '
+                 'budget in MB for SQLite cache and memory mapping, '
+                 'default 1024.'},
+    'intkeys': {'driverattr': 'integer_keys', 'dest': 'integer_keys',
+                'clarg': '--intkeys', 'action': 'store_const',
+                'const': True, 'default': False, 'required': False,
+                'help': 'Key spectra and PSMs on integer IDs instead of '
+                'text IDs in a new lookup, which results in smaller lookups '
+                'and faster joins. Later lookup steps detect this and '
+                'follow suit.'},
     'spectrafns': {'driverattr': 'spectrafns', 'dest': 'spectra',
                    'type': str, 'help': 'Spectra files in mzML '
                    'format. Multiple files can be specified, if '
@@ -298,6 +324,17 @@ mzidtsv_options = {
                     'type': 'file', 'required': False},
     'mzidfn': {'driverattr': 'mzidfn', 'clarg': '--mzid', 'help': 'mzIdentML',
                'type': 'file'},
+    'recipe': {'driverattr': 'recipe', 'clarg': '--recipe', 'type': 'file',
+               'help': 'YAML file with a list of steps to run on the PSM '
+               'table, each a command with its options as on the command '
+               'line, e.g. "conffilt --confidence-col 14 '
+               '--confidence-lvl 0.01 --confidence-better lower". Steps '
+               'can be one of [conffilt, specdata, quant, percolator, '
+               'proteingroup, genes], lookups passed to steps should '
+               'match the PSMs they receive from previous steps. specdata, '
+               'quant and proteingroup cannot follow conffilt. Steps run '
+               'serially, output options and --workers are not accepted '
+               'in steps.'},
     'bioset': {'driverattr': 'bioset', 'clarg': '--bioset', 'const': True,
                'action': 'store_const', 'default': False,
                'help': 'this enables automatic splitting on '
@@ -326,6 +363,13 @@ mzidtsv_options = {
                'isobaric ratios. Values below threshold will be set to NA.',
                'required': False, 'default': -1,
                },
+    'lowmemory': {'driverattr': 'lowmemory', 'clarg': '--lowmemory',
+                  'action': 'store_const', 'const': True, 'default': False,
+                  'required': False,
+                  'help': 'Calculate PSM ratios in two passes over the PSM '
+                  'table, keeping ratios in a temporary file on disk '
+                  'instead of in memory. Ratios are then output in single '
+                  'precision. Cannot be used with --protcol.'},
 }
 mzidtsv_options['quantcolpattern'] = {
     k: v for k, v in shared_options['quantcolpattern'].items()}
@@ -6,6 +6,8 @@ from app.writers import pycolator as writers
 
 class PycolatorDriver(base.BaseDriver):
     """Driver for pycolator functions"""
+    workers = 1
+
     def __init__(self):
         super().__init__()
         self.infiletype = 'percolator out XML'
@@ -22,13 +24,17 @@ class PycolatorDriver(base.BaseDriver):
     def get_all_psms(self):
         return readers.generate_psms(self.fn, self.ns)
 
-    def get_all_psms_strings(self):
-        return readers.generate_psms_multiple_fractions_strings([self.fn],
-                                                                self.ns)
+    def get_all_psms_with_raw(self):
+        return readers.generate_psms_with_raw(self.fn)
+
+    def get_all_peptides_with_raw(self):
+        return readers.generate_peptides_with_raw(self.fn)
+
+    def get_all_psms_raw(self):
+        return readers.generate_psms_multiple_fractions_raw([self.fn])
 
-    def get_all_peptides_strings(self):
-        return readers.generate_peptides_multiple_fractions_strings([self.fn],
-                                                                    self.ns)
+    def get_all_peptides_raw(self):
+        return readers.generate_peptides_multiple_fractions_raw([self.fn])
 
     def prepare(self):
         self.ns, self.static_xml = self.prepare_percolator_output(self.fn)
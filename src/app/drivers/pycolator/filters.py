@@ -1,9 +1,31 @@
 from app.drivers.pycolator import base
 from app.actions.pycolator import filters as preparation
+from app.actions.pycolator import parallel
 from app.drivers.options import pycolator_options
 
 
-class FilterPeptideLength(base.PycolatorDriver):
+class FilterDriver(base.PycolatorDriver):
+    """Base class for filters, which output the PSMs and peptides they keep
+    unchanged. Elements are fetched with their bytes from the input file
+    so these can be written without serializing the elements."""
+    def get_all_peptides(self):
+        return self.get_all_peptides_with_raw()
+
+    def get_all_psms(self):
+        return self.get_all_psms_with_raw()
+
+    def get_filtered_features(self, feattype, transform, transform_args):
+        """Returns PSMs or peptides filtered by transform, which is run on
+        chunks of the input in parallel when using more than one worker"""
+        if self.workers > 1:
+            return parallel.generate_transformed_chunks(
+                self.fn, self.ns, [feattype], transform, transform_args,
+                self.workers)
+        features = {'psm': self.allpsms, 'peptide': self.allpeps}[feattype]
+        return transform(features, *transform_args)
+
+
+class FilterPeptideLength(FilterDriver):
     """Filters on peptide length, to be specified in calling. Outputs to
     multiple files if multiple file input is given. No PSMs will be
     outputted."""
@@ -13,21 +35,23 @@ class FilterPeptideLength(base.PycolatorDriver):
 
     def set_options(self):
         super().set_options()
-        options = self.define_options(['maxlength', 'minlength'],
-                                      pycolator_options)
+        options = self.define_options(['maxlength', 'minlength',
+                                       'workers'], pycolator_options)
         self.options.update(options)
 
     def set_features(self):
         # FIXME psm filter len too!
         self.features = {
-            'psm': preparation.filter_peptide_length(
-                self.allpsms, 'psm', self.ns, self.minlength, self.maxlength),
-            'peptide': preparation.filter_peptide_length(
-                self.allpeps, 'pep', self.ns, self.minlength, self.maxlength)
+            'psm': self.get_filtered_features(
+                'psm', preparation.filter_peptide_length,
+                ('psm', self.ns, self.minlength, self.maxlength)),
+            'peptide': self.get_filtered_features(
+                'peptide', preparation.filter_peptide_length,
+                ('pep', self.ns, self.minlength, self.maxlength))
         }
 
 
-class FilterUniquePeptides(base.PycolatorDriver):
+class FilterUniquePeptides(FilterDriver):
     """This class processes multiple percolator runs from fractions and
     filters out the best scoring peptides."""
     outsuffix = '_filtuni.xml'
@@ -40,8 +64,8 @@ class FilterUniquePeptides(base.PycolatorDriver):
         self.options.update(self.define_options(['score'], pycolator_options))
 
     def get_all_psms(self):
-        """Override parent method so it returns strings instead"""
-        return self.get_all_psms_strings()
+        """Override parent method so it returns PSM bytes only"""
+        return self.get_all_psms_raw()
 
     def set_features(self):
         uniquepeps = preparation.filter_unique_peptides(self.allpeps,
@@ -50,7 +74,7 @@ class FilterUniquePeptides(base.PycolatorDriver):
         self.features = {'psm': self.allpsms, 'peptide': uniquepeps}
 
 
-class FilterWholeProteinSequence(base.PycolatorDriver):
+class FilterWholeProteinSequence(FilterDriver):
     """This class processes multiple percolator runs from fractions and
     filters out first peptides that are found in a specified searchspace. Then
     it keeps the remaining best scoring unique peptides."""
@@ -64,31 +88,24 @@ class FilterWholeProteinSequence(base.PycolatorDriver):
         super().set_options()
         self.options.update(self.define_options(['deamidate', 'fasta',
                                                  'minlength', 'lookupfn',
-                                                 'forcetryp'],
+                                                 'forcetryp', 'workers'],
                                                 pycolator_options))
 
     def set_features(self):
+        whole_proteins = preparation.get_whole_proteins(self.fasta)
         self.features = {
-            'peptide': preparation.filter_whole_proteins(self.allpeps,
-                                                         self.fasta,
-                                                         self.lookup,
-                                                         'pep',
-                                                         self.ns,
-                                                         self.deamidate,
-                                                         self.minlength,
-                                                         self.forcetryp),
-            'psm': preparation.filter_whole_proteins(self.allpsms,
-                                                     self.fasta,
-                                                     self.lookup,
-                                                     'psm',
-                                                     self.ns,
-                                                     self.deamidate,
-                                                     self.minlength,
-                                                     self.forcetryp)
+            'peptide': self.get_filtered_features(
+                'peptide', preparation.filter_whole_proteins,
+                (whole_proteins, self.lookup, 'pep', self.ns, self.deamidate,
+                 self.minlength, self.forcetryp)),
+            'psm': self.get_filtered_features(
+                'psm', preparation.filter_whole_proteins,
+                (whole_proteins, self.lookup, 'psm', self.ns, self.deamidate,
+                 self.minlength, self.forcetryp)),
         }
 
 
-class FilterPeptideSequence(base.PycolatorDriver):
+class FilterPeptideSequence(FilterDriver):
     """This class processes multiple percolator runs from fractions and
     filters out first peptides that are found in a specified searchspace. Then
     it keeps the remaining best scoring unique peptides."""
@@ -101,21 +118,15 @@ class FilterPeptideSequence(base.PycolatorDriver):
     def set_options(self):
         super().set_options()
         self.options.update(self.define_options(['falloff', 'deamidate',
-                                                 'lookupfn'],
+                                                 'lookupfn', 'workers'],
                                                 pycolator_options))
 
     def set_features(self):
         self.features = {
-            'peptide': preparation.filter_known_searchspace(self.allpeps,
-                                                            'pep',
-                                                            self.lookup,
-                                                            self.ns,
-                                                            self.falloff,
-                                                            self.deamidate),
-            'psm': preparation.filter_known_searchspace(self.allpsms,
-                                                        'psm',
-                                                        self.lookup,
-                                                        self.ns,
-                                                        self.falloff,
-                                                        self.deamidate),
+            'peptide': self.get_filtered_features(
+                'peptide', preparation.filter_known_searchspace,
+                ('pep', self.lookup, self.ns, self.falloff, self.deamidate)),
+            'psm': self.get_filtered_features(
+                'psm', preparation.filter_known_searchspace,
+                ('psm', self.lookup, self.ns, self.falloff, self.deamidate)),
         }
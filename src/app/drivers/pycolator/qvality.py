@@ -9,6 +9,7 @@ class QvalityDriver(base.PycolatorDriver):
     """Runs qvality from two Percolator XML files. One containing target
     PSMs or peptides, and the other containing decoys."""
     outsuffix = '_qvalityout.txt'
+    compress = False
     command = 'qvality'
     commandhelp = ('Runs qvality on an inputfile: target and decoy data. '
                    'When using separate files for target and decoy, '
@@ -28,7 +29,9 @@ class QvalityDriver(base.PycolatorDriver):
                 self.qvalityoptions.append(option.replace('***', '--'))
 
     def set_options(self):
+        """Qvality writes its own output, which cannot be compressed"""
         super().set_options()
+        del(self.options['--compress'])
         options = self.define_options(['decoyfn', 'featuretype', 'qoptions'],
                                       pycolator_options)
         self.options.update(options)
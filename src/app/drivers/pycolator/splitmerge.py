@@ -1,7 +1,9 @@
 from app.drivers.pycolator import base
 from app.actions.pycolator import splitmerge as preparation
+from app.actions.pycolator import parallel
 from app.readers import pycolator as readers
 from app.drivers.options import pycolator_options
+from app.writers import pycolator as writers
 
 
 class SplitDriver(base.PycolatorDriver):
@@ -9,11 +11,9 @@ class SplitDriver(base.PycolatorDriver):
 
     def run(self):
         self.set_filter_types()
-        for filter_type, suffix in self.filter_types:
-            self.prepare()
-            self.set_features(filter_type)
-            self.outsuffix = suffix
-            self.write()
+        self.prepare()
+        self.set_features()
+        self.write()
         self.finish()
 
     def set_options(self):
@@ -21,16 +21,33 @@ class SplitDriver(base.PycolatorDriver):
         output file"""
         super().set_options()
         del(self.options['-o'])
+        self.options.update(self.define_options(['workers'],
+                                                pycolator_options))
 
-    def set_features(self, filter_type):
-        """Calls splitter to split percolator output into target/decoy
-        elements.
-        Writes two new xml files with features. Currently only psms and
-        peptides. Proteins not here, since one cannot do protein inference
+    def prepare(self):
+        self.ns, self.static_xml = self.prepare_percolator_output(self.fn)
+        self.allfeatures = readers.generate_psms_and_peptides(self.fn)
+
+    def get_split_features(self, transform, transform_args):
+        """Returns features with their splits from transform, which is run
+        on chunks of the input in parallel when using more than one
+        worker"""
+        if self.workers > 1:
+            return parallel.generate_transformed_chunks(
+                self.fn, self.ns, ['psm', 'peptide'], transform,
+                transform_args, self.workers, with_type=True)
+        return transform(self.allfeatures, *transform_args)
+
+    def write(self):
+        """Writes a new xml file with features per filter type, in a
+        single pass over the input. Currently only psms and peptides.
+        Proteins not here, since one cannot do protein inference
         before having merged and remapped multifraction data anyway.
         """
-        elements_to_split = {'psm': self.allpsms, 'peptide': self.allpeps}
-        self.features = self.splitfunc(elements_to_split, self.ns, filter_type)
+        outfns = {filter_type: self.create_outfilepath(self.fn, suffix)
+                  for filter_type, suffix in self.filter_types}
+        writers.write_split_percolator_xml(self.static_xml, self.features,
+                                           outfns)
 
 
 class SplitTDDriver(SplitDriver):
@@ -41,9 +58,9 @@ class SplitTDDriver(SplitDriver):
         self.filter_types = [('target', '_target.xml'),
                              ('decoy', '_decoy.xml')]
 
-    def set_features(self, filter_type):
-        self.splitfunc = preparation.split_target_decoy
-        super().set_features(filter_type)
+    def set_features(self):
+        self.features = self.get_split_features(
+            preparation.split_target_decoy, (self.ns,))
 
 
 class SplitProteinDriver(SplitDriver):
@@ -54,13 +71,13 @@ class SplitProteinDriver(SplitDriver):
 
     def set_filter_types(self):
         maxdigits = len(str(len(self.protheaders)))
-        self.filter_types = [(headers, '_h{i:0{dig}d}.xml'.format(
-            i=ix, dig=maxdigits))
-            for ix, headers in enumerate(self.protheaders)]
+        self.filter_types = [(ix, '_h{i:0{dig}d}.xml'.format(
+            i=ix, dig=maxdigits)) for ix in range(len(self.protheaders))]
 
-    def set_features(self, filter_type):
-        self.splitfunc = preparation.split_protein_header_id_type
-        super().set_features(filter_type)
+    def set_features(self):
+        self.features = self.get_split_features(
+            preparation.split_protein_header_id_type,
+            (self.ns, self.protheaders))
 
     def set_options(self):
         super().set_options()
@@ -93,7 +110,7 @@ class MergeDriver(base.PycolatorDriver):
 
     def set_features(self):
         """"Merge all psms and peptides"""
-        allpsms_str = readers.generate_psms_multiple_fractions_strings(
-            self.mergefiles, self.ns)
+        allpsms_raw = readers.generate_psms_multiple_fractions_raw(
+            self.mergefiles)
         allpeps = preparation.merge_peptides(self.mergefiles, self.ns)
-        self.features = {'psm': allpsms_str, 'peptide': allpeps}
+        self.features = {'psm': allpsms_raw, 'peptide': allpeps}
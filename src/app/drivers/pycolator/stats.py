@@ -21,11 +21,11 @@ class ReassignmentDriver(base.PycolatorDriver):
             self.features = {
                 'psm': reassign.reassign_elements(self.allpsms, stats,
                                                   self.ns),
-                'peptide': self.get_all_peptides_strings(),
+                'peptide': self.get_all_peptides_raw(),
             }
         elif self.featuretype == 'peptide':
             self.features = {
                 'peptide': reassign.reassign_elements(self.allpeps, stats,
                                                       self.ns),
-                'psm': self.get_all_psms_strings(),
+                'psm': self.get_all_psms_raw(),
             }
@@ -353,11 +353,84 @@ mslookup_tables = {'biosets': ['set_id INTEGER PRIMARY KEY',
                                         'pos INTEGER'],
                    }
 
+# Schema for lookups with integer keys for spectra and PSMs. The text IDs
+# (e.g. mzmlfileid_scannr) are kept in spectra_key and psm_key columns, all
+# other tables reference the integer rowids.
+integer_key_tables = {'mzml': ['spectra_id INTEGER PRIMARY KEY',
+                               'spectra_key TEXT',
+                               'mzmlfile_id INTEGER',
+                               'scan_nr TEXT',
+                               'charge INTEGER',
+                               'mz DOUBLE',
+                               'retention_time DOUBLE',
+                               'ion_injection_time DOUBLE',
+                               'FOREIGN KEY(mzmlfile_id)'
+                               'REFERENCES mzmlfiles'],
+                      'isobaric_quant': ['spectra_id INTEGER',
+                                         'channel_id INTEGER',
+                                         'intensity REAL',
+                                         'FOREIGN KEY(spectra_id)'
+                                         'REFERENCES mzml',
+                                         'FOREIGN KEY(channel_id)'
+                                         'REFERENCES isobaric_channels'
+                                         ],
+                      'ms1_align': ['spectra_id INTEGER',
+                                    'feature_id INTEGER',
+                                    'FOREIGN KEY(spectra_id) '
+                                    'REFERENCES mzml '
+                                    'FOREIGN KEY(feature_id) '
+                                    'REFERENCES ms1_quant',
+                                    ],
+                      'psms': ['psm_id INTEGER PRIMARY KEY',
+                               'psm_key TEXT NOT NULL',
+                               'pep_id INTEGER',
+                               'score TEXT',
+                               'spectra_id INTEGER',
+                               'FOREIGN KEY(pep_id)'
+                               'REFERENCES peptide_sequences '
+                               'FOREIGN KEY(spectra_id)'
+                               'REFERENCES mzml'
+                               ],
+                      'psmrows': ['psm_id INTEGER',
+                                  'rownr INTEGER',
+                                  'FOREIGN KEY(psm_id) '
+                                  'REFERENCES psms(psm_id)'],
+                      'protein_psm': ['protein_acc TEXT',
+                                      'psm_id INTEGER',
+                                      'FOREIGN KEY(protein_acc) '
+                                      'REFERENCES proteins(protein_acc) '
+                                      'FOREIGN KEY(psm_id) '
+                                      'REFERENCES psms(psm_id)'],
+                      'psm_protein_groups': ['psm_id INTEGER',
+                                             'master_id INTEGER',
+                                             'FOREIGN KEY(psm_id) REFERENCES'
+                                             ' psms(psm_id)',
+                                             'FOREIGN KEY(master_id) '
+                                             'REFERENCES '
+                                             'protein_group_master(master_id)'
+                                             ],
+                      }
+
 
 class DatabaseConnection(object):
     def __init__(self, fn=None):
         """SQLite connecting when given filename"""
         self.fn = fn
+        self.integer_keys = False
+        self.bulk_load = False
+        self.deferred_indexes = []
+        if self.fn is not None:
+            self.connect(self.fn)
+
+    def __getstate__(self):
+        """Lookups are pickled without their connection, e.g. when passing
+        them to worker processes, which reconnect to the file instead"""
+        state = self.__dict__.copy()
+        state.pop('conn', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
         if self.fn is not None:
             self.connect(self.fn)
 
@@ -369,7 +442,10 @@ class DatabaseConnection(object):
         """Creates database tables in sqlite lookup db"""
         cursor = self.get_cursor()
         for table in tables:
-            columns = mslookup_tables[table]
+            if self.integer_keys and table in integer_key_tables:
+                columns = integer_key_tables[table]
+            else:
+                columns = mslookup_tables[table]
             try:
                 cursor.execute('CREATE TABLE {0}({1})'.format(
                     table, ', '.join(columns)))
@@ -379,7 +455,7 @@ class DatabaseConnection(object):
                       'add to existing tables instead of creating '
                       'new.'.format(table))
             else:
-                self.conn.commit()
+                self.commit()
 
     def connect(self, fn):
         """SQLite connect method initialize db"""
@@ -389,6 +465,63 @@ class DatabaseConnection(object):
         cur.execute('PRAGMA FOREIGN_KEYS=ON')
         cur.execute('PRAGMA cache_size=10000')
         cur.execute('PRAGMA journal_mode=MEMORY')
+        self.integer_keys = self.check_integer_keys()
+
+    def check_integer_keys(self):
+        """Returns True if the spectra table of the lookup is keyed
+        on integers rather than on text IDs"""
+        cursor = self.get_cursor()
+        cursor.execute('PRAGMA table_info(mzml)')
+        return any(col[1] == 'spectra_id' and col[2] == 'INTEGER'
+                   for col in cursor)
+
+    def use_integer_keys(self):
+        """Creates new spectra and PSM tables with integer keys, unless
+        the lookup already contains a text keyed spectra table"""
+        cursor = self.get_cursor()
+        cursor.execute('PRAGMA table_info(mzml)')
+        if cursor.fetchall() and not self.integer_keys:
+            print('Warning: lookup already contains spectra with text IDs, '
+                  'will not use integer keys')
+        else:
+            self.integer_keys = True
+
+    def start_bulk_load(self, memory_mb):
+        """Sets up the connection for loading large amounts of data. Foreign
+        key checks and syncing are switched off, the whole load is run in a
+        single transaction and indexes are deferred until the load is
+        finished. The memory budget (MB) is split between page cache and
+        memory mapped I/O."""
+        cur = self.get_cursor()
+        cur.execute('PRAGMA foreign_keys=OFF')
+        cur.execute('PRAGMA synchronous=OFF')
+        cur.execute('PRAGMA temp_store=MEMORY')
+        cur.execute('PRAGMA cache_size=-{}'.format(memory_mb * 512))
+        cur.execute('PRAGMA mmap_size={}'.format(memory_mb * 512 * 1024))
+        self.bulk_load = True
+
+    def finish_bulk_load(self):
+        """Builds deferred indexes, commits the load and analyzes the
+        lookup for the query planner"""
+        self.bulk_load = False
+        self.create_deferred_indexes()
+        self.conn.commit()
+        cur = self.get_cursor()
+        cur.execute('ANALYZE')
+        cur.execute('PRAGMA synchronous=FULL')
+        cur.execute('PRAGMA foreign_keys=ON')
+
+    def create_deferred_indexes(self):
+        """Creates indexes that have been deferred during bulk loading, e.g.
+        when they are needed for querying before the load is finished"""
+        indexes, self.deferred_indexes = self.deferred_indexes, []
+        for index_name, table, column in indexes:
+            self.create_index(index_name, table, column)
+
+    def commit(self):
+        """Commits to lookup, unless bulk loading in a single transaction"""
+        if not self.bulk_load:
+            self.conn.commit()
 
     def get_cursor(self):
         """Quickly get cursor, abstracting connection"""
@@ -399,7 +532,14 @@ class DatabaseConnection(object):
         self.conn.close()
 
     def index_column(self, index_name, table, column):
-        """Called by interfaces to index specific column in table"""
+        """Called by interfaces to index specific column in table. Indexing
+        is deferred when bulk loading"""
+        if self.bulk_load:
+            self.deferred_indexes.append((index_name, table, column))
+        else:
+            self.create_index(index_name, table, column)
+
+    def create_index(self, index_name, table, column):
         cursor = self.get_cursor()
         try:
             cursor.execute(
@@ -408,7 +548,7 @@ class DatabaseConnection(object):
             print(error)
             print('Skipping index creation and assuming it exists already')
         else:
-            self.conn.commit()
+            self.commit()
 
     def get_inclause(self, inlist):
         """Returns SQL IN clauses"""
@@ -424,7 +564,7 @@ class DatabaseConnection(object):
         """Abstraction over executemany method"""
         cursor = self.get_cursor()
         cursor.executemany(sql, values)
-        self.conn.commit()
+        self.commit()
 
     def execute_sql(self, sql):
         """Executes SQL and returns cursor for it"""
@@ -443,16 +583,11 @@ class ResultLookupInterface(DatabaseConnection):
         cursor.execute('SELECT mzmlfile_id, mzmlfilename FROM mzmlfiles')
         return {fn: fnid for fnid, fn in cursor.fetchall()}
 
-    def get_spectra_id(self, fn_id, retention_time=None, scan_nr=None):
-        """Returns spectra id for spectra filename and retention time"""
+    def get_spectra_rts_ids(self, fn_id):
+        """Returns retention times and spectra ids of a spectra file,
+        sorted on retention time"""
         cursor = self.get_cursor()
-        sql = 'SELECT spectra_id FROM mzml WHERE mzmlfile_id=? '
-        values = [fn_id]
-        if retention_time is not None:
-            sql = '{0} AND retention_time=?'.format(sql)
-            values.append(retention_time)
-        if scan_nr is not None:
-            sql = '{0} AND scan_nr=?'.format(sql)
-            values.append(scan_nr)
-        cursor.execute(sql, tuple(values))
-        return cursor.fetchone()[0]
+        cursor.execute('SELECT retention_time, spectra_id FROM mzml '
+                       'WHERE mzmlfile_id=? ORDER BY retention_time',
+                       (fn_id,))
+        return cursor
@@ -30,7 +30,7 @@ class ProteinGroupDB(ResultLookupInterface):
         cursor.executemany(
             'INSERT INTO psm_protein_groups(psm_id, master_id) '
             'VALUES(?, ?)', psms)
-        self.conn.commit()
+        self.commit()
         self.index_column('psm_pg_index', 'psm_protein_groups', 'master_id')
         self.index_column('psm_pg_psmid_index', 'psm_protein_groups', 'psm_id')
 
@@ -38,7 +38,7 @@ class ProteinGroupDB(ResultLookupInterface):
         cur = self.get_cursor()
         sql = 'UPDATE protein_group_master SET protein_acc=? WHERE master_id=?'
         cur.executemany(sql, new_masters)
-        self.conn.commit()
+        self.commit()
 
     def get_master_ids(self):
         cur = self.get_cursor()
@@ -50,7 +50,7 @@ class ProteinGroupDB(ResultLookupInterface):
         sql = ('INSERT INTO protein_coverage(protein_acc, coverage) '
                'VALUES(?, ?)')
         cursor.executemany(sql, coverage)
-        self.conn.commit()
+        self.commit()
         self.index_column('cov_index', 'protein_coverage', 'protein_acc')
 
     def store_protein_group_content(self, protein_groups):
@@ -59,7 +59,7 @@ class ProteinGroupDB(ResultLookupInterface):
                            'protein_acc, master_id, peptide_count, '
                            'psm_count, protein_score) '
                            'VALUES(?, ?, ?, ?, ?)', protein_groups)
-        self.conn.commit()
+        self.commit()
 
     def index_protein_group_content(self):
         self.index_column('pgc_master_index', 'protein_group_content',
@@ -78,35 +78,25 @@ class ProteinGroupDB(ResultLookupInterface):
 
     def get_proteins_for_peptide(self, psm_id):
         """Returns list of proteins for a passed psm_id"""
-        protsql = self.get_sql_select(['protein_acc'], 'protein_psm')
-        protsql = '{0} WHERE psm_id=?'.format(protsql)
+        if self.integer_keys:
+            protsql = self.get_sql_select(
+                ['protein_acc'], 'protein_psm JOIN psms USING(psm_id)')
+            protsql = '{0} WHERE psm_key=?'.format(protsql)
+        else:
+            protsql = self.get_sql_select(['protein_acc'], 'protein_psm')
+            protsql = '{0} WHERE psm_id=?'.format(protsql)
         cursor = self.get_cursor()
         proteins = cursor.execute(protsql, psm_id).fetchall()
         return [x[0] for x in proteins]
 
-    def get_protpepmap_from_proteins(self, proteins):
-        pepsql = self.get_sql_select(['protein_acc', 'psm_id'],
-                                     'protein_psm',
-                                     distinct=True)
-        pepsql = '{0} WHERE protein_acc {1}'.format(
-            pepsql, self.get_inclause(proteins))
-        cursor = self.get_cursor()
-        protpeps = cursor.execute(pepsql, proteins).fetchall()
-        outmap = {}
-        for protein, peptide in protpeps:
-            try:
-                outmap[protein].append(peptide)
-            except KeyError:
-                outmap[protein] = [peptide]
-        return outmap
-
     def get_all_proteins_psms_seq(self):
-        sql = ('SELECT p.protein_acc, ps.sequence, pp.psm_id, peps.sequence '
+        sql = ('SELECT p.protein_acc, ps.sequence, peps.sequence '
                'FROM proteins AS p '
                'JOIN protein_seq AS ps USING(protein_acc) '
                'JOIN protein_psm AS pp USING(protein_acc) '
                'JOIN psms AS psms USING(psm_id) '
-               'JOIN peptide_sequences AS peps USING(pep_id)'
+               'JOIN peptide_sequences AS peps USING(pep_id) '
+               'ORDER BY p.protein_acc'
                )
         cursor = self.get_cursor()
         return cursor.execute(sql)
@@ -13,7 +13,7 @@ class PSMDB(ResultLookupInterface):
         cursor.executemany(
             'INSERT INTO proteins(protein_acc) '
             'VALUES(?)', proteins)
-        self.conn.commit()
+        self.commit()
         cursor = self.get_cursor()
         if evidence_lvls:
             cursor.executemany(
@@ -23,7 +23,9 @@ class PSMDB(ResultLookupInterface):
             cursor.executemany(
                 'INSERT INTO protein_seq(protein_acc, sequence) '
                 'VALUES(?, ?)', sequences)
-        self.conn.commit()
+        self.commit()
+
+    def index_proteins(self):
         self.index_column('proteins_index', 'proteins', 'protein_acc')
         self.index_column('evidence_index', 'protein_evidence', 'protein_acc')
 
@@ -32,7 +34,7 @@ class PSMDB(ResultLookupInterface):
         cursor.executemany(
             'INSERT INTO prot_desc(protein_acc, description) '
             'VALUES(?, ?)', descriptions)
-        self.conn.commit()
+        self.commit()
         self.index_column('protdesc_index', 'prot_desc', 'protein_acc')
 
     def store_gene_and_associated_id(self, feats):
@@ -47,7 +49,7 @@ class PSMDB(ResultLookupInterface):
         cursor = self.get_cursor()
         cursor.executemany(
             'INSERT INTO genes(gene_acc, protein_acc) VALUES(?, ?)', genes)
-        self.conn.commit()
+        self.commit()
         self.index_column('gene_index', 'genes', 'protein_acc')
 
     def store_associated_ids(self, assoc_ids):
@@ -55,7 +57,7 @@ class PSMDB(ResultLookupInterface):
         cursor.executemany(
             'INSERT INTO associated_ids(assoc_id, protein_acc) VALUES(?, ?)',
             assoc_ids)
-        self.conn.commit()
+        self.commit()
         self.index_column('associd_index', 'associated_ids', 'protein_acc')
 
     def get_protein_gene_map(self):
@@ -75,39 +77,51 @@ class PSMDB(ResultLookupInterface):
     def store_pepseqs(self, sequences):
         cursor = self.get_cursor()
         cursor.executemany(
-            'INSERT INTO peptide_sequences(sequence) VALUES(?)', sequences)
-        self.conn.commit()
+            'INSERT INTO peptide_sequences(pep_id, sequence) VALUES(?, ?)',
+            sequences)
+        self.commit()
 
-    def store_psms(self, psms):
+    def get_highest_pep_id(self):
         cursor = self.get_cursor()
+        cursor.execute('SELECT MAX(pep_id) FROM peptide_sequences')
+        return cursor.fetchone()[0] or 0
+
+    def get_highest_psm_id(self):
+        cursor = self.get_cursor()
+        cursor.execute('SELECT MAX(psm_id) FROM psms')
+        return cursor.fetchone()[0] or 0
+
+    def store_psms(self, psms, psmrows):
+        cursor = self.get_cursor()
+        if self.integer_keys:
+            cursor.executemany(
+                'INSERT INTO psms(psm_id, psm_key, pep_id, score, spectra_id) '
+                'VALUES(?, ?, ?, ?, '
+                '(SELECT spectra_id FROM mzml WHERE spectra_key=?))',
+                ((psm['psm_id'], psm['psm_key'], psm['seq'], psm['score'],
+                  psm['spec_id']) for psm in psms))
+        else:
+            cursor.executemany(
+                'INSERT INTO psms(psm_id, pep_id, score, spectra_id) '
+                'VALUES(?, ?, ?, ?)', ((psm['psm_id'], psm['seq'],
+                                        psm['score'], psm['spec_id'])
+                                       for psm in psms))
         cursor.executemany(
-            'INSERT INTO psms(psm_id, pep_id, score, spectra_id) '
-            'VALUES(?, ?, ?, ?)', ((psm['psm_id'], psm['seq'], psm['score'],
-                                    psm['spec_id'])
-                                   for psm in psms))
-        cursor.executemany(
-            'INSERT INTO psmrows(psm_id, rownr) VALUES(?, ?)',
-            ((psm['psm_id'], psm['rownr']) for psm in psms))
-        self.conn.commit()
-
-    def store_peptides_proteins(self, allpepprot, psmids_to_store):
-        ppmap = {psm_id: allpepprot[psm_id] for psm_id in psmids_to_store}
-        prot_psm_ids = ((prot_acc, psm_id)
-                        for psm_id, prots in ppmap.items()
-                        for prot_acc in prots)
+            'INSERT INTO psmrows(psm_id, rownr) VALUES(?, ?)', psmrows)
+        self.commit()
+
+    def store_peptides_proteins(self, prot_psm_ids):
         cursor = self.get_cursor()
         cursor.executemany(
             'INSERT INTO protein_psm(protein_acc, psm_id)'
             ' VALUES (?, ?)', prot_psm_ids)
-        self.conn.commit()
-
-    def get_peptide_seq_map(self):
-        cursor = self.get_cursor()
-        seqs = cursor.execute('SELECT pep_id, sequence FROM peptide_sequences')
-        return {seq: pepid for pepid, seq in seqs.fetchall()}
+        self.commit()
 
     def index_psms(self):
-        self.index_column('psmid_index', 'psms', 'psm_id')
+        if self.integer_keys:
+            self.index_column('psmkey_index', 'psms', 'psm_key')
+        else:
+            self.index_column('psmid_index', 'psms', 'psm_id')
         self.index_column('psmspecid_index', 'psms', 'spectra_id')
         self.index_column('psmrowid_index', 'psmrows', 'psm_id')
         self.index_column('psmrow_index', 'psmrows', 'rownr')
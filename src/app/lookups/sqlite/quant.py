@@ -27,14 +27,6 @@ class QuantDB(ResultLookupInterface):
         cursor = self.get_cursor()
         return cursor.execute(sql), sqlfields
 
-    def get_precursor_quant_window(self, windowsize, minmz):
-        cursor = self.get_cursor()
-        return cursor.execute(
-            'SELECT feature_id, mzmlfile_id, charge, mz, retention_time '
-            'FROM ms1_quant '
-            'WHERE mz > ? ORDER BY mz '
-            'LIMIT ?', (minmz, windowsize))
-
     def get_all_quantmaps(self):
         """Returns all unique quant channels from lookup as list"""
         cursor = self.get_cursor()
@@ -84,7 +76,12 @@ class PrecursorQuantDB(QuantDB):
         self.index_column('charge_index', 'ms1_quant', 'charge')
         self.index_column('feat_mz_index', 'ms1_quant', 'mz')
 
-    def get_spectra_mz_sorted(self):
+    def get_all_precursor_quants(self):
+        return self.get_cursor().execute(
+            'SELECT feature_id, mzmlfile_id, charge, mz, retention_time '
+            'FROM ms1_quant')
+
+    def get_all_spectra(self):
         return self.get_cursor().execute(
             'SELECT spectra_id, mzmlfile_id, charge, mz, retention_time '
-            'FROM mzml ORDER BY mz')
+            'FROM mzml')
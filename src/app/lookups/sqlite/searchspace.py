@@ -16,7 +16,7 @@ class SearchSpaceDB(DatabaseConnection):
         cursor = self.get_cursor()
         cursor.executemany(
             'INSERT INTO known_searchspace(seqs) VALUES (?)', peps)
-        self.conn.commit()
+        self.commit()
 
     def index_peps(self, reverse_seqs):
         if reverse_seqs:
@@ -30,11 +30,11 @@ class SearchSpaceDB(DatabaseConnection):
         cursor = self.get_cursor()
         cursor.executemany('INSERT INTO protein_peptides(seq, protid, pos) '
                            'VALUES(?, ?, ?)', pepproteins)
-        self.conn.commit()
+        self.commit()
 
     def index_proteins(self):
         self.index_column('pepix', 'protein_peptides', 'seq')
-        self.conn.commit()
+        self.commit()
 
     def check_seq_exists(self, seq, amount_ntermwildcards):
         """Look up sequence in sqlite DB. Returns True or False if it
@@ -7,13 +7,20 @@ class SpectraDB(BioSetDB):
         self.create_tables(['mzml'])
 
     def store_mzmls(self, spectra):
+        """Stores spectra, the first field of each being its text ID. With
+        integer keys the text ID goes to spectra_key and SQLite assigns
+        spectra_id"""
+        idcol = 'spectra_key' if self.integer_keys else 'spectra_id'
         self.store_many(
-            'INSERT INTO mzml(spectra_id, mzmlfile_id, scan_nr, charge, mz, '
+            'INSERT INTO mzml({}, mzmlfile_id, scan_nr, charge, mz, '
             'retention_time, ion_injection_time) '
-            'VALUES (?, ?, ?, ?, ?, ?, ?)', spectra)
+            'VALUES (?, ?, ?, ?, ?, ?, ?)'.format(idcol), spectra)
 
     def index_mzml(self):
-        self.index_column('spectra_id_index', 'mzml', 'spectra_id')
+        if self.integer_keys:
+            self.index_column('spectra_key_index', 'mzml', 'spectra_key')
+        else:
+            self.index_column('spectra_id_index', 'mzml', 'spectra_id')
         self.index_column('mzmlfnid_mzml_index', 'mzml', 'mzmlfile_id')
         self.index_column('scan_index', 'mzml', 'scan_nr')
         self.index_column('specrt_index', 'mzml', 'retention_time')
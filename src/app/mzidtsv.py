@@ -4,7 +4,7 @@ import sys
 
 from app.drivers.mzidtsv import (spectra, percolator, proteingrouping,
                                  prot2gene, quant, splitmerge,
-                                 filter_confidence, isonormalize)
+                                 filter_confidence, isonormalize, pipeline)
 from app.drivers import startup
 
 
@@ -19,5 +19,6 @@ def main():
                prot2gene.TSVGeneFromProteinDriver(),
                isonormalize.PSMIsoquantRatioDriver(),
                isonormalize.PSMIsoquantNormalizeDriver(),
+               pipeline.MzidTSVPipelineDriver(),
                ]
     startup.start_msstitch(drivers, sys.argv)
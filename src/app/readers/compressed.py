@@ -0,0 +1,102 @@
+import io
+import os
+import gzip
+import shutil
+import subprocess
+import threading
+
+PIPE_READ_CHUNK = 1048576
+COMPRESSION_MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+DECOMPRESS_COMMANDS = {'gzip': ['gzip', '-dc'], 'zstd': ['zstd', '-dcq']}
+
+
+def get_compression(fn):
+    """Returns the compression format (gzip or zstd) of a file by checking
+    its first bytes, or False for uncompressed files"""
+    with open(fn, 'rb') as fp:
+        start = fp.read(4)
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if start.startswith(magic):
+            return compression
+    return False
+
+
+def open_input(fn, mode='r'):
+    """Opens a file for reading like open() does, but decompresses gzip
+    and zstd files transparently. Decompression runs in a subprocess, or
+    in a thread when no gzip executable is found, and overlaps with
+    whatever parses the output."""
+    compression = get_compression(fn)
+    if not compression:
+        return open(fn, mode)
+    fp = io.BufferedReader(PipedDecompressor(fn, compression),
+                           PIPE_READ_CHUNK)
+    if 'b' in mode:
+        return fp
+    return io.TextIOWrapper(fp)
+
+
+class PipedDecompressor(io.RawIOBase):
+    """Raw binary stream reading the decompressed output of a file from a
+    pipe that is fed by a subprocess or thread"""
+    def __init__(self, fn, compression):
+        self.fn = fn
+        self.proc, self.thread, self.error = None, None, None
+        command = DECOMPRESS_COMMANDS[compression]
+        executable = shutil.which(command[0])
+        if executable is not None:
+            self.proc = subprocess.Popen([executable] + command[1:] + [fn],
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, bufsize=0)
+            self.pipe = self.proc.stdout
+        elif compression == 'gzip':
+            readfd, writefd = os.pipe()
+            self.pipe = os.fdopen(readfd, 'rb', buffering=0)
+            self.thread = threading.Thread(target=self.decompress_gzip,
+                                           args=(writefd,), daemon=True)
+            self.thread.start()
+        else:
+            raise RuntimeError('Cannot read {}-compressed file {}, no {} '
+                               'executable found'.format(compression, fn,
+                                                         command[0]))
+
+    def decompress_gzip(self, writefd):
+        try:
+            with gzip.open(self.fn, 'rb') as gzfp, \
+                    os.fdopen(writefd, 'wb') as pipe:
+                for chunk in iter(lambda: gzfp.read(PIPE_READ_CHUNK), b''):
+                    pipe.write(chunk)
+        except BrokenPipeError:
+            pass
+        except Exception as error:
+            self.error = error
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        nbytes = self.pipe.readinto(buf)
+        if not nbytes:
+            self.check_finished()
+        return nbytes
+
+    def check_finished(self):
+        if self.proc is not None and self.proc.wait() != 0:
+            raise RuntimeError('Could not decompress file {}'.format(self.fn))
+        elif self.thread is not None:
+            self.thread.join()
+            if self.error is not None:
+                raise RuntimeError('Could not decompress file {}: '
+                                   '{}'.format(self.fn, self.error))
+
+    def close(self):
+        if self.closed:
+            return
+        self.pipe.close()
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+        elif self.thread is not None:
+            self.thread.join()
+        super().close()
@@ -1,5 +1,7 @@
 from Bio import SeqIO
 
+from app.readers.compressed import open_input
+
 
 def get_proteins_for_db(fastafn):
     """Runs through fasta file and returns proteins accession nrs, sequences
@@ -16,7 +18,7 @@ def get_proteins_for_db(fastafn):
 
 
 def parse_biomart_fn(martfn, ensg_id, ensp_id, desc_id, symb_id, alt_symb_id):
-    with open(martfn) as fp:
+    with open_input(martfn) as fp:
         header = next(fp).strip().split('\t')
         ensg = header.index(ensg_id)
         ensp = header.index(ensp_id)
@@ -40,7 +42,7 @@ def get_proteins_genes(fastafn, fastadelim=None, genefield=None):
     a passed file. If the file is FASTA from ENSEMBL or UniProt, only genes and
     descriptions are given and symbol will be None. If the file is a ENSEMBL
     Biomart mapping file it tries to parse that and also return the rest"""
-    with open(fastafn) as fp:
+    with open_input(fastafn) as fp:
         firstline = next(fp).strip()
     if firstline[0] == '>':
         for record in parse_fasta(fastafn):
@@ -65,7 +67,7 @@ def parse_protein_identifier(record):
 
 
 def parse_fasta(fn):
-    with open(fn) as fp:
+    with open_input(fn) as fp:
         for record in SeqIO.parse(fp, 'fasta'):
             yield record
 
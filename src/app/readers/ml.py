@@ -1,5 +1,9 @@
 def get_scan_nr(element, attribname):
     """General method to get a scan nr from xml element of mzML/mzIdentML"""
-    info = element.attrib[attribname]
+    return get_scan_nr_from_id(element.attrib[attribname])
+
+
+def get_scan_nr_from_id(info):
+    """Returns scan nr from a native spectrum ID string"""
     infomap = {y[0]: y[1] for y in [x.split('=') for x in info.split()]}
     return infomap['scan']
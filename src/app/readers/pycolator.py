@@ -1,38 +1,45 @@
 from lxml import etree
 from app.readers import xml as basereader
+from app.readers.compressed import open_input
+
+COMPILED_XPATHS = {}
 
 
 def get_percolator_static_xml(fn, ns):
     root = basereader.get_root_el(fn)
-    process = etree.iterparse(fn, tag='{%s}process_info' % ns['xmlns'],
-                              events=('start',))
-    root.append(next(process)[1])
+    with open_input(fn, 'rb') as fp:
+        process = etree.iterparse(fp, tag='{%s}process_info' % ns['xmlns'],
+                                  events=('start',))
+        root.append(next(process)[1])
     return root
 
 
-# Stringified element generators interfaces
-def generate_psms_multiple_fractions_strings(input_files, ns):
-    return basereader.generate_tags_multiple_files_strings(input_files,
-                                                           ns, 'psm',
-                                                           ['peptide',
-                                                            'protein'])
+# Raw element bytes generators interfaces
+def generate_psms_multiple_fractions_raw(input_files):
+    return basereader.generate_raw_tags_multiple_files(input_files, 'psm')
 
 
-def generate_peptides_multiple_fractions_strings(input_files, ns):
-    return basereader.generate_tags_multiple_files_strings(input_files,
-                                                           ns, 'peptide',
-                                                           ['psm', 'protein'])
+def generate_peptides_multiple_fractions_raw(input_files):
+    return basereader.generate_raw_tags_multiple_files(input_files,
+                                                       'peptide')
 
 
 # Element generators interfaces
-def generate_psms_multiple_fractions(input_files, ns):
-    return basereader.generate_tags_multiple_files(input_files, 'psm',
-                                                   ['peptide', 'protein'], ns)
+def generate_psms_and_peptides(fn):
+    """Yields tuples of feature type (psm or peptide), element and the
+    element's bytes, reading and parsing the file once for both"""
+    return basereader.generate_xmltags_with_raw(fn, ['psm', 'peptide'])
+
 
+def generate_psms_with_raw(fn):
+    for tag, el, raw in basereader.generate_xmltags_with_raw(fn, ['psm']):
+        yield el, raw
 
-def generate_peptides_multiple_fractions(input_files, ns):
-    return basereader.generate_tags_multiple_files(input_files, 'peptide',
-                                                   ['psm', 'protein'], ns)
+
+def generate_peptides_with_raw(fn):
+    for tag, el, raw in basereader.generate_xmltags_with_raw(fn,
+                                                              ['peptide']):
+        yield el, raw
 
 
 def generate_psms(fn, ns):
@@ -43,13 +50,28 @@ def generate_peptides(fn, ns):
     return basereader.generate_xmltags(fn, 'peptide', ['psm', 'protein'], ns)
 
 
+def get_xpath(path, ns):
+    """Returns a compiled XPath for a path using the xmlns prefix, from a
+    registry keyed on path and namespace so it is only compiled once"""
+    try:
+        return COMPILED_XPATHS[(path, ns['xmlns'])]
+    except KeyError:
+        xpath = etree.XPath(path, namespaces={'xmlns': ns['xmlns']})
+        COMPILED_XPATHS[(path, ns['xmlns'])] = xpath
+        return xpath
+
+
+def get_child_element(el, tag, ns):
+    return get_xpath('xmlns:{}'.format(tag), ns)(el)[0]
+
+
 def get_peptide_seq(peptide, ns):
     return peptide.attrib['{%s}peptide_id' % ns['xmlns']]
 
 
 def get_psm_seq(psm, ns):
-    return psm.find('{%s}peptide_seq' % ns['xmlns']).attrib['seq']
+    return get_child_element(psm, 'peptide_seq', ns).attrib['seq']
 
 
 def get_psm_ids_from_peptide(peptide, ns):
-    return peptide.xpath('xmlns:psm_ids', namespaces=ns)[0]
+    return get_child_element(peptide, 'psm_ids', ns)
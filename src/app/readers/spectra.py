@@ -1,68 +1,256 @@
 import os
+import re
+from multiprocessing import Pool
+
+from lxml import etree
+
 from app.readers import xml as basereader
 from app.readers import ml
-from app.readers import xmlformatting as formatting
-
-
-def mzmlfn_ms2_spectra_generator(mzmlfiles):
-    for fn, spec, ns in mzmlfn_spectra_generator(mzmlfiles):
-        specparams = get_all_cvparams(spec, ns)
-        mslvl = fetch_cvparam_value_by_name(specparams, 'ms level')
-        if mslvl != '2':
-            continue
-        scannr = get_spec_scan_nr(spec)
-        rt = fetch_cvparams_values_from_subel(spec, 'scan',
-                                              ['scan start time'], ns)
-        iit = fetch_cvparams_values_from_subel(spec, 'scan',
-                                               ['ion injection time'], ns)
-        mz, charge = fetch_cvparams_values_from_subel(spec, 'selectedIon',
-                                                      ['selected ion m/z',
-                                                       'charge state'], ns)
-        yield fn, {'scan': scannr, 'rt': rt[0], 'iit': iit[0], 'mz': mz,
-                   'charge': charge}
-        formatting.clear_el(spec)
-
-
-def mzmlfn_spectra_generator(mzmlfiles):
-    for fn in mzmlfiles:
-        ns = basereader.get_namespace(fn)
-        spectra = basereader.generate_xmltags(
-            fn,
-            'spectrum',
-            ['offset',
-             ],
-            ns)
-        for spectrum in spectra:
-            yield os.path.basename(fn), spectrum, ns
-
-
-def fetch_cvparams_values_from_subel(base, subelname, paramnames, ns):
-    """Searches a base element for subelement by name, then takes the
-    cvParams of that subelement and returns the values as a list
-    for the paramnames that match. Value order in list equals input
-    paramnames order."""
-    sub_el = basereader.find_element_xpath(base, subelname, ns)
-    cvparams = get_all_cvparams(sub_el, ns)
-    output = []
-    for param in paramnames:
-        output.append(fetch_cvparam_value_by_name(cvparams, param))
-    return output
-
-
-def fetch_cvparam_value_by_name(params, name):
-    for cvparam in params:
-        try:
-            if cvparam.attrib['name'] == name:
-                return cvparam.attrib['value']
-        except KeyError:
-            pass
-    return False
-
-
-def get_all_cvparams(element, ns):
-    return element.findall('{%s}cvParam' % ns['xmlns'])
-
-
-def get_spec_scan_nr(spectrum):
-    """Returns scan number of mzML spectrum as a str."""
-    return ml.get_scan_nr(spectrum, 'id')
+from app.readers.compressed import open_input, get_compression
+
+
+MZML_READ_CHUNK = 1048576
+MZML_INDEXED_READ_CHUNK = 16384
+MZML_INDEX_TAIL = 4096
+MZML_SPECTRUM_PARAMS = {'spectrum': {'ms level': 'mslvl'},
+                        'scan': {'scan start time': 'rt',
+                                 'ion injection time': 'iit'},
+                        'selectedIon': {'selected ion m/z': 'mz',
+                                        'charge state': 'charge'},
+                        }
+
+
+def mzmlfn_ms2_spectra_generator(mzmlfiles, workers=1):
+    """Yields MS2 spectra metadata of mzML files in file order. With more
+    than one worker, files are scanned in parallel and the spectra of
+    each file are yielded when it is done"""
+    if workers > 1:
+        with Pool(workers) as pool:
+            for fn, spectra in zip(mzmlfiles, pool.imap(get_mzml_ms2_spectra,
+                                                         mzmlfiles)):
+                for spectrum in spectra:
+                    yield os.path.basename(fn), spectrum
+    else:
+        for fn in mzmlfiles:
+            for spectrum in generate_mzml_ms2_spectra(fn):
+                yield os.path.basename(fn), spectrum
+
+
+def generate_mzml_ms2_spectra(fn):
+    """Reads spectra through the offset index of indexedmzML files, which
+    only reads the metadata part of each spectrum from disk, or scans the
+    file when it has no (usable) index"""
+    offsets = get_mzml_spectrum_offsets(fn)
+    if offsets:
+        spectra = generate_indexed_spectra_metadata(fn, offsets)
+    else:
+        spectra = generate_mzml_spectra_metadata(fn)
+    for spectrum in spectra:
+        if spectrum['mslvl'] == '2':
+            yield spectrum
+
+
+def get_mzml_ms2_spectra(fn):
+    return list(generate_mzml_ms2_spectra(fn))
+
+
+def generate_mzml_spectra_metadata(fn):
+    """Scans an mzML file for spectrum metadata without building an
+    element tree. Yields a dict per spectrum with scan nr, ms level,
+    retention time, injection time, precursor m/z and charge. Values not
+    found in the spectrum are False."""
+    scanner = MzmlMetadataScanner(basereader.get_namespace(fn)['xmlns'])
+    parser = etree.XMLParser(target=scanner, huge_tree=True)
+    with open_input(fn, 'rb') as fp:
+        for chunk in generate_chunks_skip_element(fp, b'binaryDataArrayList'):
+            parser.feed(chunk)
+            yield from scanner.spectra
+            scanner.spectra = []
+    parser.close()
+    yield from scanner.spectra
+
+
+def generate_chunks_skip_element(fp, tag):
+    """Reads a file in chunks and leaves out all elements with the passed
+    (unprefixed) tag, including their content, so the XML parser does not
+    have to tokenize them. Bytes that may contain the start of a split
+    start or end tag are kept until the next chunk is read."""
+    starttag, endtag = b'<' + tag, b'</' + tag + b'>'
+    rest, skipping = b'', False
+    for chunk in iter(lambda: fp.read(MZML_READ_CHUNK), b''):
+        buf, pos = rest + chunk, 0
+        while True:
+            if skipping:
+                end = buf.find(endtag, pos)
+                if end == -1:
+                    pos = max(pos, len(buf) - len(endtag))
+                    break
+                pos, skipping = end + len(endtag), False
+            else:
+                start = buf.find(starttag, pos)
+                if start == -1:
+                    keep_from = max(pos, len(buf) - len(starttag))
+                    yield buf[pos:keep_from]
+                    pos = keep_from
+                    break
+                yield buf[pos:start]
+                pos, skipping = start, True
+        rest = buf[pos:]
+    if not skipping:
+        yield rest
+
+
+def get_mzml_spectrum_offsets(fn):
+    """Returns a list of (spectrum native ID, byte offset) from the
+    indexList of an indexedmzML file. Returns False when there is no index,
+    when its first and last offsets do not point to spectra, or when the
+    file is compressed so offsets cannot be seeked to."""
+    if get_compression(fn):
+        return False
+    with open(fn, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        fp.seek(max(0, fp.tell() - MZML_INDEX_TAIL))
+        indexoffset = re.search(rb'<indexListOffset>\s*(\d+)\s*'
+                                rb'</indexListOffset>', fp.read())
+        if indexoffset is None:
+            return False
+        fp.seek(int(indexoffset.group(1)))
+        indexlist = fp.read()
+        if not indexlist.startswith(b'<indexList'):
+            return False
+        indexlist = etree.fromstring(
+            indexlist[:indexlist.find(b'</indexList>') + 12])
+        offsets = [(offset.attrib['idRef'], int(offset.text))
+                   for index in indexlist if index.get('name') == 'spectrum'
+                   for offset in index]
+        for _, offset in offsets[:1] + offsets[-1:]:
+            fp.seek(offset)
+            if not fp.read(9) == b'<spectrum':
+                return False
+    return offsets
+
+
+def generate_indexed_spectra_metadata(fn, offsets):
+    """Yields spectrum metadata like generate_mzml_spectra_metadata, for
+    the spectra at the passed (native ID, byte offset) index entries.
+    Spectra are read from their offset up to their binary data arrays,
+    and fed to a single parser inside a wrapping mzML element."""
+    ns = basereader.get_namespace(fn)
+    scanner = MzmlMetadataScanner(ns['xmlns'])
+    parser = etree.XMLParser(target=scanner, huge_tree=True)
+    parser.feed(get_wrapping_start_tag(ns))
+    with open(fn, 'rb') as fp:
+        for _, offset in offsets:
+            parser.feed(read_spectrum_bytes(fp, offset, skip_binary=True))
+            yield from scanner.spectra
+            scanner.spectra = []
+    parser.feed(b'</mzML>')
+    parser.close()
+    yield from scanner.spectra
+
+
+def get_spectra_metadata_by_scan(fn, scans):
+    """Returns metadata of the spectra with the passed scan nrs from an
+    indexedmzML file, without reading the rest of the file"""
+    return list(generate_indexed_spectra_metadata(
+        fn, get_scan_offsets(fn, scans)))
+
+
+def generate_spectrum_elements_by_scan(fn, scans):
+    """Yields complete spectrum elements, including binary data arrays,
+    for the passed scan nrs from an indexedmzML file"""
+    ns = basereader.get_namespace(fn)
+    with open(fn, 'rb') as fp:
+        for _, offset in get_scan_offsets(fn, scans):
+            wrapped = etree.fromstring(
+                get_wrapping_start_tag(ns) +
+                read_spectrum_bytes(fp, offset, skip_binary=False) +
+                b'</mzML>')
+            yield wrapped[0]
+
+
+def get_scan_offsets(fn, scans):
+    offsets = get_mzml_spectrum_offsets(fn)
+    if not offsets:
+        raise RuntimeError('File {} is not an indexedmzML file with a '
+                           'usable spectrum index'.format(fn))
+    scans = {str(scan) for scan in scans}
+    return [(spec_id, offset) for spec_id, offset in offsets
+            if ml.get_scan_nr_from_id(spec_id) in scans]
+
+
+def get_wrapping_start_tag(ns):
+    return '<mzML {}>'.format(' '.join(
+        '{}="{}"'.format(prefix, uri) for prefix, uri in ns.items())).encode()
+
+
+def read_spectrum_bytes(fp, offset, skip_binary):
+    """Reads a spectrum element from a file offset. With skip_binary, it is
+    cut off at its binaryDataArrayList and closed there."""
+    endtag = b'</spectrum>'
+    fp.seek(offset)
+    data = b''
+    while True:
+        chunk = fp.read(MZML_INDEXED_READ_CHUNK)
+        searchfrom = max(0, len(data) - len(endtag) - 10)
+        data += chunk
+        end = data.find(endtag, searchfrom)
+        if skip_binary:
+            binstart = data.find(b'<binaryDataArrayList', searchfrom)
+            if binstart != -1 and (end == -1 or binstart < end):
+                return data[:binstart] + endtag
+        if end != -1:
+            return data[:end + len(endtag)]
+        elif not chunk:
+            raise RuntimeError('Could not find end of spectrum at offset '
+                               '{} in mzML file'.format(offset))
+
+
+class MzmlMetadataScanner(object):
+    """Parser target that collects spectrum metadata from mzML parse
+    events. Only cvParams that are direct children of the spectrum, its
+    first scan and first selectedIon are read, like when finding them in
+    a spectrum element. There is no data method, so text such as binary
+    data arrays is discarded by the parser."""
+
+    def __init__(self, xmlns):
+        self.xmlns = '{{{}}}'.format(xmlns)
+        self.spectrum_tag = '{}spectrum'.format(self.xmlns)
+        self.cvparam_tag = '{}cvParam'.format(self.xmlns)
+        self.param_tags = {'{}{}'.format(self.xmlns, tag): params
+                           for tag, params in MZML_SPECTRUM_PARAMS.items()}
+        self.spectra, self.spectrum = [], None
+        self.tagstack, self.seen_param_tags = [], set()
+
+    def start(self, tag, attrib):
+        if tag == self.spectrum_tag:
+            self.spectrum = {'scan': ml.get_scan_nr_from_id(attrib['id']),
+                             'mslvl': False, 'rt': False, 'iit': False,
+                             'mz': False, 'charge': False}
+            self.seen_param_tags = set()
+        elif self.spectrum is not None and tag == self.cvparam_tag:
+            parent = self.tagstack[-1]
+            if parent in self.param_tags and parent not in \
+                    self.seen_param_tags:
+                try:
+                    key = self.param_tags[parent][attrib['name']]
+                except KeyError:
+                    pass
+                else:
+                    if self.spectrum[key] is False:
+                        self.spectrum[key] = attrib['value']
+        self.tagstack.append(tag)
+
+    def end(self, tag):
+        self.tagstack.pop()
+        if self.spectrum is None:
+            return
+        elif tag == self.spectrum_tag:
+            self.spectra.append(self.spectrum)
+            self.spectrum = None
+        elif tag in self.param_tags:
+            # only the first scan and selectedIon elements are read
+            self.seen_param_tags.add(tag)
+
+    def close(self):
+        return None
@@ -1,27 +1,28 @@
+import io
 import re
 import os
-import itertools
+from collections.abc import MutableMapping
+from operator import itemgetter
+
 from app.dataformats import mzidtsv as mzidtsvdata
 from app.dataformats import prottable as prottabledata
+from app.readers.compressed import open_input, get_compression
+
+TSV_CHUNK_SIZE = 16777216
 
 
 def get_tsv_header(tsvfn):
-    with open(tsvfn) as fp:
+    with open_input(tsvfn) as fp:
         return next(fp).strip().split('\t')
 
 
-def generate_tsv_lines_multifile(fns, header):
-    return itertools.chain.from_iterable([generate_tsv_psms(fn, header)
-                                          for fn in fns])
-
-
 def generate_tsv_proteins(fn, header):
     return generate_split_tsv_lines(fn, header)
 
 
 def generate_tsv_pep_protein_quants(fns):
-    """Unlike generate_tsv_lines_multifile, this generates tsv lines
-    from multiple files that may have different headers. Yields
+    """Generates tsv lines from multiple files that may have different
+    headers. Yields
     fn, header as well as quant data for each protein quant"""
     for fn in fns:
         header = get_tsv_header(fn)
@@ -58,8 +59,134 @@ def generate_split_tsv_lines(fn, header):
         yield {x: y for (x, y) in zip(header, line.strip().split('\t'))}
 
 
+def generate_tsv_psm_rows(fn, header):
+    """Like generate_tsv_psms, but yields TsvRow records which share a
+    single header index instead of building a dict per line"""
+    return generate_tsv_rows_from_lines(generate_tsv_psms_line(fn), header)
+
+
+def generate_tsv_range_rows(fn, header, start, end):
+    """Yields TsvRow records of the lines in a byte range of a TSV file, as
+    returned by get_tsv_chunk_ranges"""
+    with open(fn, 'rb') as fp:
+        fp.seek(start)
+        lines = io.TextIOWrapper(io.BytesIO(fp.read(end - start)))
+    return generate_tsv_rows_from_lines(lines, header)
+
+
+def generate_tsv_rows_from_lines(lines, header):
+    index = TsvRowIndex(header)
+    nfields = len(header)
+    for line in lines:
+        values = line.strip().split('\t')
+        if len(values) > nfields:
+            del values[nfields:]
+        yield TsvRow(values, index)
+
+
+class TsvRowIndex(dict):
+    """Field name to position map shared by all TsvRows of a table. Fields
+    that are added to rows are appended to it, so positions never change.
+    Also caches getters for the field selections that rows are written
+    with."""
+    def __init__(self, header):
+        super().__init__((field, ix) for ix, field in enumerate(header))
+        self.getters = {}
+
+    def get_getter(self, fields):
+        try:
+            return self.getters[fields]
+        except KeyError:
+            pass
+        positions = [self[field] for field in fields]
+        if len(positions) == 1:
+            def getter(values):
+                return (values[positions[0]],)
+        else:
+            getter = itemgetter(*positions)
+        self.getters[fields] = getter
+        return getter
+
+
+class TsvRow(MutableMapping):
+    """Dict-like TSV line, storing values in a list of which the positions
+    are looked up in a TsvRowIndex shared with the other lines. Setting a
+    field that is not in the table adds it to the index and appends the
+    value to the list, without copying the line."""
+    __slots__ = ('values', 'index')
+    MISSING = object()
+
+    def __init__(self, values, index):
+        self.values = values
+        self.index = index
+
+    def __getitem__(self, field):
+        try:
+            value = self.values[self.index[field]]
+        except IndexError:
+            raise KeyError(field)
+        if value is TsvRow.MISSING:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        try:
+            ix = self.index[field]
+        except KeyError:
+            ix = self.index[field] = len(self.index)
+        if ix >= len(self.values):
+            self.values.extend([TsvRow.MISSING] * (ix - len(self.values) + 1))
+        self.values[ix] = value
+
+    def __delitem__(self, field):
+        if field not in self:
+            raise KeyError(field)
+        self.values[self.index[field]] = TsvRow.MISSING
+
+    def __iter__(self):
+        return (field for field, ix in self.index.items()
+                if ix < len(self.values) and
+                self.values[ix] is not TsvRow.MISSING)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def select(self, fields):
+        """Returns a tuple of the values of a tuple of fields"""
+        try:
+            values = self.index.get_getter(fields)(self.values)
+        except IndexError:
+            values = tuple(self[field] for field in fields)
+        if TsvRow.MISSING in values:
+            values = tuple(self[field] for field in fields)
+        return values
+
+
+def get_tsv_chunk_ranges(fn, chunksize=None):
+    """Returns (start, end) byte offsets of chunks of about chunksize bytes
+    (default TSV_CHUNK_SIZE) of the lines after the header of a TSV file.
+    Chunks end at a newline. Returns False for compressed files, which
+    cannot be read from an offset."""
+    if get_compression(fn):
+        return False
+    if chunksize is None:
+        chunksize = TSV_CHUNK_SIZE
+    ranges = []
+    with open(fn, 'rb') as fp:
+        fp.readline()
+        start = fp.tell()
+        size = fp.seek(0, os.SEEK_END)
+        while start < size:
+            fp.seek(start + chunksize)
+            fp.readline()
+            end = min(fp.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
 def generate_tsv_psms_line(fn):
-    with open(fn) as fp:
+    with open_input(fn) as fp:
         next(fp)  # skip header
         for line in fp:
             yield line
@@ -1,16 +1,25 @@
 from lxml import etree
 import itertools
+import re
+from xml.parsers import expat
 from app.readers import xmlformatting as formatting
+from app.readers.compressed import open_input
+
+RAW_READ_CHUNK = 1048576
+START_TAG_RE = re.compile(rb'<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+ROOT_NAME_RE = re.compile(rb'<([^\s/>]+)')
+TAIL_RE = re.compile(rb'\s*')
 
 
 def get_namespace_from_top(fn, key='xmlns'):
-    ac, el = next(etree.iterparse(fn))
+    with open_input(fn, 'rb') as fp:
+        ac, el = next(etree.iterparse(fp))
     return {'xmlns': el.nsmap[key]}
 
 
 def get_root_el(fn):
-    rootgen = etree.iterparse(fn, events=('start',))
-    root = next(rootgen)[1]
+    with open_input(fn, 'rb') as fp:
+        root = next(etree.iterparse(fp, events=('start',)))[1]
     for child in root.getchildren():
         root.remove(child)
     return root
@@ -41,12 +50,13 @@ def generate_tags_multiple_files(input_files, tag, ignore_tags, ns=None):
         fn, tag, ignore_tags, ns) for fn in input_files])
 
 
-def generate_tags_multiple_files_strings(input_files, ns, tag, ignore_tags):
+def generate_raw_tags_multiple_files(input_files, tag):
     """
-    Creates stringified xml output of elements with certain tag.
+    Calls raw xmltag generator for multiple files, yields only the bytes.
     """
-    for el in generate_tags_multiple_files(input_files, tag, ignore_tags, ns):
-        yield formatting.string_and_clear(el, ns)
+    for fn in input_files:
+        for rawtag, raw in generate_raw_xmltags(fn, [tag]):
+            yield raw
 
 
 def generate_xmltags(fn, returntag, ignore_tags, ns=None):
@@ -57,18 +67,135 @@ def generate_xmltags(fn, returntag, ignore_tags, ns=None):
     """
     xmlns = create_namespace(ns)
     ns_ignore = ['{0}{1}'.format(xmlns, x) for x in ignore_tags]
-    for ac, el in etree.iterparse(fn):
-        if el.tag == '{0}{1}'.format(xmlns, returntag):
-            yield el
-        elif el.tag in ns_ignore:
-            formatting.clear_el(el)
+    with open_input(fn, 'rb') as fp:
+        for ac, el in etree.iterparse(fp):
+            if el.tag == '{0}{1}'.format(xmlns, returntag):
+                yield el
+            elif el.tag in ns_ignore:
+                formatting.clear_el(el)
+
+
+def generate_raw_xmltag_chunks(fn, returntags):
+    """
+    Reads the file once with an expat parser and yields, for every chunk
+    read, the start tag bytes of the root element and a list of (tag,
+    bytes) tuples of elements with any of returntags, in document order.
+    The bytes are sliced from the read buffer at the byte offsets the
+    parser reports for the element's start and end tags, and include the
+    whitespace after the element, which is what lxml outputs for an
+    element with its tail. Tags are matched on their local name, elements
+    nested in a returned element are only output as part of it.
+    """
+    returntags = set(returntags)
+    parser = expat.ParserCreate(namespace_separator=' ')
+    buf, base, roottag = b'', 0, None
+    open_tag, open_start, nested = None, 0, 0
+    spans = []
+
+    def start_root(name, attrs):
+        nonlocal roottag
+        ix = parser.CurrentByteIndex - base
+        roottag = buf[ix:START_TAG_RE.match(buf, ix).end()]
+        parser.StartElementHandler = start_element
+
+    def start_element(name, attrs):
+        nonlocal open_tag, open_start, nested
+        tag = name[name.rfind(' ') + 1:]
+        if tag in returntags:
+            if not nested:
+                open_tag, open_start = tag, parser.CurrentByteIndex
+            nested += 1
+
+    def end_element(name):
+        nonlocal nested
+        if not nested:
+            return
+        tag = name[name.rfind(' ') + 1:]
+        if tag not in returntags:
+            return
+        nested -= 1
+        if nested:
+            return
+        # The parser reports the start of an end tag, or the end of an
+        # empty element
+        ix = parser.CurrentByteIndex - base
+        if buf[ix - 2:ix] == b'/>' and START_TAG_RE.match(
+                buf, open_start - base).end() == ix:
+            end = ix
+        else:
+            end = buf.index(b'>', ix) + 1
+        spans.append((open_tag, open_start, end + base))
+
+    if hasattr(parser, 'SetReparseDeferralEnabled'):
+        # Report all complete tags in the data passed to the parser, which
+        # the buffer is trimmed on
+        parser.SetReparseDeferralEnabled(False)
+    parser.StartElementHandler = start_root
+    parser.EndElementHandler = end_element
+    eof = False
+    with open_input(fn, 'rb') as fp:
+        while not eof:
+            chunk = fp.read(RAW_READ_CHUNK)
+            eof = not chunk
+            buf += chunk
+            try:
+                parser.Parse(chunk, eof)
+            except expat.ExpatError as error:
+                raise RuntimeError('Could not parse XML in {}: {}'.format(
+                    fn, error))
+            rawtags = []
+            for tag, start, end in spans:
+                tailend = TAIL_RE.match(buf, end - base).end()
+                if tailend == len(buf) and not eof:
+                    # More whitespace may follow in the next chunk
+                    break
+                rawtags.append((tag, buf[start - base:tailend]))
+            del(spans[:len(rawtags)])
+            if spans:
+                keep = spans[0][1]
+            elif nested:
+                keep = open_start
+            else:
+                # A tag that has not been reported yet is not complete, and
+                # starts at the last < since it cannot contain any
+                keep = base + max(buf.rfind(b'<'), 0)
+            buf, base = buf[keep - base:], keep
+            if rawtags:
+                yield roottag, rawtags
+
+
+def generate_raw_xmltags(fn, returntags):
+    """
+    Yields tuples of (tag, bytes) for elements with any of returntags, in
+    document order, without building elements. See
+    generate_raw_xmltag_chunks.
+    """
+    for roottag, rawtags in generate_raw_xmltag_chunks(fn, returntags):
+        yield from rawtags
+
+
+def generate_xmltags_with_raw(fn, returntags):
+    """
+    Like generate_raw_xmltags, but yields tuples of (tag, element, bytes),
+    so unchanged elements can be output as their bytes without serializing
+    them. The file is read once: elements are parsed from the bytes of
+    each chunk, inside a copy of the root start tag so they get the
+    document's namespaces.
+    """
+    for roottag, rawtags in generate_raw_xmltag_chunks(fn, returntags):
+        rootend = b'</' + ROOT_NAME_RE.match(roottag).group(1) + b'>'
+        root = etree.fromstring(b''.join([roottag] + [
+            raw for tag, raw in rawtags] + [rootend]))
+        for (tag, raw), el in zip(rawtags, list(root)):
+            yield tag, el, raw
 
 
 def get_element(fn, tag, ns=None):
     xmlns = create_namespace(ns)
-    for ac, el in etree.iterparse(fn):
-        if el.tag == '{0}{1}'.format(xmlns, tag):
-            return el
+    with open_input(fn, 'rb') as fp:
+        for ac, el in etree.iterparse(fp):
+            if el.tag == '{0}{1}'.format(xmlns, tag):
+                return el
 
 
 def create_namespace(ns):
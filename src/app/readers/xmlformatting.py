@@ -1,16 +1,16 @@
 from lxml import etree
 
-def string_and_clear(el, ns):
-    str_el = stringify_strip_namespace_declaration(el, ns)
+def serialize_and_clear(el, ns):
+    bytes_el = serialize_strip_namespace_declaration(el, ns)
     clear_el(el)
-    return str_el
+    return bytes_el
 
-def stringify_strip_namespace_declaration(el, ns):
-    strxml = etree.tostring(el, encoding='utf-8').decode('utf-8')
-    strxml = strxml.replace('xmlns="{0}" '.format(ns['xmlns']), '')
-    strxml = strxml.replace('xmlns:p="{0}" '.format(ns['xmlns:p']), '')
-    strxml = strxml.replace('xmlns:xsi="{0}" '.format(ns['xmlns:xsi']), '')
-    return strxml
+def serialize_strip_namespace_declaration(el, ns):
+    bytesxml = etree.tostring(el, encoding='utf-8')
+    for prefix in ['xmlns', 'xmlns:p', 'xmlns:xsi']:
+        bytesxml = bytesxml.replace('{0}="{1}" '.format(
+            prefix, ns[prefix]).encode('utf-8'), b'')
+    return bytesxml
 
 def clear_el(el):
     el.clear()
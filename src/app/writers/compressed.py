@@ -0,0 +1,78 @@
+import io
+import gzip
+import shutil
+import subprocess
+
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+COMPRESS_COMMANDS = {'gzip': ['gzip', '-c'], 'zstd': ['zstd', '-cq']}
+
+
+def get_output_compression(fn):
+    """Returns compression format to write a file in from its extension,
+    or False"""
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if fn.endswith(extension):
+            return compression
+    return False
+
+
+def add_compression_extension(fn, compression):
+    if not compression:
+        return fn
+    extension = COMPRESSION_EXTENSIONS[compression]
+    return fn if fn.endswith(extension) else fn + extension
+
+
+def strip_compression_extension(fn):
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if fn.endswith(extension):
+            return fn[:-len(extension)]
+    return fn
+
+
+def open_output(fn, mode='w'):
+    """Opens a file for writing like open() does. Files ending in .gz or
+    .zst are compressed by a subprocess while writing, so compression
+    overlaps with producing output"""
+    compression = get_output_compression(fn)
+    if not compression:
+        return open(fn, mode)
+    command = COMPRESS_COMMANDS[compression]
+    executable = shutil.which(command[0])
+    if executable is None and compression == 'gzip':
+        return gzip.open(fn, mode if 'b' in mode else mode + 't')
+    elif executable is None:
+        raise RuntimeError('Cannot write {}-compressed file {}, no {} '
+                           'executable found'.format(compression, fn,
+                                                     command[0]))
+    fp = io.BufferedWriter(PipedCompressor(fn, [executable] + command[1:],
+                                           append='a' in mode))
+    if 'b' in mode:
+        return fp
+    return io.TextIOWrapper(fp)
+
+
+class PipedCompressor(io.RawIOBase):
+    """Raw binary stream writing to a pipe into a compressing subprocess
+    which outputs to a file. Appending adds a compressed member/frame to
+    the end of the file."""
+    def __init__(self, fn, command, append=False):
+        self.fn = fn
+        with open(fn, 'ab' if append else 'wb') as outfp:
+            self.proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                         stdout=outfp, bufsize=0)
+
+    def writable(self):
+        return True
+
+    def write(self, buf):
+        return self.proc.stdin.write(buf)
+
+    def close(self):
+        if self.closed:
+            return
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError('Could not compress output to '
+                               'file {}'.format(self.fn))
+        super().close()
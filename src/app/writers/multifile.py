@@ -0,0 +1,79 @@
+from collections import OrderedDict
+
+from app.writers.compressed import open_output
+
+MAX_OPEN_FILES = 128
+FILE_BUFFER_SIZE = 1048576
+TOTAL_BUFFER_SIZE = 268435456
+
+
+class MultiFileWriter(object):
+    """Writes bytes to many output files, e.g. one per split value. Data is
+    kept in a buffer per file and written in batches when it grows over
+    buffer_size, or when all buffers together grow over total_buffer_size.
+    At most max_open files are open at a time, the least recently written
+    one is closed when another is needed, and reopened for appending."""
+    def __init__(self, max_open=MAX_OPEN_FILES, buffer_size=FILE_BUFFER_SIZE,
+                 total_buffer_size=TOTAL_BUFFER_SIZE):
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.total_buffer_size = total_buffer_size
+        self.handles = OrderedDict()
+        self.opened = set()
+        self.buffers = {}
+        self.buffered = {}
+        self.total_buffered = 0
+
+    def __contains__(self, fn):
+        return fn in self.buffers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, fn, data):
+        try:
+            self.buffers[fn].append(data)
+            self.buffered[fn] += len(data)
+        except KeyError:
+            self.buffers[fn] = [data]
+            self.buffered[fn] = len(data)
+        self.total_buffered += len(data)
+        if self.buffered[fn] >= self.buffer_size:
+            self.flush(fn)
+        elif self.total_buffered >= self.total_buffer_size:
+            self.flush_all()
+
+    def flush(self, fn):
+        if not self.buffers[fn]:
+            return
+        self.get_handle(fn).write(b''.join(self.buffers[fn]))
+        self.buffers[fn] = []
+        self.total_buffered -= self.buffered[fn]
+        self.buffered[fn] = 0
+
+    def flush_all(self):
+        for fn in self.buffers:
+            self.flush(fn)
+
+    def get_handle(self, fn):
+        try:
+            self.handles.move_to_end(fn)
+            return self.handles[fn]
+        except KeyError:
+            pass
+        if len(self.handles) >= self.max_open:
+            self.handles.popitem(last=False)[1].close()
+        # Files that have been closed before are reopened for appending
+        mode = 'ab' if fn in self.opened else 'wb'
+        self.opened.add(fn)
+        self.handles[fn] = open_output(fn, mode)
+        return self.handles[fn]
+
+    def close(self):
+        self.flush_all()
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = OrderedDict()
@@ -1,19 +1,29 @@
 from app.writers import tsv
+from app.writers.multifile import MultiFileWriter
 
 
 def write_mzid_tsv(header, psms, outfn):
     tsv.write_tsv(header, psms, outfn)
 
 
-def write_multi_mzidtsv(header, oldheader, psms, base_outfile):
-    outfile_handles = {}
-    for psm in psms:
-        line = psm['psm']
-        split_pool = psm['split_pool']
-        if split_pool not in outfile_handles:
-            outfile_handles[split_pool] = open(base_outfile.format(split_pool),
-                                               'w')
-            tsv.write_tsv_line_from_list(header, outfile_handles[split_pool])
-        tsv.write_tsv_line_from_list([line[field] for field in oldheader],
-                                     outfile_handles[split_pool])
-    [handle.close() for handle in outfile_handles.values()]
+def write_mzid_tsv_chunks(header, chunks, outfn):
+    tsv.write_tsv_chunks(header, chunks, outfn)
+
+
+def write_mzid_tsv_bytes(header, chunks, outfn):
+    tsv.write_tsv_bytes(header, chunks, outfn)
+
+
+def write_multi_mzidtsv(header, psms, base_outfile):
+    """Writes unparsed PSM lines to the files of their split pools. Takes
+    tuples of (split pool, line bytes)"""
+    headerline = tsv.get_tsv_header_bytes(header)
+    outfiles = {}
+    with MultiFileWriter() as writer:
+        for split_pool, line in psms:
+            try:
+                writer.write(outfiles[split_pool], line)
+            except KeyError:
+                outfiles[split_pool] = base_outfile.format(split_pool)
+                writer.write(outfiles[split_pool], headerline)
+                writer.write(outfiles[split_pool], line)
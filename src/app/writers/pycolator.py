@@ -1,42 +1,78 @@
 from lxml import etree
 
+from app.writers.compressed import open_output
+from app.writers.multifile import MultiFileWriter
+
 
 def write_percolator_xml(staticxml, feats, fn):
     """Given the static percolator xml root and process info nodes, and all
     psms and peptides as iterators in a dict {'peptide': pep_iterator, 'psm':
-    psm_iterator}, this generates percolator out data into a file."""
-
-    # First get xml until psms opening element is found.
-    etree.SubElement(staticxml, 'psms').text = '***psms***'
-    root = etree.tostring(staticxml, pretty_print=True,
-                          xml_declaration=True, encoding='UTF-8')
-    root = root.decode('utf-8')
-    root = root[:root.find('***psms***')]
-
-    # Write opening xml
-    with open(fn, 'w') as fp:
-        fp.write(root)
-        fp.write('\n')
+    psm_iterator}, this generates percolator out data into a file. Features
+    are bytes, either copied from an input file or serialized."""
+    root = get_percolator_xml_head(staticxml)
+    with open_output(fn, 'wb') as fp:
+        # Write opening xml
+        fp.write(root.encode('utf-8'))
+        fp.write(b'\n')
 
-    # Then write features
-    with open(fn, 'a') as fp:
+        # Then write features
         psmcount = 0
         for psm in feats['psm']:
             psmcount += 1
             fp.write(psm)
-            fp.write('\n')
-        fp.write('</psms><peptides>\n')
+            fp.write(b'\n')
+        fp.write(b'</psms><peptides>\n')
 
         peptidecount = 0
         for pep in feats['peptide']:
             peptidecount += 1
             fp.write(pep)
-            fp.write('\n')
-        fp.write('</peptides></percolator_output>')
+            fp.write(b'\n')
+        fp.write(b'</peptides></percolator_output>')
     print('Wrote {0} psms, {1} peptides to file {2}'.format(psmcount,
                                                             peptidecount, fn))
 
 
+def write_split_percolator_xml(staticxml, feats, outfns):
+    """Writes percolator out data to multiple files in a single pass. Takes
+    tuples of feature type (psm or peptide), the splits the feature goes
+    to and the feature bytes, with all PSMs before the peptides, and a
+    dict of split: output filename."""
+    root = '{}\n'.format(get_percolator_xml_head(staticxml)).encode('utf-8')
+    counts = {split: {'psm': 0, 'peptide': 0} for split in outfns}
+    with MultiFileWriter() as writer:
+        for fn in outfns.values():
+            writer.write(fn, root)
+        in_peptides = False
+        for feattype, splits, feat in feats:
+            if feattype == 'peptide' and not in_peptides:
+                for fn in outfns.values():
+                    writer.write(fn, b'</psms><peptides>\n')
+                in_peptides = True
+            feat = feat + b'\n'
+            for split in splits:
+                writer.write(outfns[split], feat)
+                counts[split][feattype] += 1
+        for fn in outfns.values():
+            if not in_peptides:
+                writer.write(fn, b'</psms><peptides>\n')
+            writer.write(fn, b'</peptides></percolator_output>')
+    for split, fn in outfns.items():
+        print('Wrote {0} psms, {1} peptides to file {2}'.format(
+            counts[split]['psm'], counts[split]['peptide'], fn))
+
+
+def get_percolator_xml_head(staticxml):
+    """Returns the xml of the static percolator xml root and process info
+    nodes until the psms opening element"""
+    etree.SubElement(staticxml, 'psms').text = '***psms***'
+    root = etree.tostring(staticxml, pretty_print=True,
+                          xml_declaration=True, encoding='UTF-8')
+    root = root.decode('utf-8')
+    staticxml.remove(staticxml[-1])
+    return root[:root.find('***psms***')]
+
+
 def write_qvality_input(scores, fn):
     with open(fn, 'w') as fp:
         for score in scores:
@@ -1,15 +1,49 @@
+from app.readers.tsv import TsvRow
+from app.writers.compressed import open_output
+
+
 def write_tsv(headerfields, features, outfn):
     """Writes header and generator of lines to tab separated file.
 
     headerfields - list of field names in header in correct order
-    features - generates 1 list per line that belong to header
-    outfn - filename to output to. Overwritten if exists
+    features - generates 1 dict or TsvRow per line with keys from header
+    outfn - filename to output to. Overwritten if exists, compressed if
+            it ends in .gz or .zst
     """
-    with open(outfn, 'w') as fp:
+    with open_output(outfn) as fp:
+        write_tsv_line_from_list(headerfields, fp)
+        fp.writelines(generate_tsv_lines(headerfields, features))
+
+
+def write_tsv_chunks(headerfields, chunks, outfn):
+    """Writes header and chunks of already formatted lines, e.g. from
+    parallel workers, to tab separated file"""
+    with open_output(outfn) as fp:
         write_tsv_line_from_list(headerfields, fp)
-        for line in features:
-            write_tsv_line_from_list([str(line[field]) for field
-                                      in headerfields], fp)
+        fp.writelines(chunks)
+
+
+def write_tsv_bytes(headerfields, chunks, outfn):
+    """Writes header and chunks of unparsed bytes of lines, e.g. copied
+    from other tables, to tab separated file"""
+    with open_output(outfn, 'wb') as fp:
+        fp.write(get_tsv_header_bytes(headerfields))
+        fp.writelines(chunks)
+
+
+def get_tsv_header_bytes(headerfields):
+    return '{}\n'.format('\t'.join(headerfields)).encode()
+
+
+def generate_tsv_lines(headerfields, features):
+    """Formats dicts or TsvRows to tsv lines with carriage return"""
+    fields = tuple(headerfields)
+    for line in features:
+        if isinstance(line, TsvRow):
+            values = line.select(fields)
+        else:
+            values = [line[field] for field in fields]
+        yield '\t'.join([str(value) for value in values]) + '\n'
 
 
 def write_tsv_line_from_list(linelist, outfp):
@@ -0,0 +1,51 @@
+"""Micro-benchmark of looking up child elements of percolator PSMs and
+peptides, with XPath strings evaluated per element as pycolator did before,
+and with compiled XPaths from the pycolator reader registry.
+
+Run from the repository root with a (large) percolator output file:
+    PYTHONPATH=src python tests/benchmarks/pycolator_xpath.py perco.xml
+"""
+import sys
+import time
+
+from app.readers import pycolator as reader
+from app.readers import xml
+from app.readers import xmlformatting as formatting
+
+CHILD_TAGS = ['svm_score', 'q_value', 'pep']
+
+
+def lookup_xpath_strings(el, ns):
+    return [el.xpath('xmlns:{}'.format(tag), namespaces=ns)[0]
+            for tag in CHILD_TAGS]
+
+
+def lookup_compiled(el, ns):
+    return [reader.get_child_element(el, tag, ns) for tag in CHILD_TAGS]
+
+
+def run_lookups(elements, ns, lookup):
+    """Returns number of elements and seconds spent in lookups"""
+    amount, spent = 0, 0
+    for el in elements:
+        start = time.perf_counter()
+        lookup(el, ns)
+        spent += time.perf_counter() - start
+        amount += 1
+        formatting.clear_el(el)
+    return amount, spent
+
+
+def main(fn):
+    ns = xml.get_namespace(fn)
+    for name, lookup in [('xpath strings', lookup_xpath_strings),
+                         ('compiled xpath', lookup_compiled)]:
+        for feattype, generate in [('psm', reader.generate_psms),
+                                   ('peptide', reader.generate_peptides)]:
+            amount, spent = run_lookups(generate(fn, ns), ns, lookup)
+            print('{0:15} {1:8} {2:10d} elements {3:12.0f} elements/s'.format(
+                name, feattype, amount, amount / spent))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -1,5 +1,6 @@
 import unittest
 import subprocess
+import sys
 import os
 import shutil
 import sqlite3
@@ -8,6 +9,22 @@ from lxml import etree
 from tempfile import mkdtemp
 
 
+ENTRY_MODULES = {'msspercolator': 'app.pycolator',
+                 'msslookup': 'app.mslookup',
+                 'msspsmtable': 'app.mzidtsv',
+                 'msspeptable': 'app.peptable',
+                 'mssprottable': 'app.prottable',
+                 }
+
+PATCHED_RUN = """import sys
+from importlib import import_module
+for module, attr, value in {patches!r}:
+    setattr(import_module(module), attr, value)
+sys.argv[0] = {executable!r}
+import_module({entry!r}).main()
+"""
+
+
 class BaseTest(unittest.TestCase):
     testdir = 'tests'
     fixdir = os.path.join(os.getcwd(), testdir, 'fixtures')
@@ -45,6 +62,23 @@ class BaseTest(unittest.TestCase):
             raise
         return cmd
 
+    def run_command_patched(self, patches, options=[]):
+        """Runs the command in a Python process in which module attributes
+        are first set, patches is a list of (module, attribute, value).
+        Used for e.g. small chunk sizes, so parallel code paths get
+        multiple chunks from small fixtures"""
+        cmd = self.get_std_options()
+        script = PATCHED_RUN.format(patches=patches,
+                                    executable=self.executable,
+                                    entry=ENTRY_MODULES[self.executable])
+        cmd = [sys.executable, '-c', script] + cmd[1:] + options
+        try:
+            subprocess.check_call(cmd)
+        except subprocess.CalledProcessError:
+            print('Failed to run executable {}'.format(self.executable))
+            raise
+        return cmd
+
     def run_command_expect_error(self, options=[]):
         try:
             cmd = self.run_command(options)
@@ -151,6 +185,21 @@ class BaseTestPycolator(BaseTest):
     executable = 'msspercolator'
     infilename = 'percolator_out.xml'
 
+    def run_workers_chunked(self, options, outfiles, chunksize=1):
+        """Runs the command with workers on XML chunks of chunksize, by
+        default one element per chunk, so small fixtures make several
+        batches of chunks. Then runs it serially and checks that all
+        outfiles are identical"""
+        self.run_command_patched([('app.actions.pycolator.parallel',
+                                   'XML_CHUNK_SIZE', chunksize)],
+                                 options + ['--workers', '2'])
+        for fn in outfiles:
+            os.rename(fn, fn + '_workers')
+        self.run_command(options)
+        for fn in outfiles:
+            with open(fn, 'rb') as fp, open(fn + '_workers', 'rb') as wfp:
+                self.assertEqual(fp.read(), wfp.read())
+
     def get_psm_pep_ids_from_file(self, fn):
         contents = self.read_percolator_out(fn)
         return {'psm_ids': self.get_element_ids(contents['psms'],
@@ -207,6 +256,20 @@ class MzidTSVBaseTest(BaseTest):
         super().setUp()
         self.dbfile = os.path.join(self.fixdir, 'mzidtsv_db.sqlite')
 
+    def run_workers_chunked(self, options, chunksize):
+        """Runs the command serially and with workers on TSV chunks of
+        chunksize, checks both outputs are identical and returns the
+        output lines"""
+        serialfn, self.resultfn = self.resultfn, self.resultfn + '_workers'
+        self.run_command_patched([('app.readers.tsv', 'TSV_CHUNK_SIZE',
+                                   chunksize)], options + ['--workers', '2'])
+        self.resultfn = serialfn
+        self.run_command(options)
+        with open(serialfn) as fp, open(serialfn + '_workers') as wfp:
+            serial_lines = fp.readlines()
+            self.assertEqual(serial_lines, wfp.readlines())
+        return serial_lines
+
     def rowify(self, records):
         row, rownr = [], 0
         for record in records:
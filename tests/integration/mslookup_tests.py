@@ -1,11 +1,14 @@
 from tests.integration import basetests
 
 import os
+import shutil
 import sqlite3
 import yaml
 from Bio import SeqIO
 from lxml import etree
 
+from app.readers import spectra as spectrareader
+
 
 class SearchspaceLookup(basetests.BaseTest):
     suffix = ''
@@ -105,19 +108,22 @@ class TestSpectraLookup(basetests.MSLookupTest):
     command = 'spectra'
     infilename = 'few_spectra.mzML'
 
-    def check_spectra(self, bsets):
+    def check_spectra(self, bsets, idfield='spectra_id'):
         sql = ('SELECT mf.mzmlfilename, bs.set_name, s.scan_nr, s.charge, '
-               's.mz, s.retention_time, s.ion_injection_time, s.spectra_id '
+               's.mz, s.retention_time, s.ion_injection_time, s.{} '
                'FROM mzml AS s '
                'JOIN mzmlfiles AS mf USING(mzmlfile_id) '
-               'JOIN biosets AS bs USING(set_id)')
+               'JOIN biosets AS bs USING(set_id)'.format(idfield))
         specrecs = {}
         for rec in self.get_values_from_db(self.resultfn, sql):
-            specrecs[rec[2]] = {'fn': rec[0], 'bs': rec[1], 'charge': rec[3],
-                                'mz': rec[4], 'rt': rec[5], 'iit': rec[6],
-                                'sid': rec[7]}
+            specrecs[(rec[0], rec[2])] = {
+                'fn': rec[0], 'bs': rec[1], 'charge': rec[3], 'mz': rec[4],
+                'rt': rec[5], 'iit': rec[6], 'sid': rec[7]}
+        amount_spectra = 0
         for scannr, spec in self.get_spectra_mzml(self.infile, bsets):
-            self.assertEqual(spec, specrecs[scannr])
+            self.assertEqual(spec, specrecs[(spec['fn'], scannr)])
+            amount_spectra += 1
+        self.assertEqual(amount_spectra, len(specrecs))
 
     def get_spectra_mzml(self, infiles, bsets):
         def get_cvparam_value(parent, name, ns):
@@ -167,6 +173,117 @@ class TestSpectraLookup(basetests.MSLookupTest):
         self.run_command(options)
         self.check_spectra(setnames)
 
+    def test_spectra_bulkload(self):
+        setnames = ['Set1']
+        options = ['--bulkload', '100', '--setnames']
+        options.extend(setnames)
+        self.run_command(options)
+        self.check_spectra(setnames)
+        sql = 'SELECT name FROM sqlite_master'
+        dbobjects = {x[0] for x in self.get_values_from_db(self.resultfn,
+                                                           sql)}
+        for name in ['spectra_id_index', 'mzmlfnid_mzml_index', 'scan_index',
+                     'specrt_index', 'specmz_index', 'sqlite_stat1']:
+            self.assertIn(name, dbobjects)
+
+    def test_spectra_intkeys(self):
+        setnames = ['Set1']
+        options = ['--intkeys', '--setnames']
+        options.extend(setnames)
+        self.run_command(options)
+        self.check_spectra(setnames, idfield='spectra_key')
+        sql = 'SELECT typeof(spectra_id) FROM mzml'
+        for rec in self.get_values_from_db(self.resultfn, sql):
+            self.assertEqual(rec[0], 'integer')
+
+    def test_spectra_workers(self):
+        self.infile = [self.infile]
+        for ix in range(2):
+            self.infile.append(os.path.join(self.workdir,
+                                            'spectra{}.mzML'.format(ix)))
+            shutil.copy(self.infile[0], self.infile[-1])
+        setnames = ['Set1', 'Set1', 'Set2']
+        options = ['--workers', '2', '--setnames']
+        options.extend(setnames)
+        self.run_command(options)
+        self.check_spectra(setnames)
+
+    def test_spectra_nonindexed(self):
+        self.infile = os.path.join(self.workdir, self.infilename)
+        strip_mzml_index(os.path.join(self.fixdir, self.infilename),
+                         self.infile)
+        setnames = ['Set1']
+        options = ['--setnames']
+        options.extend(setnames)
+        self.run_command(options)
+        self.check_spectra(setnames)
+
+
+class TestSpectraReader(basetests.BaseTest):
+    infilename = 'few_spectra.mzML'
+    suffix = ''
+
+    def setUp(self):
+        super().setUp()
+        self.nonindexed = os.path.join(self.workdir, 'nonindexed.mzML')
+        strip_mzml_index(self.infile, self.nonindexed)
+
+    def test_indexed_equals_scanned(self):
+        self.assertFalse(spectrareader.get_mzml_spectrum_offsets(
+            self.nonindexed))
+        offsets = spectrareader.get_mzml_spectrum_offsets(self.infile)
+        self.assertEqual(len(offsets), 11)
+        indexed = list(spectrareader.generate_indexed_spectra_metadata(
+            self.infile, offsets))
+        scanned = list(spectrareader.generate_mzml_spectra_metadata(
+            self.nonindexed))
+        self.assertEqual(len(scanned), 11)
+        self.assertEqual(indexed, scanned)
+        self.assertEqual(
+            list(spectrareader.generate_mzml_ms2_spectra(self.infile)),
+            list(spectrareader.generate_mzml_ms2_spectra(self.nonindexed)))
+
+    def test_metadata_by_scan(self):
+        allspectra = {spec['scan']: spec for spec in
+                      spectrareader.generate_mzml_spectra_metadata(
+                          self.infile)}
+        scans = ['10002', '10009']
+        result = spectrareader.get_spectra_metadata_by_scan(
+            self.infile, [int(scan) for scan in scans])
+        self.assertEqual(result, [allspectra[scan] for scan in scans])
+
+    def test_spectrum_elements_by_scan(self):
+        ns = self.get_xml_namespace(self.infile)
+        expected = {}
+        for ac, spectrum in etree.iterparse(
+                self.infile, tag='{%s}spectrum' % ns['xmlns']):
+            expected[spectrum.attrib['id'].split('scan=')[1]] = etree.tostring(
+                spectrum, with_tail=False)
+        scans = ['10001', '10009']
+        result = list(spectrareader.generate_spectrum_elements_by_scan(
+            self.infile, scans))
+        self.assertEqual(len(result), 2)
+        for scan, spectrum in zip(scans, result):
+            self.assertEqual(spectrum.attrib['id'].split('scan=')[1], scan)
+            self.assertEqual(etree.tostring(spectrum, with_tail=False),
+                             expected[scan])
+
+    def test_by_scan_nonindexed(self):
+        with self.assertRaises(RuntimeError):
+            spectrareader.get_spectra_metadata_by_scan(self.nonindexed,
+                                                       [10002])
+
+
+def strip_mzml_index(fn, outfn):
+    """Writes the mzML element of an indexedmzML file to a new file"""
+    with open(fn, 'rb') as fp:
+        data = fp.read()
+    start = data.index(b'<mzML ')
+    end = data.index(b'</mzML>') + len(b'</mzML>')
+    with open(outfn, 'wb') as fp:
+        fp.write(b'<?xml version="1.0" encoding="utf-8"?>\n')
+        fp.write(data[start:end])
+
 
 class TestPSMLookup(basetests.MSLookupTest):
     command = 'psms'
@@ -290,6 +407,42 @@ class TestPSMLookupEnsemblBase(TestPSMLookup):
             self.assertEqual(aid, exp_proteins[prot]['symb'])
 
 
+class TestPSMLookupIntegerKeys(TestPSMLookup):
+    infilename = 'mzidtsv_filtered_fr1-2.txt'
+
+    def setUp(self):
+        super().setUp()
+        db = sqlite3.connect(self.resultfn)
+        db.executescript(
+            'CREATE TABLE intkey_mzml(spectra_id INTEGER PRIMARY KEY, '
+            'spectra_key TEXT, mzmlfile_id INTEGER, scan_nr TEXT, '
+            'charge INTEGER, mz DOUBLE, retention_time DOUBLE, '
+            'ion_injection_time DOUBLE);'
+            'INSERT INTO intkey_mzml(spectra_key, mzmlfile_id, scan_nr, '
+            'charge, mz, retention_time) SELECT spectra_id, mzmlfile_id, '
+            'scan_nr, charge, mz, retention_time FROM mzml;'
+            'DROP TABLE mzml;'
+            'ALTER TABLE intkey_mzml RENAME TO mzml;'
+            'CREATE INDEX spectra_key_index ON mzml(spectra_key);')
+        db.close()
+
+    def test_intkeys(self):
+        options = ['--spectracol', '2']
+        self.run_command(options)
+        self.check_db_base()
+        sql = ('SELECT typeof(p.psm_id), typeof(p.spectra_id), p.psm_key, '
+               'mf.mzmlfilename, sp.scan_nr FROM psms AS p '
+               'JOIN mzml AS sp USING(spectra_id) '
+               'JOIN mzmlfiles AS mf USING(mzmlfile_id)')
+        count = 0
+        for psmtype, spectype, psm_key, fn, scan in self.get_values_from_db(
+                self.resultfn, sql):
+            count += 1
+            self.assertEqual((psmtype, spectype), ('integer', 'integer'))
+            self.assertEqual(psm_key.split('_')[-2], scan)
+        self.assertNotEqual(count, 0)
+
+
 class TestPSMLookupEnsembl(TestPSMLookupEnsemblBase):
     infilename = 'mzidtsv_filtered_fr1-2.txt'
 
@@ -311,6 +464,14 @@ class TestPSMLookupEnsembl(TestPSMLookupEnsemblBase):
         self.run_command(options)
         self.check_db_map(fastafn, mapfn)
 
+    def test_fasta_map_bulkload(self):
+        fastafn = os.path.join(self.fixdir, 'ensembl.fasta')
+        mapfn = os.path.join(self.fixdir, 'biomart.map')
+        options = ['--spectracol', '2', '--fasta', fastafn, '--map', mapfn,
+                   '--bulkload']
+        self.run_command(options)
+        self.check_db_map(fastafn, mapfn)
+
     def test_newversion_fasta_map(self):
         fastafn = os.path.join(self.fixdir, 'ensembl.fasta')
         mapfn = os.path.join(self.fixdir, 'new_biomart.map')
@@ -448,6 +609,38 @@ class TestMS1KronikLookup(basetests.MSLookupTest):
                    '--mztoltype', 'ppm', '--spectra', self.fakespfn]
         self.run_command(options)
         self.check_feats_stored()
+        self.check_alignments(5, 20)
+
+    def test_kronik_workers(self):
+        self.fakespfn = os.path.join(self.workdir, 'task_0_dataset_17694.dat')
+        options = ['--quanttype', 'kronik', '--rttol', '5', '--mztol', '0.01',
+                   '--mztoltype', 'Da', '--spectra', self.fakespfn,
+                   '--workers', '2']
+        self.run_command(options)
+        self.check_alignments(5, 0.01, ppm=False)
+
+    def check_alignments(self, rttol, mztol, ppm=True):
+        featsql = ('SELECT feature_id, mzmlfile_id, charge, mz, '
+                   'retention_time FROM ms1_quant')
+        feats = list(self.get_values_from_db(self.resultfn, featsql))
+        specsql = ('SELECT spectra_id, mzmlfile_id, charge, mz, '
+                   'retention_time FROM mzml')
+        expected = {}
+        for spec_id, fn_id, charge, mz, rt in self.get_values_from_db(
+                self.resultfn, specsql):
+            tol = mztol * mz / 1000000 if ppm else mztol
+            candidates = [(abs(f_mz - mz), f_id)
+                          for f_id, f_fn, f_ch, f_mz, f_rt in feats
+                          if f_fn == fn_id and f_ch == charge and
+                          abs(f_mz - mz) <= tol and
+                          abs(f_rt - rt) <= rttol / 60]
+            if candidates:
+                expected[spec_id] = min(candidates)[1]
+        sql = 'SELECT spectra_id, feature_id FROM ms1_align'
+        result = {x[0]: x[1] for x in self.get_values_from_db(self.resultfn,
+                                                              sql)}
+        self.assertNotEqual(expected, {})
+        self.assertEqual(result, expected)
 
     def check_feats_stored(self):
         PROTON_MASS = 1.0072
@@ -493,6 +686,13 @@ class TestProteingroupLookup(basetests.MSLookupTest):
         self.check_pg_content()
         self.check_psm_protein_group()
 
+    def test_proteingroup_workers(self):
+        self.run_command(['--workers', '3'])
+        self.check_pgmasters()
+        self.check_coverage()
+        self.check_pg_content()
+        self.check_psm_protein_group()
+
     def check(self, sql, keyfun, valfun):
         exp_file = os.path.join(self.fixdir, 'mzidtsv_db.sqlite')
         result = {keyfun(x): valfun(x) for x in
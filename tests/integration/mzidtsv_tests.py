@@ -1,8 +1,14 @@
 import os
+import gzip
+import zlib
+import shutil
+import subprocess
 from lxml import etree
 from statistics import median
 
 from app.dataformats import mzidtsv as constants
+from app.readers import tsv as tsvreader
+from app.writers.multifile import MultiFileWriter
 from tests.integration import basetests
 
 
@@ -136,6 +142,39 @@ class TestMergeTSV(basetests.MzidTSVBaseTest):
             for line in self.get_all_lines(expectfn):
                 self.assertEqual(line, next(resultlines))
 
+    def test_mergetsv_compressed(self):
+        gzipped_infile = os.path.join(self.workdir, self.infilename + '.gz')
+        with open(self.infile, 'rb') as fp, gzip.open(gzipped_infile,
+                                                      'wb') as gzfp:
+            shutil.copyfileobj(fp, gzfp)
+        self.infile = [gzipped_infile, os.path.join(self.fixdir,
+                                                    'mzidtsv_fr1.txt')]
+        self.resultfn = None
+        self.run_command(['--compress', 'gzip'])
+        resultfn = os.path.join(self.workdir,
+                                self.infilename + self.suffix + '.gz')
+        with gzip.open(resultfn, 'rt') as fp:
+            next(fp)
+            resultlines = [line for line in fp]
+        expectlines = [line for fn in [os.path.join(self.fixdir, fn) for fn in
+                                       [self.infilename, 'mzidtsv_fr1.txt']]
+                       for line in self.get_all_lines(fn)]
+        self.assertEqual(expectlines, resultlines)
+
+    def test_mergetsv_no_trailing_newline(self):
+        infile = os.path.join(self.workdir, self.infilename)
+        with open(self.infile) as fp, open(infile, 'w') as wfp:
+            wfp.write(fp.read().rstrip('\n'))
+        self.infile = [infile, os.path.join(self.fixdir, 'mzidtsv_fr1.txt')]
+        self.run_command_patched([('app.actions.mzidtsv.splitmerge',
+                                   'MERGE_COPY_CHUNK', 1000)])
+        resultlines = self.get_all_lines(self.resultfn)
+        for expectfn in [os.path.join(self.fixdir, self.infilename),
+                         self.infile[1]]:
+            for line in self.get_all_lines(expectfn):
+                self.assertEqual(line, next(resultlines))
+        self.assertEqual(list(resultlines), [])
+
 
 class TestSplitTSV(basetests.MzidTSVBaseTest):
     infilename = 'mzidtsv_filtered_fr1-2.txt'
@@ -164,6 +203,72 @@ class TestSplitTSV(basetests.MzidTSVBaseTest):
             for line in self.get_all_lines(resultfn):
                 self.assertEqual(line, next(self.expectlines))
 
+    def write_small_table(self):
+        self.infile = os.path.join(self.workdir, 'small.tsv')
+        with open(self.infile, 'w') as fp:
+            fp.write('Set\tPeptide\tPool\n s1\tIAMAPEPTIDE\tp1\n'
+                     's2\tPEPTIDE\tp2\ns1\tALSOPEPTIDE\tp1')
+
+    def check_small_table_split(self, expected):
+        for pool, lines in expected.items():
+            resultfn = os.path.join(self.workdir, '{}.tsv'.format(pool))
+            self.assertEqual(list(self.get_all_lines(resultfn)), lines)
+
+    def test_splitcol_first_column(self):
+        """Split values in the first column have surrounding whitespace
+        stripped, and a last line without newline gets one"""
+        self.write_small_table()
+        self.run_command(['--splitcol', '1'])
+        self.check_small_table_split({
+            's1': [' s1\tIAMAPEPTIDE\tp1\n', 's1\tALSOPEPTIDE\tp1\n'],
+            's2': ['s2\tPEPTIDE\tp2\n']})
+
+    def test_splitcol_last_column(self):
+        self.write_small_table()
+        self.run_command(['--splitcol', '3'])
+        self.check_small_table_split({
+            'p1': [' s1\tIAMAPEPTIDE\tp1\n', 's1\tALSOPEPTIDE\tp1\n'],
+            'p2': ['s2\tPEPTIDE\tp2\n']})
+
+
+class TestMultiFileWriter(basetests.MzidTSVBaseTest):
+    infilename = 'mzidtsv_filtered_fr1-2.txt'
+    suffix = ''
+
+    def test_reopen_files(self):
+        """Writes to more files than can be open, with small buffers, so
+        files are closed and reopened for appending, which for gzip output
+        adds a gzip member per reopening"""
+        fns = [os.path.join(self.workdir, 'out{}.tsv{}'.format(nr, ext))
+               for nr in range(4) for ext in ['', '.gz']]
+        expected = {fn: [] for fn in fns}
+        with open(self.infile, 'rb') as fp, MultiFileWriter(
+                max_open=3, buffer_size=500,
+                total_buffer_size=2000) as writer:
+            for nr, line in enumerate(fp):
+                fn = fns[nr % len(fns)]
+                writer.write(fn, line)
+                expected[fn].append(line)
+        for fn in fns:
+            if fn.endswith('.gz'):
+                with gzip.open(fn) as fp:
+                    self.assertEqual(fp.read(), b''.join(expected[fn]))
+                self.assertGreater(self.count_gzip_members(fn), 1)
+            else:
+                with open(fn, 'rb') as fp:
+                    self.assertEqual(fp.read(), b''.join(expected[fn]))
+
+    def count_gzip_members(self, fn):
+        with open(fn, 'rb') as fp:
+            data = fp.read()
+        members = 0
+        while data:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            decompressor.decompress(data)
+            data = decompressor.unused_data
+            members += 1
+        return members
+
 
 class TestConffiltTSV(basetests.MzidTSVBaseTest):
     command = 'conffilt'
@@ -182,9 +287,26 @@ class TestConffiltTSV(basetests.MzidTSVBaseTest):
         conflvl = 0
         self.run_conffilt(conflvl, 'higher', confcol=14)
 
-    def run_conffilt(self, conflvl, better, confcol=False, confpat=False):
+    def test_confidence_filter_workers(self):
+        conflvl = 0
+        self.run_conffilt(conflvl, 'lower', confcol=14,
+                          options=['--workers', '2'])
+
+    def test_confidence_filter_workers_chunks(self):
+        chunksize = 5000
+        self.assertGreater(len(tsvreader.get_tsv_chunk_ranges(
+            self.infile, chunksize)), 10)
+        options = ['--confidence-better', 'lower', '--confidence-lvl', '1',
+                   '--confidence-col', '14']
+        lines = self.run_workers_chunked(options, chunksize)
+        self.assertGreater(len(lines), 10)
+        for line in lines[1:]:
+            self.assertLess(float(line.strip('\n').split('\t')[13]), 1)
+
+    def run_conffilt(self, conflvl, better, confcol=False, confpat=False,
+                     options=[]):
         options = ['--confidence-better', better,
-                   '--confidence-lvl', str(conflvl)]
+                   '--confidence-lvl', str(conflvl)] + options
         if confcol is not False:
             options.extend(['--confidence-col', str(confcol)])
         elif confpat:
@@ -209,6 +331,62 @@ class TestConffiltTSV(basetests.MzidTSVBaseTest):
         self.run_command_expect_error(options)
 
 
+class TestPipelineTSV(basetests.MzidTSVBaseTest):
+    command = 'pipeline'
+    infilename = 'mzidtsv_filtered_fr1-2_nospecdata.txt'
+    suffix = '_pipeline.tsv'
+
+    def write_recipe(self, steps):
+        recipe = os.path.join(self.workdir, 'recipe.yml')
+        with open(recipe, 'w') as fp:
+            for step in steps:
+                fp.write('- {}\n'.format(' '.join(step)))
+        return recipe
+
+    def check_pipeline(self, steps):
+        self.run_command(['--recipe', self.write_recipe(steps)])
+        stepfn = os.path.join(self.fixdir, self.infilename)
+        for nr, step in enumerate(steps):
+            outfn = os.path.join(self.workdir, 'step{}.tsv'.format(nr))
+            subprocess.check_call([self.executable] + step[:1] +
+                                  ['-i', stepfn, '-o', outfn] + step[1:])
+            stepfn = outfn
+        with open(stepfn) as expectfp, open(self.resultfn) as fp:
+            self.assertEqual(expectfp.read(), fp.read())
+
+    def test_pipeline(self):
+        self.check_pipeline([
+            ['specdata', '--dbfile', self.dbfile, '--spectracol', '2'],
+            ['proteingroup', '--dbfile', self.dbfile],
+            ['genes', '--dbfile', self.dbfile]])
+
+    def test_pipeline_conffilt_last(self):
+        self.check_pipeline([
+            ['specdata', '--dbfile', self.dbfile, '--spectracol', '2'],
+            ['quant', '--dbfile', self.dbfile, '--isobaric'],
+            ['conffilt', '--confcolpattern', 'EValue',
+             '--confidence-lvl', '1e-8', '--confidence-better', 'lower']])
+
+    def test_pipeline_conffilt_before_rownr_steps(self):
+        conffilt = ['conffilt', '--confcolpattern', 'EValue',
+                    '--confidence-lvl', '0.001', '--confidence-better',
+                    'lower']
+        for step in [['specdata', '--dbfile', self.dbfile, '--spectracol',
+                      '2'],
+                     ['quant', '--dbfile', self.dbfile, '--isobaric'],
+                     ['proteingroup', '--dbfile', self.dbfile]]:
+            recipe = self.write_recipe([conffilt, step])
+            self.run_command_expect_error(['--recipe', recipe])
+            self.assertFalse(os.path.exists(self.resultfn))
+
+    def test_pipeline_step_output_options(self):
+        for option in [['--workers', '2'], ['-o', 'out.tsv'],
+                       ['--compress', 'gzip']]:
+            recipe = self.write_recipe([['genes', '--dbfile', self.dbfile] +
+                                        option])
+            self.run_command_expect_error(['--recipe', recipe])
+
+
 class TestProteinGroup(basetests.MzidTSVBaseTest):
     command = 'proteingroup'
     infilename = 'mzidtsv_filtered_fr1-2.txt'
@@ -282,6 +460,14 @@ class TestAddGenes(basetests.MzidTSVBaseTest):
                                        [genes, assoc_ids, descriptions]):
                 self.assertEqual(0, len(exp_set.difference(result)))
 
+    def test_addgenes_workers_chunks(self):
+        chunksize = 5000
+        self.assertGreater(len(tsvreader.get_tsv_chunk_ranges(
+            self.infile, chunksize)), 10)
+        inlines = list(self.get_all_lines(self.infile))
+        lines = self.run_workers_chunked(['--dbfile', self.dbfile], chunksize)
+        self.assertEqual(len(lines), len(inlines) + 1)
+
 
 class TestIso(basetests.MzidTSVBaseTest):
 
@@ -299,7 +485,7 @@ class TestIso(basetests.MzidTSVBaseTest):
                 yield {field: val for field, val in zip(header, line)}
 
     def check_normalize_medians(self, channels, denom_ch, minint, stdout,
-                                medianpsms):
+                                medianpsms, single=False):
         ch_medians = {ch: [] for ch in channels}
         for line in self.get_infile_lines(medianpsms):
             line.update({ch: line[ch]
@@ -319,11 +505,17 @@ class TestIso(basetests.MzidTSVBaseTest):
         stdout_channels = {x.split(' - ')[0]: x.split(' - ')[1]
                            for x in stdout[1:]}
         for ch in channels:
-            self.assertEqual(float(stdout_channels[ch]), ch_medians[ch])
+            if single:
+                self.assertAlmostEqual(float(stdout_channels[ch]) /
+                                       ch_medians[ch], 1, places=5)
+            else:
+                self.assertEqual(float(stdout_channels[ch]), ch_medians[ch])
         return ch_medians
 
     def do_check(self, minint, stdout, normalize=False, medianpsms=None,
-                 resultch=False):
+                 resultch=False, single=False):
+        """Checks output ratios, if single is True the output is single
+        precision and compared with a tolerance"""
         channels = ['fake_ch{}'.format(x) for x in range(8)]
         # TODO only for backwards compatibilty, remove if statement around
         # assignment when msspsmtable isonormalize is removed
@@ -333,7 +525,7 @@ class TestIso(basetests.MzidTSVBaseTest):
         if normalize:
             ch_medians = self.check_normalize_medians(channels, denom_ch,
                                                       minint, stdout,
-                                                      medianpsms)
+                                                      medianpsms, single)
         for in_line, resultline in zip(self.get_infile_lines(),
                                        self.get_values(resultch)):
             in_line.update({ch: in_line[ch]
@@ -352,7 +544,15 @@ class TestIso(basetests.MzidTSVBaseTest):
                 exp_line = [str((float(in_line[ch]) / denom))
                             if in_line[ch] != 'NA' else 'NA'
                             for ch in channels]
-            self.assertEqual(resultline, exp_line)
+            if single:
+                self.assertEqual([x == 'NA' for x in resultline],
+                                 [x == 'NA' for x in exp_line])
+                for result, exp in zip(resultline, exp_line):
+                    if exp != 'NA':
+                        self.assertAlmostEqual(float(result) / float(exp), 1,
+                                               places=5)
+            else:
+                self.assertEqual(resultline, exp_line)
 
 
 class TestIsoRatio(TestIso):
@@ -370,6 +570,28 @@ class TestIsoRatio(TestIso):
                                           '--denompatterns', '_ch[0-1]'])
         self.do_check(0, stdout)
 
+    def test_denomcolpattern_normalize(self):
+        stdout = self.run_command_stdout(['--isobquantcolpattern', 'fake_ch',
+                                          '--denompatterns', '_ch0', '_ch1',
+                                          '--normalize', 'median'])
+        self.do_check(0, stdout, normalize=True)
+
+    def test_denomcolpattern_workers_chunks(self):
+        chunksize = 300
+        self.assertGreater(len(tsvreader.get_tsv_chunk_ranges(
+            self.infile, chunksize)), 3)
+        self.run_workers_chunked(['--isobquantcolpattern', 'fake_ch',
+                                  '--denompatterns', '_ch0', '_ch1'],
+                                 chunksize)
+        self.do_check(0, b'')
+
+    def test_denomcolpattern_lowmemory(self):
+        stdout = self.run_command_stdout(['--isobquantcolpattern', 'fake_ch',
+                                          '--denompatterns', '_ch0', '_ch1',
+                                          '--normalize', 'median',
+                                          '--lowmemory'])
+        self.do_check(0, stdout, normalize=True, single=True)
+
 
 class TestIsoFeatRatio(TestIso):
     suffix = '_ratio_isobaric.txt'
@@ -430,6 +652,15 @@ class TestIsoNormalize(TestIso):
                                           '--minint', str(minint)])
         self.do_check(minint, stdout, normalize=True, resultch=self.channels)
 
+    def test_normalize_lowmemory(self):
+        minint = 3000
+        stdout = self.run_command_stdout(['--isobquantcolpattern', 'fake_ch',
+                                          '--denomcols', '21', '22',
+                                          '--minint', str(minint),
+                                          '--lowmemory'])
+        self.do_check(minint, stdout, normalize=True, resultch=self.channels,
+                      single=True)
+
 
 class TestIsoNormalizeTwofiles(TestIso):
     infilename = 'mzidtsv_short.txt'
@@ -1,10 +1,27 @@
 import os
+import re
+import gzip
+import shutil
 import sqlite3
+import subprocess
 from itertools import product
+from lxml import etree
+import numpy as np
 
+from app.readers import xml as xmlreader
+from app.actions.pycolator import reassign, parallel
 from tests.integration.basetests import BaseTestPycolator
 
 
+def count_xml_chunks(fn, feattypes, chunksize):
+    orig_chunksize = parallel.XML_CHUNK_SIZE
+    parallel.XML_CHUNK_SIZE = chunksize
+    try:
+        return len(list(parallel.generate_raw_chunks(fn, feattypes)))
+    finally:
+        parallel.XML_CHUNK_SIZE = orig_chunksize
+
+
 class TestReassign(BaseTestPycolator):
     command = 'reassign'
     suffix = '_reassigned.xml'
@@ -57,6 +74,54 @@ class TestReassign(BaseTestPycolator):
             self.assertEqual(rpep, mapvals[0])
 
 
+class TestQvalityLookup(BaseTestPycolator):
+    suffix = ''
+
+    def write_qvality(self, lines):
+        fn = os.path.join(self.workdir, 'qvality.txt')
+        with open(fn, 'w') as fp:
+            fp.write('Score\tPEP\tq-value\n')
+            for line in lines:
+                fp.write('{}\n'.format('\t'.join(line)))
+        return fn
+
+    def get_stats(self):
+        # Score 2 is in the table twice, its last statistics are used
+        return reassign.parse_qvality_output(self.write_qvality([
+            ['4', '0.01', '0.001'], ['2', '0.1', '0.01'],
+            ['2', '1.2e-01', '1.5e-02'], ['0', '0.5', '0.2'],
+            ['-1.5', '0.9', '0.6']]))
+
+    def test_lookup_statistic(self):
+        stats = self.get_stats()
+        expected = {
+            2: ('1.5e-02', '1.2e-01', None),
+            0: ('0.2', '0.5', None),
+            -2: ('1', '1', reassign.LOWER_SCORE_WARNING),
+            5: ('0.001', '0.01', reassign.HIGHER_SCORE_WARNING),
+            3: (str((0.015 + 0.001) / 2), str((0.12 + 0.01) / 2), None),
+            # Score 0 is the nearest lower score and used to interpolate
+            1: (str((0.015 + 0.2) / 2), str((0.12 + 0.5) / 2), None),
+            -1: (str((0.2 + 0.6) / 2), str((0.5 + 0.9) / 2), None),
+        }
+        for score, exp in expected.items():
+            self.assertEqual(reassign.lookup_statistic(score, stats), exp)
+        scores = list(expected) + [3.99999, -1.5, 4]
+        self.assertEqual(
+            list(zip(*reassign.lookup_statistics(scores, stats))),
+            [reassign.lookup_statistic(score, stats) for score in scores])
+
+    def test_empty_qvality(self):
+        with self.assertRaises(RuntimeError):
+            reassign.parse_qvality_output(self.write_qvality([]))
+        stats = {'score': np.array([]), 'q': np.array([]),
+                 'PEP': np.array([]), 'qtext': [], 'PEPtext': []}
+        with self.assertRaises(RuntimeError):
+            reassign.lookup_statistic(1, stats)
+        with self.assertRaises(RuntimeError):
+            reassign.lookup_statistics([1], stats)
+
+
 class TestSplit(BaseTestPycolator):
     def setUp(self):
         super().setUp()
@@ -104,6 +169,15 @@ class TestSplitProteinHeader(TestSplit):
                 self.assertIn(el.find('{%s}protein_id' % ns['xmlns']).text[:6],
                               ['decoy_', 'random'])
 
+    def test_splitprotein_workers_chunks(self):
+        # PSMs and peptides are split in one pass, of a chunk per element
+        self.assertGreater(count_xml_chunks(self.infile, ['psm', 'peptide'],
+                                            1), 4)
+        self.run_workers_chunked(
+            ['--protheaders', 'ENSP', 'random;decoy'],
+            [os.path.join(self.workdir, self.infilename + '_h{}.xml'.format(
+                nr)) for nr in range(2)])
+
 
 class TestSplitTD(TestSplit):
     command = 'splittd'
@@ -130,6 +204,40 @@ class TestSplitTD(TestSplit):
                 self.assertEqual(
                     el.attrib['{%s}decoy' % d_contents['ns']], 'true')
 
+    def test_splittd_workers(self):
+        target_result = os.path.join(self.workdir,
+                                     self.infilename + '_target.xml')
+        decoy_result = os.path.join(self.workdir,
+                                    self.infilename + '_decoy.xml')
+        self.run_command(['--workers', '2'])
+        self.do_check('splittd_target_out.xml', 'splittd_decoy_out.xml',
+                      target_result, decoy_result)
+
+    def test_splittd_workers_chunks(self):
+        # Chunks of a few elements of both types
+        self.assertGreater(count_xml_chunks(self.infile, ['psm', 'peptide'],
+                                            1000), 4)
+        self.run_workers_chunked([], [
+            os.path.join(self.workdir, self.infilename + '_{}.xml'.format(
+                td)) for td in ['target', 'decoy']], chunksize=1000)
+
+    def test_splittd_compressed(self):
+        self.infile = os.path.join(self.workdir, self.infilename + '.gz')
+        with open(os.path.join(self.fixdir, self.infilename), 'rb') as fp, \
+                gzip.open(self.infile, 'wb') as gzfp:
+            shutil.copyfileobj(fp, gzfp)
+        self.run_command(['--compress', 'gzip'])
+        target_result = os.path.join(self.workdir,
+                                     self.infilename + '_target.xml')
+        decoy_result = os.path.join(self.workdir,
+                                    self.infilename + '_decoy.xml')
+        for result in [target_result, decoy_result]:
+            with gzip.open(result + '.gz', 'rb') as gzfp, \
+                    open(result, 'wb') as fp:
+                shutil.copyfileobj(gzfp, fp)
+        self.do_check('splittd_target_out.xml', 'splittd_decoy_out.xml',
+                      target_result, decoy_result)
+
 
 class TestMerge(BaseTestPycolator):
     command = 'merge'
@@ -174,6 +282,20 @@ class TestMerge(BaseTestPycolator):
                               self.get_element_ids(result['peptides'],
                                                    'peptide_id', result['ns']))
 
+    def test_merge_peptide_without_psm_ids(self):
+        infile = os.path.join(self.workdir, self.infilename)
+        with open(self.infile, 'rb') as fp, open(infile, 'wb') as wfp:
+            wfp.write(re.sub(rb'<psm_ids>.*?</psm_ids>', b'', fp.read(),
+                             count=1, flags=re.DOTALL))
+        self.infile = [os.path.join(self.fixdir, 'splittd_decoy_out.xml'),
+                       infile]
+        cmd = self.get_std_options()
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        output = cm.exception.output.decode()
+        self.assertIn('RuntimeError', output)
+        self.assertIn(infile, output)
+
 
 class TestFilterUnique(BaseTestPycolator):
     command = 'filteruni'
@@ -229,6 +351,11 @@ class TestFilterLength(BaseTestPycolator):
         self.all_peps_in_output(origin['psm_seqs'], minlen, maxlen,
                                 result['psm_seqs'])
 
+    def test_filterlen_workers_chunks(self):
+        self.assertGreater(count_xml_chunks(self.infile, ['psm'], 1), 4)
+        self.run_workers_chunked(['--maxlen', '20', '--minlen', '10'],
+                                 [self.resultfn])
+
 
 class TestFilterKnown(BaseTestPycolator):
     command = 'filterseq'
@@ -250,6 +377,15 @@ class TestFilterKnown(BaseTestPycolator):
         self.dbpath = os.path.join(self.fixdir, self.dbfn)
         self.assert_seqs_correct(['--deamidate'], 'deamidate')
 
+    def test_workers(self):
+        self.dbpath = os.path.join(self.fixdir, self.dbfn)
+        self.assert_seqs_correct(['--workers', '2'])
+
+    def test_workers_chunks(self):
+        self.run_workers_chunked(['--dbfile', os.path.join(
+            self.fixdir, self.reversed_dbfn), '--insourcefrag', '12',
+            '--deamidate'], [self.resultfn])
+
     def deamidate(self, sequence):
         aa_possible = [(aa,) if aa != 'D' else ('D', 'N') for aa in sequence]
         return list(''.join(aa) for aa in product(*aa_possible))
@@ -279,6 +415,29 @@ class TestFilterKnown(BaseTestPycolator):
                         self.assertIn(oriseq, result_seqs)
 
 
+class TestFilterProtein(BaseTestPycolator):
+    command = 'filterprot'
+    suffix = '_filtprot.xml'
+
+    def setUp(self):
+        super().setUp()
+        self.fasta = os.path.join(self.fixdir, 'ensembl.fasta')
+        self.dbpath = os.path.join(self.workdir, 'mslookup_db.sqlite')
+        subprocess.check_call(['msslookup', 'protspace', '-i', self.fasta,
+                               '--minlen', '7'], cwd=self.workdir)
+
+    def test_workers_chunks(self):
+        """Filters with workers, which get the FASTA proteins and the
+        lookup passed once, and compares to filtering serially"""
+        options = ['--dbfile', self.dbpath, '--fasta', self.fasta,
+                   '--minlen', '7']
+        self.run_workers_chunked(options, [self.resultfn])
+        result = self.get_psm_pep_ids_from_file(self.resultfn)
+        origin = self.get_psm_pep_ids_from_file(self.infile[0])
+        self.assertGreater(len(result['psm_ids']), 0)
+        self.assertLess(len(result['psm_ids']), len(origin['psm_ids']))
+
+
 class TestQvality(BaseTestPycolator):
     command = 'qvality'
     suffix = '_qvalityout.txt'
@@ -289,3 +448,89 @@ class TestQvality(BaseTestPycolator):
         self.decoy = os.path.join(self.fixdir, self.decoyfn)
         #options = ['--decoyfn', self.decoy, '--feattype', 'blaja', ]
         self.fail('pycolator qvality integration testing not implemented yet')
+
+
+class TestRawXMLTags(BaseTestPycolator):
+    suffix = ''
+
+    def get_raw_tags(self, fn, returntags, chunksize, with_elements=False):
+        orig_chunksize = xmlreader.RAW_READ_CHUNK
+        xmlreader.RAW_READ_CHUNK = chunksize
+        try:
+            if with_elements:
+                return list(xmlreader.generate_xmltags_with_raw(fn,
+                                                                returntags))
+            return list(xmlreader.generate_raw_xmltags(fn, returntags))
+        finally:
+            xmlreader.RAW_READ_CHUNK = orig_chunksize
+
+    def write_xml(self, xml):
+        fn = os.path.join(self.workdir, 'test.xml')
+        with open(fn, 'wb') as fp:
+            fp.write(xml)
+        return fn
+
+    def test_raw_equals_parsed(self):
+        ns = xmlreader.get_namespace(self.infile)
+        feattypes = ['psm', 'peptide']
+        # Percolator output has all PSMs before all peptides
+        contents = self.read_percolator_out(self.infile)
+        parsed = [(tag, etree.tostring(el, with_tail=False))
+                  for tag in feattypes for el in contents[tag + 's']]
+        wrapper = '<root {}>{{}}</root>'.format(' '.join(
+            '{}="{}"'.format(*decl) for decl in ns.items())).encode()
+        expected_raws = self.get_raw_tags(self.infile, feattypes, 1048576)
+        for chunksize in [1, 2, 3, 5, 8, 13, 64, 100, 1000]:
+            raws = self.get_raw_tags(self.infile, feattypes, chunksize)
+            self.assertEqual(raws, expected_raws)
+            self.assertEqual(len(parsed), len(raws))
+            for (tag, el), (rawtag, raw) in zip(parsed, raws):
+                self.assertEqual(tag, rawtag)
+                rawel = etree.fromstring(wrapper.replace(b'{}', raw))[0]
+                self.assertEqual(el, etree.tostring(rawel, with_tail=False))
+            elements = self.get_raw_tags(self.infile, feattypes, chunksize,
+                                         with_elements=True)
+            self.assertEqual([(tag, etree.tostring(el, with_tail=False))
+                              for tag, el, raw in elements], parsed)
+            self.assertEqual([(tag, raw) for tag, el, raw in elements],
+                             expected_raws)
+
+    def test_self_closing(self):
+        fn = self.write_xml(b'<root><psms><psm id="1"/>\n  <psm id="2" />\n'
+                            b'  <psm_other/><psm id="3"><a/></psm></psms>\n'
+                            b'<psm id="5" a="/>"/><psm id="6"></psm>\n'
+                            b'<peptide id="4"><psm_ids/></peptide></root>')
+        expected = [('psm', b'<psm id="1"/>\n  '),
+                    ('psm', b'<psm id="2" />\n  '),
+                    ('psm', b'<psm id="3"><a/></psm>'),
+                    ('psm', b'<psm id="5" a="/>"/>'),
+                    ('psm', b'<psm id="6"></psm>\n'),
+                    ('peptide', b'<peptide id="4"><psm_ids/></peptide>')]
+        for chunksize in [1, 2, 7, 1000]:
+            self.assertEqual(self.get_raw_tags(fn, ['psm', 'peptide'],
+                                               chunksize), expected)
+
+    def test_markup_in_comments_prefixes_nesting(self):
+        """Tags in comments and CDATA are not elements, prefixed tags are
+        matched on local name, and nested elements are output as part of
+        the element they are in"""
+        fn = self.write_xml(
+            b'<root xmlns="urn:a" xmlns:p="urn:b"><!-- <psm id="0"> -->\n'
+            b'<psm id="1"><![CDATA[</psm><psm>]]></psm>\n'
+            b'<p:psm id="2"><psm id="3"/></p:psm> <other/></root>')
+        expected = [('psm', b'<psm id="1"><![CDATA[</psm><psm>]]></psm>\n'),
+                    ('psm', b'<p:psm id="2"><psm id="3"/></p:psm> ')]
+        for chunksize in [1, 3, 1000]:
+            self.assertEqual(self.get_raw_tags(fn, ['psm'], chunksize),
+                             expected)
+            elements = self.get_raw_tags(fn, ['psm'], chunksize,
+                                         with_elements=True)
+            self.assertEqual([el.tag for tag, el, raw in elements],
+                             ['{urn:a}psm', '{urn:b}psm'])
+            self.assertEqual(elements[0][1].text, '</psm><psm>')
+
+    def test_unclosed(self):
+        fn = self.write_xml(b'<root><psm id="1"></psm><psm id="2"><a/>')
+        for chunksize in [1, 3, 1000]:
+            with self.assertRaises(RuntimeError):
+                self.get_raw_tags(fn, ['psm'], chunksize)